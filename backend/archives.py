@@ -0,0 +1,286 @@
+import io
+import json
+import time
+import hashlib
+import logging
+import tarfile
+import zipfile
+import tempfile
+import shutil
+from catalog import UPLOADS, TRASH
+from batch import OperationError, check_name
+from chunked_uploads import COPY_BUFFER
+
+FORMATS = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+CONTENT_TYPES = {
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip',
+    'application/x-tar': 'tar',
+    'application/gzip': 'tar',
+    'application/x-gzip': 'tar',
+    'application/x-gtar': 'tar',
+}
+SUFFIXES = (('.zip', 'zip'), ('.tar', 'tar'), ('.tar.gz', 'tar'), ('.tgz', 'tar'))
+# First in every export, so an import can check each file as it arrives.
+MANIFEST = 'manifest.json'
+# Last in an export whose files could not all be read.
+ERRORS = 'errors.json'
+MANIFEST_VERSION = 1
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class ArchiveError(OperationError):
+    pass
+
+
+def detect_format(requested=None, content_type=None, filename=None):
+    if requested:
+        if requested not in FORMATS:
+            raise ArchiveError(f"format must be one of {', '.join(FORMATS)}")
+        return requested
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    for suffix, fmt in SUFFIXES:
+        if filename and filename.lower().endswith(suffix):
+            return fmt
+    raise ArchiveError("Cannot tell the archive format; pass format=zip or format=tar")
+
+
+def archive_path(row):
+    return f"{row['location']}/{row['name']}"
+
+
+def parse_path(path, into=None):
+    """(location, name) for an archive member.
+
+    Exports put files under uploads/ and trash/; a file at the top level of
+    any other archive goes to uploads. `into` overrides the location.
+    """
+    parts = path.strip('/').split('/')
+    if len(parts) == 2 and parts[0] in (UPLOADS, TRASH):
+        location, name = parts
+    elif len(parts) == 1:
+        location, name = UPLOADS, parts[0]
+    else:
+        raise ArchiveError(f"{path} is in a folder; only uploads/ and trash/ can be imported")
+    return into or location, check_name(name)
+
+
+def manifest(rows, created_at=None):
+    return {
+        "version": MANIFEST_VERSION,
+        "created_at": created_at or time.time(),
+        "files": [{
+            "path": archive_path(row),
+            "location": row["location"],
+            "name": row["name"],
+            "size": row["size"],
+            "sha256": row["sha256"],
+            "mtime": row["mtime"],
+            "deleted_at": row["deleted_at"],
+        } for row in rows],
+    }
+
+
+def read_manifest(stream):
+    # Manifest entries by path; an unreadable manifest only loses the checks.
+    try:
+        data = json.load(stream)
+        return {entry["path"]: entry for entry in data.get("files", []) if isinstance(entry, dict) and "path" in entry}
+    except (ValueError, KeyError, AttributeError, TypeError) as e:
+        logging.warning(f"Ignoring an unreadable archive manifest: {e}")
+        return {}
+
+
+class _ShortRead(Exception):
+    pass
+
+
+class _Sink:
+    # Collects what an archive writer writes, for the response to send on.
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def export_archive(rows, fmt, open_row, deflate=False):
+    """Yield a zip or tar of rows while it is written, without temporary files.
+
+    manifest.json comes first, with each file's size and the SHA-256 the
+    catalog recorded for it. open_row returns a readable stream over a row's
+    bytes. Files that cannot be read, or that do not match their checksum,
+    are listed in a trailing errors.json; a member cut short is padded with
+    zeros so the rest of the archive stays readable.
+    """
+    sink = _Sink()
+    errors = []
+    writer = _ZipWriter(sink, deflate) if fmt == 'zip' else _TarWriter(sink)
+    body = json.dumps(manifest(rows), indent=1).encode()
+    yield from writer.add(MANIFEST, len(body), time.time(), io.BytesIO(body), hashlib.sha256())
+
+    for row in rows:
+        path = archive_path(row)
+        try:
+            src = open_row(row)
+        except Exception as e:
+            logging.error(f"Could not export {path}: {e}")
+            errors.append({"path": path, "error": str(e)})
+            continue
+        hasher = hashlib.sha256()
+        try:
+            with src:
+                yield from writer.add(path, row["size"], row["mtime"], src, hasher)
+        except _ShortRead as e:
+            logging.error(f"Could not export {path}: {e}")
+            errors.append({"path": path, "error": str(e)})
+            continue
+        if row["sha256"] and hasher.hexdigest() != row["sha256"]:
+            logging.error(f"Exported {path} does not match its checksum")
+            errors.append({"path": path, "error": "Content does not match its checksum"})
+
+    if errors:
+        body = json.dumps({"errors": errors}, indent=1).encode()
+        yield from writer.add(ERRORS, len(body), time.time(), io.BytesIO(body), hashlib.sha256())
+    yield from writer.close()
+
+
+def _copy(src, dest, size, hasher, sink):
+    # Copies exactly size bytes, yielding the archive as it grows. A file that
+    # ends early is padded with zeros so the sizes already written still hold.
+    remaining = size
+    error = None
+    try:
+        while remaining > 0:
+            data = src.read(min(COPY_BUFFER, remaining))
+            if not data:
+                error = f"File ended after {size - remaining} of its {size} bytes"
+                break
+            hasher.update(data)
+            dest.write(data)
+            remaining -= len(data)
+            yield sink.drain()
+        else:
+            if src.read(1):
+                error = f"File is larger than the {size} bytes recorded for it"
+    except Exception as e:
+        error = f"Read failed after {size - remaining} of {size} bytes: {e}"
+    while remaining > 0:
+        pad = min(COPY_BUFFER, remaining)
+        dest.write(bytes(pad))
+        remaining -= pad
+    if error:
+        raise _ShortRead(error)
+
+
+class _ZipWriter:
+
+    def __init__(self, sink, deflate):
+        self.sink = sink
+        # An unseekable file makes zipfile write sizes and CRCs after each
+        # member instead of seeking back to its header.
+        self.archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED,
+                                       allowZip64=True)
+
+    def add(self, path, size, mtime, src, hasher):
+        info = zipfile.ZipInfo(path, date_time=max(time.localtime(mtime)[:6], ZIP_EPOCH))
+        info.compress_type = self.archive.compression
+        info.file_size = size
+        info.external_attr = 0o644 << 16
+        short = None
+        with self.archive.open(info, 'w') as dest:
+            try:
+                yield from _copy(src, dest, size, hasher, self.sink)
+            except _ShortRead as e:
+                short = e
+        yield self.sink.drain()
+        if short is not None:
+            raise short
+
+    def close(self):
+        self.archive.close()
+        yield self.sink.drain()
+
+
+class _TarWriter:
+    # tarfile's addfile copies a whole member before returning, so headers
+    # and padding are written here and the data streamed in between.
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.written = 0
+
+    def _write(self, data):
+        self.sink.write(data)
+        self.written += len(data)
+
+    def add(self, path, size, mtime, src, hasher):
+        info = tarfile.TarInfo(path)
+        info.size = size
+        # Whole seconds fit the ustar header; fractions would need a pax record.
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        self._write(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+        short = None
+        try:
+            yield from _copy(src, self, size, hasher, self.sink)
+        except _ShortRead as e:
+            short = e
+        self._write(bytes(-size % tarfile.BLOCKSIZE))
+        yield self.sink.drain()
+        if short is not None:
+            raise short
+
+    def write(self, data):
+        self._write(data)
+
+    def close(self):
+        self._write(bytes(2 * tarfile.BLOCKSIZE))
+        self._write(bytes(-self.written % tarfile.RECORDSIZE))
+        yield self.sink.drain()
+
+
+def read_archive(stream, fmt, spool_dir=None):
+    """Yield (path, size, reader) for each file in a zip or tar, in archive order.
+
+    Tar archives (gzip-compressed or not) are read as they arrive. A zip
+    keeps its index at the end, so one that arrives unseekable is first
+    spooled to an anonymous file in spool_dir. reader is None for members
+    that are not regular files. Directories are skipped.
+    """
+    if fmt == 'tar':
+        with tarfile.open(fileobj=stream, mode='r|*') as archive:
+            for member in archive:
+                if member.isdir():
+                    continue
+                yield member.name, member.size, archive.extractfile(member) if member.isfile() else None
+        return
+
+    seekable = getattr(stream, 'seekable', lambda: False)()
+    spool = None
+    if not seekable:
+        spool = tempfile.TemporaryFile(dir=spool_dir)
+        shutil.copyfileobj(stream, spool, COPY_BUFFER)
+        spool.seek(0)
+        stream = spool
+    try:
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, info.file_size, member
+    finally:
+        if spool is not None:
+            spool.close()
@@ -1,49 +1,73 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file, stream_with_context
 import os
-import shutil
+import json
 from datetime import datetime
 import logging
 from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, storage
-from io import BytesIO
+import io
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from concurrent.futures import ThreadPoolExecutor
+from chunked_uploads import ChunkedUploads, UploadError, COPY_BUFFER
+from catalog import Catalog, UPLOADS, TRASH, encode_cursor, decode_cursor
+from batch import OperationError, check_name, operation_result, parse_operations, run_batch, MAX_OPERATIONS
+from content_store import ObjectLocks, hash_stream
+from storage_backends import LocalStorage, MemoryStorage, ReplicatedStorage
+from cluster import Cluster
+from health import HealthMonitor
+from retention import TrashRetention
+from versions import VersionHistory
+from search_index import ContentIndexer, INDEX_MAX_BYTES
+from scrubber import Scrubber
+from compression import CompressionTier, ColdRecompressor
+from metrics import Registry, Tracer, Instrumented, RequestMetrics, ROUTE_KEY
+from changes import ChangeFeed, FeedError, DEFAULT_LIMIT, MAX_LIMIT, KEEPALIVE_INTERVAL
+from archives import (ArchiveError, FORMATS, MANIFEST, detect_format, parse_path, read_manifest, export_archive,
+                      read_archive)
+import difflib
+import threading
+import time
+import tarfile
+import zipfile
+import mimetypes
+import tempfile
+import shutil
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Change-Seq', 'ETag'])
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 USE_FIREBASE = False
+# The Firebase client libraries take a good part of a second to import, so
+# they are only loaded when there are credentials and no other backend was chosen.
+wants_firebase = os.environ.get('STORAGE_BACKEND', 'firebase') == 'firebase'
+has_credentials = bool(os.environ.get('FIREBASE_CREDENTIALS') or os.path.exists('serviceAccountKey.json'))
 try:
-    # Check if Firebase is already initialized to prevent 500 errors on re-import
-    if not firebase_admin._apps:
-        # Check environment variable first (Vercel deployment)
-        if os.environ.get('FIREBASE_CREDENTIALS'):
-            import json
-            cred_json = json.loads(os.environ['FIREBASE_CREDENTIALS'])
-            cred = credentials.Certificate(cred_json)
-            bucket_name = os.environ.get('FIREBASE_STORAGE_BUCKET', 'file-recovery-system-5d7e9.appspot.com')
-            firebase_admin.initialize_app(cred, {
-                'storageBucket': bucket_name
-            })
-            USE_FIREBASE = True
-            logging.info(f"Firebase initialized successfully from environment variable with bucket: {bucket_name}")
-        
-        # Fall back to local file (local development)
-        elif os.path.exists('serviceAccountKey.json'):
-            cred = credentials.Certificate('serviceAccountKey.json')
+    if wants_firebase and not has_credentials:
+        logging.warning("Firebase credentials not found, using local storage")
+    elif wants_firebase:
+        import firebase_admin
+        from firebase_admin import credentials
+        # Check if Firebase is already initialized to prevent 500 errors on re-import
+        if not firebase_admin._apps:
+            # Check environment variable first (Vercel deployment)
+            if os.environ.get('FIREBASE_CREDENTIALS'):
+                cred = credentials.Certificate(json.loads(os.environ['FIREBASE_CREDENTIALS']))
+                source = "environment variable"
+            # Fall back to local file (local development)
+            else:
+                cred = credentials.Certificate('serviceAccountKey.json')
+                source = "local file"
             bucket_name = os.environ.get('FIREBASE_STORAGE_BUCKET', 'file-recovery-system-5d7e9.appspot.com')
             firebase_admin.initialize_app(cred, {
                 'storageBucket': bucket_name
             })
             USE_FIREBASE = True
-            logging.info(f"Firebase initialized successfully from local file with bucket: {bucket_name}")
+            logging.info(f"Firebase initialized successfully from {source} with bucket: {bucket_name}")
         else:
-            logging.warning("Firebase credentials not found, using local storage")
-    else:
-        # Already initialized
-        USE_FIREBASE = True
-        logging.info("Firebase already initialized, skipping re-initialization")
+            # Already initialized
+            USE_FIREBASE = True
+            logging.info("Firebase already initialized, skipping re-initialization")
 
 except Exception as e:
     logging.warning(f"Firebase initialization failed: {e}, using local storage")
@@ -51,15 +75,106 @@ except Exception as e:
 if os.environ.get('VERCEL'):
     UPLOAD_FOLDER = "/tmp/uploads"
     TRASH_FOLDER = "/tmp/trash"
+    CATALOG_PATH = os.environ.get('CATALOG_PATH', "/tmp/catalog.db")
+    STAGING_FOLDER = os.environ.get('STAGING_FOLDER', "/tmp/staging")
+    OBJECTS_FOLDER = "/tmp/objects"
+    NAMES_FOLDER = "/tmp/names"
 else:
     UPLOAD_FOLDER = "uploads"
     TRASH_FOLDER = "trash"
+    CATALOG_PATH = os.environ.get('CATALOG_PATH', "catalog.db")
+    STAGING_FOLDER = os.environ.get('STAGING_FOLDER', "staging")
+    OBJECTS_FOLDER = "objects"
+    NAMES_FOLDER = "names"
 
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["TRASH_FOLDER"] = TRASH_FOLDER
+app.config["CATALOG_PATH"] = CATALOG_PATH
+app.config["STAGING_FOLDER"] = STAGING_FOLDER
+app.config["OBJECTS_FOLDER"] = OBJECTS_FOLDER
+app.config["NAMES_FOLDER"] = NAMES_FOLDER
+# Firebase resumable uploads send (and buffer) one chunk per request; must be a multiple of 256 KiB.
+app.config["BLOB_CHUNK_SIZE"] = int(os.environ.get('BLOB_CHUNK_SIZE', 8 * 1024 * 1024))
+app.config["MAX_PAGE_SIZE"] = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+# Let a fronting web server (nginx X-Accel/Apache mod_xsendfile) stream local files.
+app.config["USE_X_SENDFILE"] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+app.config["BATCH_WORKERS"] = int(os.environ.get('BATCH_WORKERS', 16))
+app.config["MAX_BATCH_OPERATIONS"] = int(os.environ.get('MAX_BATCH_OPERATIONS', MAX_OPERATIONS))
+# Request threads in the production server (see gunicorn.conf.py).
+app.config["SERVER_THREADS"] = int(os.environ.get('SERVER_THREADS', 32))
+# Keep-alive connections to Firebase; one per request thread and batch worker so none of them queue for one.
+app.config["STORAGE_POOL_SIZE"] = int(os.environ.get('STORAGE_POOL_SIZE',
+                                                     app.config["SERVER_THREADS"] + app.config["BATCH_WORKERS"]))
+# Retention, scrubbing, cold recompression and node heartbeats run in background
+# threads. Serverless platforms freeze those between requests, so they are off there.
+app.config["BACKGROUND_JOBS"] = os.environ.get('BACKGROUND_JOBS', '0' if os.environ.get('VERCEL') else '1').lower() in (
+    '1', 'true', 'yes')
+# "local", "firebase", "replicated" or "memory"; by default Firebase when it initialised, otherwise local.
+app.config["STORAGE_BACKEND"] = os.environ.get('STORAGE_BACKEND', 'firebase' if USE_FIREBASE else 'local')
+if app.config["STORAGE_BACKEND"] == 'firebase' and not USE_FIREBASE:
+    # Asked for explicitly but unavailable; the reason was logged above.
+    app.config["STORAGE_BACKEND"] = 'local'
+# Trash retention: files older than TRASH_MAX_AGE seconds, or the oldest ones once
+# the trash holds more than TRASH_QUOTA_BYTES, are purged in the background. 0 disables either.
+app.config["TRASH_MAX_AGE"] = int(os.environ.get('TRASH_MAX_AGE', 0))
+app.config["TRASH_QUOTA_BYTES"] = int(os.environ.get('TRASH_QUOTA_BYTES', 0))
+app.config["RETENTION_INTERVAL"] = int(os.environ.get('RETENTION_INTERVAL', 60))
+app.config["RETENTION_BATCH_SIZE"] = int(os.environ.get('RETENTION_BATCH_SIZE', 100))
+# Version history: every VERSION_SNAPSHOT_INTERVAL-th version is stored whole, the
+# rest as deltas; files above VERSION_DELTA_MAX_BYTES are always stored whole.
+app.config["MAX_VERSIONS"] = int(os.environ.get('MAX_VERSIONS', 50))
+app.config["VERSION_SNAPSHOT_INTERVAL"] = int(os.environ.get('VERSION_SNAPSHOT_INTERVAL', 8))
+app.config["VERSION_DELTA_MAX_BYTES"] = int(os.environ.get('VERSION_DELTA_MAX_BYTES', 16 * 1024 * 1024))
+# Scrubbing: every stored object is re-read and checked against its SHA-256 once per
+# SCRUB_INTERVAL seconds (0 disables), reading at most SCRUB_RATE bytes/s (0 = unlimited).
+app.config["SCRUB_INTERVAL"] = int(os.environ.get('SCRUB_INTERVAL', 24 * 60 * 60))
+app.config["SCRUB_RATE"] = int(os.environ.get('SCRUB_RATE', 10 * 1024 * 1024))
+# Content search indexes at most this many bytes from the start of each text file.
+app.config["SEARCH_INDEX_MAX_BYTES"] = int(os.environ.get('SEARCH_INDEX_MAX_BYTES', INDEX_MAX_BYTES))
+app.config["MAX_SEARCH_RESULTS"] = int(os.environ.get('MAX_SEARCH_RESULTS', 200))
+# Replicated storage: host:port of each storage node (see storage_node.py), how
+# many nodes keep each object, and points per node on the hash ring.
+app.config["STORAGE_NODES"] = [node.strip() for node in os.environ.get('STORAGE_NODES', '').split(',') if node.strip()]
+app.config["REPLICAS"] = int(os.environ.get('REPLICAS', 3))
+app.config["RING_VNODES"] = int(os.environ.get('RING_VNODES', 128))
+app.config["NODE_TIMEOUT"] = float(os.environ.get('NODE_TIMEOUT', 10))
+# Failure detection: a heartbeat every HEARTBEAT_INTERVAL seconds; a node is suspect
+# once its phi reaches PHI_THRESHOLD and dead after NODE_DEAD_AFTER more seconds,
+# when its objects are re-replicated at up to REPAIR_BANDWIDTH bytes/s (0 = unlimited).
+app.config["HEARTBEAT_INTERVAL"] = float(os.environ.get('HEARTBEAT_INTERVAL', 1))
+app.config["PHI_THRESHOLD"] = float(os.environ.get('PHI_THRESHOLD', 8))
+app.config["NODE_DEAD_AFTER"] = float(os.environ.get('NODE_DEAD_AFTER', 10))
+app.config["REPAIR_BANDWIDTH"] = int(os.environ.get('REPAIR_BANDWIDTH', 32 * 1024 * 1024))
+# Compression: "zstd" or "gzip" stores new objects compressed unless they look
+# incompressible; empty stores them raw. Levels of 0 use the codec's defaults.
+# Objects left only in the trash for COLD_AFTER seconds (0 disables) are
+# recompressed at COLD_COMPRESSION_LEVEL.
+app.config["COMPRESSION"] = os.environ.get('COMPRESSION', '')
+app.config["COMPRESSION_LEVEL"] = int(os.environ.get('COMPRESSION_LEVEL', 0))
+app.config["COLD_COMPRESSION_LEVEL"] = int(os.environ.get('COLD_COMPRESSION_LEVEL', 0))
+app.config["COLD_AFTER"] = int(os.environ.get('COLD_AFTER', 7 * 24 * 60 * 60))
+app.config["COLD_INTERVAL"] = int(os.environ.get('COLD_INTERVAL', 60 * 60))
+# Instrumentation: /metrics serves request, storage and catalog metrics in the
+# Prometheus text format. TRACE_SAMPLE_RATE of requests (0 to 1) also record a
+# span per storage and catalog call; the last TRACE_BUFFER of them are on /metrics/traces.
+app.config["TRACE_SAMPLE_RATE"] = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+app.config["TRACE_BUFFER"] = int(os.environ.get('TRACE_BUFFER', 200))
+# Change feed: the newest CHANGE_LOG_SIZE changes are kept for /changes. At most
+# CHANGE_STREAMS clients hold a /changes/stream open at once (each holds a server
+# thread), each for at most CHANGE_STREAM_TIMEOUT seconds before it reconnects.
+app.config["CHANGE_LOG_SIZE"] = int(os.environ.get('CHANGE_LOG_SIZE', 100000))
+app.config["CHANGE_POLL_INTERVAL"] = float(os.environ.get('CHANGE_POLL_INTERVAL', 0.5))
+app.config["CHANGE_STREAMS"] = int(os.environ.get('CHANGE_STREAMS', max(1, app.config["SERVER_THREADS"] // 4)))
+app.config["CHANGE_STREAM_TIMEOUT"] = int(os.environ.get('CHANGE_STREAM_TIMEOUT', 300))
+# Archive import: files are read from the archive one at a time and handed to
+# the batch workers to store; at most IMPORT_QUEUE wait for a worker at once.
+# Backends that hash before uploading get each file spooled, in memory up to
+# IMPORT_SPOOL_BYTES and in the staging folder beyond.
+app.config["IMPORT_QUEUE"] = int(os.environ.get('IMPORT_QUEUE', 2 * app.config["BATCH_WORKERS"]))
+app.config["IMPORT_SPOOL_BYTES"] = int(os.environ.get('IMPORT_SPOOL_BYTES', 8 * 1024 * 1024))
 
-# Only create directories if not using Firebase
-if not USE_FIREBASE:
+# Only create directories if storing locally
+if app.config["STORAGE_BACKEND"] == 'local':
     try:
         os.makedirs(UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(TRASH_FOLDER, exist_ok=True)
@@ -72,6 +187,327 @@ if not USE_FIREBASE:
         else:
             logging.error(f"Could not create local directories: {e}")
 
+registry = Registry()
+tracer = Tracer(app.config["TRACE_SAMPLE_RATE"], keep=app.config["TRACE_BUFFER"])
+app.wsgi_app = RequestMetrics(app.wsgi_app, registry, tracer)
+storage_calls = registry.counter('storage_operations_total', 'Calls to the storage backend, by outcome.',
+                                 ('backend', 'operation', 'outcome'))
+storage_latency = registry.histogram('storage_operation_duration_seconds',
+                                     'Time spent in storage backend calls, in seconds.', ('backend', 'operation'))
+catalog_calls = registry.counter('catalog_operations_total', 'Calls to the catalog, by outcome.',
+                                 ('backend', 'operation', 'outcome'))
+catalog_latency = registry.histogram('catalog_operation_duration_seconds', 'Time spent in catalog calls, in seconds.',
+                                     ('backend', 'operation'))
+
+catalog = Instrumented(Catalog(CATALOG_PATH, migrate=False), 'catalog', 'sqlite', catalog_calls, catalog_latency, tracer)
+uploads = ChunkedUploads(STAGING_FOLDER)
+batch_executor = ThreadPoolExecutor(max_workers=app.config["BATCH_WORKERS"], thread_name_prefix='batch')
+
+cluster = None
+compression = CompressionTier(app.config["COMPRESSION"] or None, level=app.config["COMPRESSION_LEVEL"],
+                              cold_level=app.config["COLD_COMPRESSION_LEVEL"])
+# File contents are stored once per SHA-256 under objects/; names in uploads/
+# and trash/ only point at them (hard links locally, empty pointer blobs in Firebase).
+if app.config["STORAGE_BACKEND"] == 'firebase':
+    import firebase_admin
+    from firebase_storage import FirebaseStorage
+    store = FirebaseStorage(firebase_admin.get_app(), pool_size=app.config["STORAGE_POOL_SIZE"],
+                            chunk_size=app.config["BLOB_CHUNK_SIZE"], compression=compression)
+elif app.config["STORAGE_BACKEND"] == 'memory':
+    store = MemoryStorage(compression)
+elif app.config["STORAGE_BACKEND"] == 'replicated':
+    cluster = Cluster(app.config["STORAGE_NODES"], replicas=app.config["REPLICAS"], vnodes=app.config["RING_VNODES"],
+                      timeout=app.config["NODE_TIMEOUT"], pool_size=app.config["STORAGE_POOL_SIZE"],
+                      copy_bandwidth=app.config["REPAIR_BANDWIDTH"])
+    store = ReplicatedStorage(cluster, os.path.join(NAMES_FOLDER, UPLOADS), os.path.join(NAMES_FOLDER, TRASH),
+                              STAGING_FOLDER)
+    # Nodes check every object against its hash, so they are sent raw bytes.
+    if compression.enabled:
+        logging.warning("Replicated storage keeps objects uncompressed; COMPRESSION is ignored.")
+else:
+    store = LocalStorage(UPLOAD_FOLDER, TRASH_FOLDER, OBJECTS_FOLDER, names_folder=NAMES_FOLDER,
+                         compression=compression)
+logging.info(f"Using {type(store).__name__} for file storage")
+store = Instrumented(store, 'storage', app.config["STORAGE_BACKEND"], storage_calls, storage_latency, tracer)
+object_locks = ObjectLocks()
+# Held while a name's content is replaced, moved or purged, so its previous
+# content is kept as exactly one version and a purge removes the file its
+# catalog lookup found. Always taken before any object lock.
+name_locks = ObjectLocks()
+indexer = ContentIndexer(catalog, store, max_bytes=app.config["SEARCH_INDEX_MAX_BYTES"])
+
+def format_timestamp(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts else "Unknown"
+
+def file_entry(row):
+    return {
+        "name": row["name"],
+        "size": row["size"],
+        "type": row["type"],
+        "date_modified": format_timestamp(row["mtime"])
+    }
+
+def trash_entry(row):
+    return {
+        "name": row["name"],
+        "size": row["size"],
+        "date_deleted": format_timestamp(row["deleted_at"])
+    }
+
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def list_location(location, to_entry, search=None, sort_by='name'):
+    # Without `limit` the whole listing is returned, as before; with it, one page
+    # is returned and the cursor for the next page goes in X-Next-Cursor.
+    # X-Change-Seq is where to follow /changes from; the ETag only moves when
+    # this location changes, so revalidating an unchanged view is a 304.
+    # Both are read before the listing, so a client replaying changes misses none.
+    change_seq = catalog.change_seq()
+    etag = f'{location}-{catalog.change_seq(location)}'
+    if request.if_none_match.contains(etag):
+        return listing_headers(Response(status=304), etag, change_seq)
+
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    if limit is not None and not 1 <= limit <= app.config["MAX_PAGE_SIZE"]:
+        return jsonify({"error": f"limit must be between 1 and {app.config['MAX_PAGE_SIZE']}"}), 400
+    try:
+        after = decode_cursor(sort_by, cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Fetch one extra row to know whether another page exists.
+    rows = catalog.query(location, search=search, sort_by=sort_by, after=after,
+                         limit=limit + 1 if limit is not None else None)
+
+    if wants_ndjson() and limit is None:
+        def generate():
+            for row in rows:
+                yield json.dumps(to_entry(row)) + '\n'
+        return listing_headers(Response(stream_with_context(generate()), mimetype='application/x-ndjson'), etag,
+                               change_seq)
+
+    rows = list(rows)
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort_by, rows[-1])
+
+    with tracer.span('json.encode'):
+        if wants_ndjson():
+            response = Response(''.join(json.dumps(to_entry(row)) + '\n' for row in rows),
+                                mimetype='application/x-ndjson')
+        else:
+            response = jsonify([to_entry(row) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return listing_headers(response, etag, change_seq)
+
+def listing_headers(response, etag, change_seq):
+    response.set_etag(etag)
+    response.headers['X-Change-Seq'] = str(change_seq)
+    # Cached copies are kept but always revalidated, which is one index lookup.
+    response.cache_control.no_cache = True
+    response.vary.add('Accept')
+    return response
+
+def store_upload(filename, stream, content_type=None, sha256=None, size=None):
+    """Store the stream's bytes as uploads/<filename>, keeping one copy per distinct content.
+
+    Backends with hashes_before_upload need a seekable stream, or sha256 and
+    size passed in.
+    """
+    staged = store.stage(stream, content_type, sha256=sha256, size=size)
+    return store_staged(filename, staged)
+
+def store_staged(filename, staged, location=UPLOADS, deleted_at=None):
+    # Commits staged content and points location/filename at it. What an
+    # upload replaces is kept as a version; what a trash entry replaces is
+    # only released, as trash has no history.
+    try:
+        with name_locks(filename):
+            previous = catalog.get(location, filename)
+            with object_locks(staged.sha256):
+                store.commit(staged)
+                if staged.encoding:
+                    catalog.put_encoding(staged.sha256, staged.size, *staged.encoding)
+                mtime = store.link(location, filename, staged.sha256, staged.size, staged.content_type)
+                catalog.put(location, filename, staged.size, mtime, staged.sha256,
+                            deleted_at=(deleted_at or time.time()) if location == TRASH else None)
+            if location == UPLOADS:
+                keep_version(filename, previous, staged.sha256)
+            elif previous and previous["sha256"] != staged.sha256:
+                release_object(previous["sha256"])
+    finally:
+        store.discard(staged)
+    indexer.submit(staged.sha256)
+    return staged.sha256, staged.size
+
+def keep_version(name, previous, current_sha256):
+    # Called with the name lock held, after the name points at its new content.
+    if not previous or previous["sha256"] == current_sha256:
+        return
+    try:
+        history.archive(name, previous, current_sha256)
+    except Exception as e:
+        logging.error(f"Could not keep the previous version of {name}: {e}")
+    release_object(previous["sha256"])
+
+def release_object(sha256):
+    # Deletes the stored bytes once no name in uploads/ or trash/ refers to them.
+    if not sha256:
+        return
+    with object_locks(sha256):
+        if catalog.refcount(sha256):
+            return
+        store.delete_object(sha256)
+        catalog.forget_text(sha256)
+        catalog.forget_encoding(sha256)
+    logging.info(f"Object {sha256} is no longer referenced and was deleted.")
+
+def adopt_unhashed_files():
+    # Files written before the object store existed, or whose catalog rows were
+    # rebuilt from a plain directory scan, are hashed once and folded into it.
+    for location in (UPLOADS, TRASH):
+        for name in catalog.unhashed(location):
+            try:
+                sha256, size, stored = store.identify(location, name)
+                if not stored:
+                    with object_locks(sha256):
+                        store.adopt(location, name, sha256, size)
+                catalog.set_sha256(location, name, sha256)
+                indexer.submit(sha256)
+                logging.info(f"Moved {location}/{name} into the object store.")
+            except Exception as e:
+                logging.error(f"Could not move {location}/{name} into the object store: {e}")
+
+def prepare_storage():
+    reconcile_catalog()
+    start_background_jobs()
+    adopt_unhashed_files()
+    indexer.backfill()
+
+def reconcile_catalog():
+    # Bring the catalog in line with whatever is actually in storage, in case files
+    # were added or removed while the server was down. A file stored mid-scan
+    # could be dropped from the catalog, so writes wait for this (see ensure_started).
+    try:
+        catalog.reconcile(UPLOADS, store.scan(UPLOADS))
+        catalog.reconcile(TRASH, store.scan(TRASH))
+    except Exception as e:
+        logging.error(f"Catalog reconcile failed: {e}")
+    finally:
+        reconciled.set()
+
+def start_background_jobs():
+    if not app.config["BACKGROUND_JOBS"]:
+        return
+    uploads.start()
+    change_feed.start()
+    retention.start()
+    cold_compression.start()
+    scrubber.start()
+    if monitor is not None:
+        monitor.start()
+
+history = VersionHistory(
+    catalog,
+    store,
+    object_locks,
+    release_object,
+    snapshot_interval=app.config["VERSION_SNAPSHOT_INTERVAL"],
+    max_versions=app.config["MAX_VERSIONS"],
+    delta_max_bytes=app.config["VERSION_DELTA_MAX_BYTES"],
+)
+
+scrubber = Scrubber(
+    catalog,
+    store,
+    history,
+    object_locks,
+    rate=app.config["SCRUB_RATE"],
+    interval=app.config["SCRUB_INTERVAL"],
+)
+
+# purge_many is defined further down; the scheduler only calls it once started.
+retention = TrashRetention(
+    catalog,
+    lambda entries: purge_many(entries),
+    max_age=app.config["TRASH_MAX_AGE"],
+    quota_bytes=app.config["TRASH_QUOTA_BYTES"],
+    batch_size=app.config["RETENTION_BATCH_SIZE"],
+    interval=app.config["RETENTION_INTERVAL"],
+)
+
+cold_compression = ColdRecompressor(
+    catalog,
+    store,
+    compression,
+    object_locks,
+    cold_after=app.config["COLD_AFTER"],
+    interval=app.config["COLD_INTERVAL"],
+)
+
+def object_referenced(sha256):
+    return catalog.refcount(sha256) > 0
+
+monitor = None
+if cluster is not None:
+    monitor = HealthMonitor(
+        cluster,
+        lock=object_locks,
+        referenced=object_referenced,
+        interval=app.config["HEARTBEAT_INTERVAL"],
+        phi_threshold=app.config["PHI_THRESHOLD"],
+        dead_after=app.config["NODE_DEAD_AFTER"],
+    )
+
+change_feed = ChangeFeed(
+    catalog,
+    keep=app.config["CHANGE_LOG_SIZE"],
+    poll_interval=app.config["CHANGE_POLL_INTERVAL"],
+    max_streams=app.config["CHANGE_STREAMS"],
+)
+
+ENTRY_FORMATS = {UPLOADS: file_entry, TRASH: trash_entry}
+
+services_started = False
+services_lock = threading.Lock()
+reconciled = threading.Event()
+
+def start_services():
+    """Migrate the catalog and start reconciling it with storage in the background.
+
+    Runs once per process: from gunicorn's post_worker_init, or else before
+    the first request, so importing the app (a cold start on Vercel) stays
+    cheap. The background jobs start once the reconcile is done.
+    """
+    global services_started
+    if services_started:
+        return
+    with services_lock:
+        if services_started:
+            return
+        catalog.migrate()
+        threading.Thread(target=prepare_storage, name='prepare-storage', daemon=True).start()
+        services_started = True
+
+@app.before_request
+def ensure_started():
+    start_services()
+    # Reads are served from the catalog as it stands; listing a large bucket
+    # no longer holds up the first response.
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        reconciled.wait()
+
+@app.before_request
+def record_route():
+    # Metrics are kept per URL rule rather than per path, so names do not multiply them.
+    request.environ[ROUTE_KEY] = request.url_rule.rule if request.url_rule else None
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -82,91 +518,198 @@ def upload_file():
         return jsonify({"error": "No selected file"}), 400
     
     try:
-        if USE_FIREBASE:
-            bucket = storage.bucket()
-            blob = bucket.blob(f"uploads/{file.filename}")
-            file.stream.seek(0)
-            blob.upload_from_string(file.read(), content_type=file.content_type)
-            logging.info(f"File {file.filename} uploaded to Firebase successfully.")
-        else:
-            filepath = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
-            file.save(filepath)
-            logging.info(f"File {file.filename} uploaded locally successfully.")
+        check_name(file.filename)
+    except OperationError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    try:
+        store_upload(file.filename, file.stream, file.content_type)
+        logging.info(f"File {file.filename} uploaded successfully.")
     except Exception as e:
         logging.error(f"Error saving file: {e}")
         return jsonify({"error": f"Failed to upload file: {str(e)}"}), 500
     
     return jsonify({"message": f"{file.filename} uploaded successfully"}), 201
 
+@app.route('/uploads', methods=['POST'])
+def init_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename')
+    size = data.get('size')
+
+    if not filename or not isinstance(size, int):
+        return jsonify({"error": "filename and integer size are required"}), 400
+
+    try:
+        manifest = uploads.init(check_name(filename), size, data.get('chunk_size'))
+        logging.info(f"Started chunked upload {manifest['upload_id']} for {filename} ({size} bytes).")
+        return jsonify(manifest), 201
+    except (UploadError, OperationError) as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        logging.error(f"Error starting chunked upload: {e}")
+        return jsonify({"error": f"Failed to start upload: {str(e)}"}), 500
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    try:
+        return jsonify(uploads.status(upload_id)), 200
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    try:
+        chunk = uploads.write_chunk(upload_id, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+        return jsonify(chunk), 200
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        logging.error(f"Error writing chunk {index} of upload {upload_id}: {e}")
+        return jsonify({"error": f"Failed to write chunk: {str(e)}"}), 500
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    data = request.get_json(silent=True) or {}
+    expected = data.get('sha256')
+    if expected is not None and not isinstance(expected, str):
+        return jsonify({"error": "sha256 must be a hex string"}), 400
+    try:
+        manifest, assembled = uploads.open_assembled(upload_id)
+        filename = manifest["filename"]
+        sha256 = None
+        if store.hashes_before_upload or expected:
+            # Staged chunks are cheap to read twice; hashing them first means
+            # content the bucket already holds is never uploaded again, and
+            # content the client did not send is never stored.
+            with assembled:
+                sha256, _ = hash_stream(assembled)
+            if expected and expected.lower() != sha256:
+                uploads.discard(upload_id)
+                logging.warning(f"Upload {upload_id} for {filename} has checksum {sha256}, client expected {expected}")
+                return jsonify({"error": "Checksum mismatch for the assembled file"}), 422
+            _, assembled = uploads.open_assembled(upload_id)
+        with assembled:
+            sha256, size = store_upload(filename, assembled, data.get('content_type'),
+                                        sha256=sha256, size=manifest["size"])
+
+        uploads.discard(upload_id)
+        logging.info(f"Chunked upload {upload_id} stored as {filename}.")
+        return jsonify({"message": f"{filename} uploaded successfully", "size": size, "sha256": sha256}), 201
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        logging.error(f"Error completing upload {upload_id}: {e}")
+        return jsonify({"error": f"Failed to complete upload: {str(e)}"}), 500
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    try:
+        uploads.discard(upload_id)
+        return jsonify({"message": "Upload aborted"}), 200
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+
 @app.route('/files', methods=['GET'])
 def list_files():
     search_query = request.args.get('search', '').lower()
     sort_by = request.args.get('sort_by', 'name')
 
     try:
-        if USE_FIREBASE:
-            bucket = storage.bucket()
-            blobs = bucket.list_blobs(prefix='uploads/')
-            files = [
-                {
-                    "name": blob.name.replace('uploads/', ''),
-                    "size": blob.size,
-                    "type": blob.name.split('.')[-1] if '.' in blob.name else "Unknown",
-                    "date_modified": blob.updated.strftime('%Y-%m-%d %H:%M:%S') if blob.updated else "Unknown"
-                }
-                for blob in blobs if blob.name != 'uploads/'
-            ]
-        else:
-            files = [
-                {
-                    "name": filename,
-                    "size": os.path.getsize(os.path.join(UPLOAD_FOLDER, filename)),
-                    "type": filename.split('.')[-1] if '.' in filename else "Unknown",
-                    "date_modified": datetime.fromtimestamp(os.path.getmtime(os.path.join(UPLOAD_FOLDER, filename))).strftime('%Y-%m-%d %H:%M:%S')
-                }
-                for filename in os.listdir(UPLOAD_FOLDER) if os.path.isfile(os.path.join(UPLOAD_FOLDER, filename))
-            ]
+        return list_location(UPLOADS, file_entry, search=search_query, sort_by=sort_by)
     except Exception as e:
         logging.error(f"Error listing files: {e}")
         return jsonify({"error": f"Failed to list files: {str(e)}"}), 500
 
-    if search_query:
-        files = [file for file in files if search_query in file['name'].lower()]
+def move_file(src_location, filename, dest_location, not_found, new_name=None, replace=True):
+    # Moving a name over an existing one keeps what it replaced as a version.
+    # With replace=False an existing name is an error, checked under the lock.
+    dest_name = new_name or filename
+    with name_locks(dest_name):
+        if not replace and store.exists(dest_location, dest_name):
+            raise OperationError("A file with the new name already exists", 409)
+        moved = catalog.get(src_location, filename)
+        replaced = catalog.get(dest_location, dest_name)
+        try:
+            mtime = store.move(src_location, filename, dest_location, new_name=new_name)
+        except FileNotFoundError:
+            raise OperationError(not_found, 404)
+        catalog.move(src_location, filename, dest_location, new_name=new_name, mtime=mtime)
+        if replaced:
+            keep_version(dest_name, replaced, moved["sha256"] if moved else None)
 
-    try:
-        if sort_by == 'size':
-            files.sort(key=lambda x: x['size'])
-        elif sort_by == 'date_modified':
-            files.sort(key=lambda x: datetime.strptime(x['date_modified'], '%Y-%m-%d %H:%M:%S'), reverse=True)
-        else:
-            files.sort(key=lambda x: x['name'].lower())
-    except Exception as e:
-        logging.error(f"Sorting error: {e}")
+def forget_if_gone(name):
+    # History outlives trash moves but not a permanent delete of the last copy.
+    if not catalog.has_name(name):
+        history.drop(name)
 
-    return jsonify(files)
+def trash_file(filename):
+    move_file(UPLOADS, filename, TRASH, "File not found")
+    logging.info(f"File {filename} moved to trash.")
+    return f"{filename} moved to trash."
+
+def restore_from_trash(filename):
+    move_file(TRASH, filename, UPLOADS, "File not found in trash")
+    logging.info(f"File {filename} restored.")
+    return f"{filename} restored successfully."
+
+def purge_from_trash(filename):
+    # The name lock keeps a file deleted meanwhile from taking this name's
+    # place between the lookup and the removal.
+    with name_locks(filename):
+        entry = catalog.get(TRASH, filename)
+        try:
+            store.remove(TRASH, filename)
+        except FileNotFoundError:
+            raise OperationError("File not found in trash", 404)
+        catalog.remove(TRASH, filename)
+        if entry:
+            release_object(entry["sha256"])
+        forget_if_gone(filename)
+    logging.info(f"File {filename} permanently deleted.")
+    return f"{filename} permanently deleted."
+
+def purge_many(entries):
+    # Backends delete a whole group of names in as few requests as they can.
+    # Names the catalog does not know are reported missing without a call.
+    outcomes = []
+    names = []
+    hashes = set()
+    with name_locks.many(entry["name"] for entry in entries):
+        for entry in entries:
+            row = catalog.get(TRASH, entry["name"])
+            if row is None:
+                outcomes.append(OperationError("File not found in trash", 404))
+            else:
+                outcomes.append(f"{entry['name']} permanently deleted.")
+                names.append(entry["name"])
+                hashes.add(row["sha256"])
+        if names:
+            store.remove_many(TRASH, names)
+            catalog.remove_many(TRASH, names)
+            for sha256 in hashes:
+                release_object(sha256)
+            for name in names:
+                forget_if_gone(name)
+            logging.info(f"Permanently deleted {len(names)} files from trash in one batch.")
+    return outcomes
+
+def rename_upload(old_name, new_name):
+    check_name(old_name)
+    check_name(new_name)
+    if not store.exists(UPLOADS, old_name):
+        raise OperationError("File not found", 404)
+    move_file(UPLOADS, old_name, UPLOADS, "File not found", new_name=new_name, replace=False)
+    catalog.rename_versions(old_name, new_name)
+    logging.info(f"File renamed from {old_name} to {new_name}.")
+    return f"File renamed from {old_name} to {new_name}"
 
 @app.route('/delete/<filename>', methods=['DELETE'])
 def delete_file(filename):
     try:
-        if USE_FIREBASE:
-            bucket = storage.bucket()
-            src_blob = bucket.blob(f"uploads/{filename}")
-            if src_blob.exists():
-                dest_blob = bucket.blob(f"trash/{filename}")
-                bucket.copy_blob(src_blob, bucket, f"trash/{filename}")
-                src_blob.delete()
-                logging.info(f"File {filename} moved to trash.")
-                return jsonify({"message": f"{filename} moved to trash.", "status": "deleted"}), 200
-            else:
-                return jsonify({"error": "File not found"}), 404
-        else:
-            src_path = os.path.join(UPLOAD_FOLDER, filename)
-            dest_path = os.path.join(TRASH_FOLDER, filename)
-            if os.path.exists(src_path):
-                shutil.move(src_path, dest_path)
-                logging.info(f"File {filename} moved to trash.")
-                return jsonify({"message": f"{filename} moved to trash.", "status": "deleted"}), 200
-            return jsonify({"error": "File not found"}), 404
+        return jsonify({"message": trash_file(filename), "status": "deleted"}), 200
+    except OperationError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         logging.error(f"Error moving file to trash: {e}")
         return jsonify({"error": f"Failed to move file to trash: {str(e)}"}), 500
@@ -174,77 +717,230 @@ def delete_file(filename):
 @app.route('/restore/<filename>', methods=['PUT'])
 def restore_file(filename):
     try:
-        if USE_FIREBASE:
-            bucket = storage.bucket()
-            src_blob = bucket.blob(f"trash/{filename}")
-            if src_blob.exists():
-                dest_blob = bucket.blob(f"uploads/{filename}")
-                bucket.copy_blob(src_blob, bucket, f"uploads/{filename}")
-                src_blob.delete()
-                logging.info(f"File {filename} restored.")
-                return jsonify({"message": f"{filename} restored successfully.", "status": "restored"}), 200
-            else:
-                return jsonify({"error": "File not found in trash"}), 404
-        else:
-            src_path = os.path.join(TRASH_FOLDER, filename)
-            dest_path = os.path.join(UPLOAD_FOLDER, filename)
-
-            if os.path.exists(src_path):
-                shutil.move(src_path, dest_path)
-                logging.info(f"File {filename} restored.")
-                return jsonify({"message": f"{filename} restored successfully.", "status": "restored"}), 200
-            return jsonify({"error": "File not found in trash"}), 404
+        return jsonify({"message": restore_from_trash(filename), "status": "restored"}), 200
+    except OperationError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         logging.error(f"Error restoring file: {e}")
         return jsonify({"error": f"Failed to restore file: {str(e)}"}), 500
 
+def parse_time(value):
+    # Epoch seconds or an ISO 8601 date/time in server local time.
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/search', methods=['GET'])
+def search_files():
+    query = request.args.get('q', '')
+    location = request.args.get('location', UPLOADS)
+    limit = request.args.get('limit', 50, type=int)
+    if location not in (UPLOADS, TRASH, 'all'):
+        return jsonify({"error": "location must be uploads, trash or all"}), 400
+    if not 1 <= limit <= app.config["MAX_SEARCH_RESULTS"]:
+        return jsonify({"error": f"limit must be between 1 and {app.config['MAX_SEARCH_RESULTS']}"}), 400
+    try:
+        filters = dict(
+            type=request.args.get('type') or None,
+            min_size=request.args.get('min_size', type=int),
+            max_size=request.args.get('max_size', type=int),
+            modified_after=parse_time(request.args['modified_after']) if request.args.get('modified_after') else None,
+            modified_before=parse_time(request.args['modified_before']) if request.args.get('modified_before') else None,
+        )
+        rows = catalog.search(query, location=None if location == 'all' else location, limit=limit, **filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error searching files: {e}")
+        return jsonify({"error": f"Failed to search files: {str(e)}"}), 500
+
+    results = []
+    for row in rows:
+        entry = file_entry(row)
+        entry.update(location=row["location"], score=-row["rank"], snippet=row["snippet"])
+        if row["location"] == TRASH:
+            entry["date_deleted"] = format_timestamp(row["deleted_at"])
+        results.append(entry)
+    return jsonify(results), 200
+
+def rebalance_in_background():
+    thread = threading.Thread(target=cluster.rebalance, kwargs={"lock": object_locks, "referenced": object_referenced},
+                              name='rebalance', daemon=True)
+    thread.start()
+
+@app.route('/nodes', methods=['GET'])
+def list_nodes():
+    if cluster is None:
+        return jsonify({"error": "Storage is not replicated"}), 404
+    return jsonify(cluster.status()), 200
+
+@app.route('/nodes/health', methods=['GET'])
+def node_health():
+    if monitor is None:
+        return jsonify({"error": "Storage is not replicated"}), 404
+    return jsonify(monitor.view()), 200
+
+@app.route('/nodes', methods=['POST'])
+def add_node():
+    if cluster is None:
+        return jsonify({"error": "Storage is not replicated"}), 404
+    address = (request.get_json(silent=True) or {}).get('address')
+    if not address or not isinstance(address, str):
+        return jsonify({"error": "address (host:port) is required"}), 400
+    cluster.add_node(address)
+    rebalance_in_background()
+    logging.info(f"Storage node {address} joined the ring.")
+    return jsonify({"message": f"{address} added; rebalancing"}), 202
+
+@app.route('/nodes/<address>', methods=['DELETE'])
+def remove_node(address):
+    if cluster is None:
+        return jsonify({"error": "Storage is not replicated"}), 404
+    try:
+        cluster.remove_node(address)
+    except KeyError:
+        return jsonify({"error": "No such node"}), 404
+    rebalance_in_background()
+    logging.info(f"Storage node {address} left the ring.")
+    return jsonify({"message": f"{address} removed; rebalancing"}), 202
+
 @app.route('/trash', methods=['GET'])
 def list_trash():
     try:
-        if USE_FIREBASE:
-            bucket = storage.bucket()
-            blobs = bucket.list_blobs(prefix='trash/')
-            files = [
-                {
-                    "name": blob.name.replace('trash/', ''),
-                    "size": blob.size,
-                    "date_deleted": blob.updated.strftime('%Y-%m-%d %H:%M:%S') if blob.updated else "Unknown"
-                }
-                for blob in blobs if blob.name != 'trash/'
-            ]
-        else:
-            files = [
-                {
-                    "name": filename,
-                    "size": os.path.getsize(os.path.join(TRASH_FOLDER, filename)),
-                    "date_deleted": datetime.fromtimestamp(os.path.getmtime(os.path.join(TRASH_FOLDER, filename))).strftime('%Y-%m-%d %H:%M:%S')
-                }
-                for filename in os.listdir(TRASH_FOLDER) if os.path.isfile(os.path.join(TRASH_FOLDER, filename))
-            ]
+        return list_location(TRASH, trash_entry, sort_by='date_deleted')
     except Exception as e:
         logging.error(f"Error listing trash: {e}")
         return jsonify({"error": f"Failed to list trash: {str(e)}"}), 500
-    return jsonify(files)
+
+def change_entry(row):
+    # "put" carries the name's entry as the listings show it; "delete" means
+    # the name is no longer in that location.
+    change = {"seq": row["seq"], "location": row["location"], "name": row["name"],
+              "op": "put" if row["present"] else "delete"}
+    if row["present"]:
+        change["entry"] = ENTRY_FORMATS[row["location"]](row)
+    return change
+
+@app.route('/changes', methods=['GET'])
+def list_changes():
+    # Changes to uploads and trash after ?since=, a listing's X-Change-Seq or
+    # the `next` of an earlier call. Each name appears once, with its state now.
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    if since is None:
+        return jsonify({"error": "since is required"}), 400
+    if not 1 <= limit <= MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {MAX_LIMIT}"}), 400
+
+    try:
+        rows, latest = change_feed.changes(since, limit)
+    except FeedError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        logging.error(f"Error reading changes: {e}")
+        return jsonify({"error": f"Failed to read changes: {str(e)}"}), 500
+
+    more = len(rows) == limit
+    next_seq = rows[-1]["seq"] if rows else since
+    if not more:
+        next_seq = max(next_seq, latest)
+    return jsonify({"changes": [change_entry(row) for row in rows], "next": next_seq, "more": more}), 200
+
+@app.route('/changes/stream', methods=['GET'])
+def stream_changes():
+    # Server-sent events: one "change" event per change, with the sequence
+    # number as its id, so a reconnecting EventSource resumes from
+    # Last-Event-ID. A "reset" event means the client must list again.
+    since = request.args.get('since', type=int)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    if since is None:
+        since = catalog.change_seq()
+    try:
+        change_feed.changes(since, 1)
+    except FeedError as e:
+        return jsonify({"error": str(e)}), e.status
+    if not change_feed.open_stream():
+        return jsonify({"error": "Too many change streams are open; poll /changes instead"}), 503, {
+            "Retry-After": "30"}
+
+    deadline = time.monotonic() + app.config["CHANGE_STREAM_TIMEOUT"]
+
+    def generate():
+        position = since
+        try:
+            yield 'retry: 2000\n\n'
+            while time.monotonic() < deadline:
+                try:
+                    rows, _ = change_feed.changes(position, DEFAULT_LIMIT)
+                except FeedError as e:
+                    yield f'event: reset\ndata: {json.dumps({"error": str(e)})}\n\n'
+                    return
+                for row in rows:
+                    yield f'id: {row["seq"]}\nevent: change\ndata: {json.dumps(change_entry(row))}\n\n'
+                    position = row["seq"]
+                if len(rows) < DEFAULT_LIMIT and change_feed.wait(position, KEEPALIVE_INTERVAL) <= position:
+                    yield ': keepalive\n\n'
+        finally:
+            change_feed.close_stream()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/trash/retention', methods=['GET'])
+def trash_retention():
+    try:
+        return jsonify(retention.metrics()), 200
+    except Exception as e:
+        logging.error(f"Error reading trash retention metrics: {e}")
+        return jsonify({"error": f"Failed to read retention metrics: {str(e)}"}), 500
+
+@app.route('/scrub', methods=['GET'])
+def scrub_report():
+    try:
+        return jsonify(scrubber.metrics()), 200
+    except Exception as e:
+        logging.error(f"Error reading scrub metrics: {e}")
+        return jsonify({"error": f"Failed to read scrub metrics: {str(e)}"}), 500
+
+@app.route('/scrub', methods=['POST'])
+def start_scrub():
+    if not scrubber.scrub_now():
+        return jsonify({"error": "A scrub pass is already running"}), 409
+    return jsonify({"message": "Scrub pass started"}), 202
+
+@app.route('/compression', methods=['GET'])
+def compression_report():
+    # What this process has compressed and decompressed since it started,
+    # and the ratio achieved over everything stored compressed.
+    try:
+        return jsonify({
+            "tier": compression.metrics(),
+            "stored": catalog.encoding_summary(),
+            "cold": cold_compression.metrics(),
+        }), 200
+    except Exception as e:
+        logging.error(f"Error reading compression metrics: {e}")
+        return jsonify({"error": f"Failed to read compression metrics: {str(e)}"}), 500
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/metrics/traces', methods=['GET'])
+def recent_traces():
+    # Newest first; ?route=/files narrows them to one URL rule.
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify(tracer.recent(limit, request.args.get('route'))), 200
 
 @app.route('/delete-permanent/<filename>', methods=['DELETE'])
 def permanently_delete_file(filename):
     try:
-        if USE_FIREBASE:
-            bucket = storage.bucket()
-            blob = bucket.blob(f"trash/{filename}")
-            if blob.exists():
-                blob.delete()
-                logging.info(f"File {filename} permanently deleted.")
-                return jsonify({"message": f"{filename} permanently deleted."}), 200
-            else:
-                return jsonify({"error": "File not found in trash"}), 404
-        else:
-            file_path = os.path.join(TRASH_FOLDER, filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logging.info(f"File {filename} permanently deleted.")
-                return jsonify({"message": f"{filename} permanently deleted."}), 200
-            return jsonify({"error": "File not found in trash"}), 404
+        return jsonify({"message": purge_from_trash(filename)}), 200
+    except OperationError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         logging.error(f"Error permanently deleting file: {e}")
         return jsonify({"error": f"Failed to permanently delete file: {str(e)}"}), 500
@@ -259,61 +955,289 @@ def rename_file():
         return jsonify({"error": "Both old and new file names are required"}), 400
 
     try:
-        if USE_FIREBASE:
-            bucket = storage.bucket()
-            old_blob = bucket.blob(f"uploads/{old_name}")
-            if not old_blob.exists():
-                return jsonify({"error": "File not found"}), 404
-            
-            new_blob = bucket.blob(f"uploads/{new_name}")
-            if new_blob.exists():
-                return jsonify({"error": "A file with the new name already exists"}), 409
-            
-            bucket.copy_blob(old_blob, bucket, f"uploads/{new_name}")
-            old_blob.delete()
-            logging.info(f"File renamed from {old_name} to {new_name}.")
-        else:
-            old_path = os.path.join(UPLOAD_FOLDER, old_name)
-            new_path = os.path.join(UPLOAD_FOLDER, new_name)
-            
-            if not os.path.exists(old_path):
-                return jsonify({"error": "File not found"}), 404
-            
-            if os.path.exists(new_path):
-                return jsonify({"error": "A file with the new name already exists"}), 409
-            
-            os.rename(old_path, new_path)
-            logging.info(f"File renamed from {old_name} to {new_name}.")
+        return jsonify({"message": rename_upload(old_name, new_name)}), 200
+    except OperationError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         logging.error(f"Error renaming file: {e}")
         return jsonify({"error": f"Failed to rename file: {str(e)}"}), 500
 
-    return jsonify({"message": f"File renamed from {old_name} to {new_name}"}), 200
+BATCH_HANDLERS = {
+    'delete': lambda entry: trash_file(entry["name"]),
+    'restore': lambda entry: restore_from_trash(entry["name"]),
+    'purge': lambda entry: purge_from_trash(entry["name"]),
+    'rename': lambda entry: rename_upload(entry["name"], entry["new_name"]),
+}
+
+@app.route('/batch', methods=['POST'])
+def batch_operations():
+    # Runs delete/restore/purge/rename for many files at once on a bounded
+    # worker pool; "empty_trash" and "restore_all" cover the whole trash.
+    try:
+        operations = parse_operations(request.get_json(silent=True), lambda: catalog.names(TRASH),
+                                      app.config["MAX_BATCH_OPERATIONS"])
+    except OperationError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    try:
+        results = run_batch(batch_executor, operations, BATCH_HANDLERS, {'purge': purge_many})
+    except Exception as e:
+        logging.error(f"Error running batch: {e}")
+        return jsonify({"error": f"Failed to run batch: {str(e)}"}), 500
+
+    succeeded = sum(1 for result in results if result["ok"])
+    logging.info(f"Batch of {len(results)} operations finished, {len(results) - succeeded} failed.")
+    return jsonify({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}), 200
+
+def export_selection(params, names):
+    # The rows to export: the given names, a content search, or every file in
+    # the location whose name contains `search`.
+    location = params.get('location', UPLOADS)
+    if location not in (UPLOADS, TRASH, 'all'):
+        raise ArchiveError("location must be uploads, trash or all")
+    locations = (UPLOADS, TRASH) if location == 'all' else (location,)
+    if names:
+        if location == 'all':
+            raise ArchiveError("names must be exported from either uploads or trash")
+        rows = [catalog.get(location, name) for name in names]
+        missing = [name for name, row in zip(names, rows) if row is None]
+        if missing:
+            raise ArchiveError(f"Not found in {location}: {', '.join(missing[:20])}", 404)
+        return rows
+    if params.get('q'):
+        found = catalog.search(params['q'], location=None if location == 'all' else location,
+                               limit=app.config["MAX_SEARCH_RESULTS"])
+        return [row for row in (catalog.get(r["location"], r["name"]) for r in found) if row]
+    search = (params.get('search') or '').lower()
+    return [row for loc in locations for row in catalog.query(loc, search=search)]
+
+def open_for_export(row):
+    if row["sha256"]:
+        return store.open_object(row["sha256"])
+    # Not yet hashed into the object store; only uploads can be opened by name.
+    download = store.open(row["name"]) if row["location"] == UPLOADS else None
+    if download is None:
+        raise FileNotFoundError(f"{row['location']}/{row['name']} is not in storage")
+    return open(download.path, 'rb') if download.path else download.stream
+
+@app.route('/export', methods=['GET', 'POST'])
+def export_files():
+    # Streams a zip or tar of uploads/<name> and trash/<name> entries with a
+    # manifest.json of sizes and SHA-256s first. POST takes the same
+    # parameters as a JSON body, for selections too long for a URL.
+    if request.method == 'POST':
+        params = request.get_json(silent=True)
+        if not isinstance(params, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        names = params.get('names') or []
+    else:
+        params = request.args
+        names = request.args.getlist('names')
+    try:
+        fmt = detect_format(params.get('format') or 'zip')
+        names = [check_name(name) for name in names]
+        rows = export_selection(params, names)
+    except (ArchiveError, OperationError) as e:
+        return jsonify({"error": str(e)}), e.status
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error selecting files to export: {e}")
+        return jsonify({"error": f"Failed to export files: {str(e)}"}), 500
+
+    deflate = str(params.get('compress', '')).lower() in ('1', 'true', 'yes')
+    download_name = f"{params.get('location', UPLOADS)}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}"
+    logging.info(f"Exporting {len(rows)} files as {download_name}.")
+    response = Response(export_archive(rows, fmt, open_for_export, deflate=deflate), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    return response
+
+def stage_for_import(name, reader):
+    # Runs on the request thread, which is the only one that can read the
+    # archive; whatever the backend needs later must be copied off it now.
+    content_type = mimetypes.guess_type(name)[0]
+    if not store.hashes_before_upload:
+        return store.stage(reader, content_type), None
+    spool = tempfile.SpooledTemporaryFile(app.config["IMPORT_SPOOL_BYTES"], dir=STAGING_FOLDER)
+    try:
+        shutil.copyfileobj(reader, spool, COPY_BUFFER)
+        spool.seek(0)
+        return store.stage(spool, content_type), spool
+    except Exception:
+        spool.close()
+        raise
+
+def finish_import(location, name, staged, spool, expected_sha256, deleted_at, queued):
+    try:
+        if expected_sha256 and expected_sha256 != staged.sha256:
+            store.discard(staged)
+            raise ArchiveError("Content does not match the checksum in the manifest", 422)
+        store_staged(name, staged, location, deleted_at=deleted_at)
+        return f"Imported into {location}"
+    finally:
+        if spool is not None:
+            spool.close()
+        queued.release()
+
+def import_archive(members, into=None, skip_existing=False):
+    """Store each file of an archive; returns one result per file, in archive
+    order, and why the archive could not be read to its end, if it could not.
+
+    Files are staged here, in archive order, and committed on the batch
+    workers, so uploads to remote storage overlap with reading the archive.
+    """
+    queued = threading.BoundedSemaphore(app.config["IMPORT_QUEUE"])
+    manifest = {}
+    seen = set()
+    pending = []
+    damaged = None
+
+    def done(entry, outcome):
+        pending.append((entry, outcome))
+
+    try:
+        for path, _, reader in members:
+            import_member(path, reader, into, skip_existing, manifest, seen, queued, done)
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+        damaged = str(e)
+
+    results = []
+    for entry, outcome in pending:
+        if hasattr(outcome, 'result'):
+            try:
+                outcome = outcome.result()
+            except Exception as e:
+                if not isinstance(e, OperationError):
+                    logging.error(f"Could not import {entry['path']}: {e}")
+                outcome = e
+        results.append(operation_result(entry, outcome))
+    return results, damaged
+
+def import_member(path, reader, into, skip_existing, manifest, seen, queued, done):
+    if path == MANIFEST and reader is not None:
+        manifest.update(read_manifest(reader))
+        return
+    entry = {"path": path}
+    try:
+        location, name = parse_path(path, into)
+        entry.update(location=location, name=name)
+        if reader is None:
+            raise ArchiveError(f"{path} is not a regular file")
+        if (location, name) in seen:
+            raise ArchiveError(f"{path} appears more than once in the archive")
+        seen.add((location, name))
+        if skip_existing and catalog.get(location, name):
+            done(entry, "Skipped, already exists")
+            return
+        meta = manifest.get(path, {})
+        queued.acquire()
+        try:
+            staged, spool = stage_for_import(name, reader)
+        except Exception:
+            queued.release()
+            raise
+        done(entry, batch_executor.submit(finish_import, location, name, staged, spool, meta.get("sha256"),
+                                          meta.get("deleted_at"), queued))
+    except Exception as e:
+        if not isinstance(e, OperationError):
+            logging.error(f"Could not import {path}: {e}")
+        done(entry, e)
+
+@app.route('/import', methods=['POST'])
+def import_files():
+    # Takes a zip or tar (as an export writes them, or any flat archive) as
+    # the raw body or as a multipart "file"; ?into=trash puts every file in
+    # the trash, ?skip_existing=true leaves names that already exist alone.
+    into = request.args.get('into') or None
+    if into not in (None, UPLOADS, TRASH):
+        return jsonify({"error": "into must be uploads or trash"}), 400
+    skip_existing = request.args.get('skip_existing', '').lower() in ('1', 'true', 'yes')
+
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    try:
+        if upload is not None:
+            fmt = detect_format(request.args.get('format'), upload.mimetype, upload.filename)
+            stream = upload.stream
+        else:
+            fmt = detect_format(request.args.get('format'), request.mimetype)
+            stream = request.stream
+    except ArchiveError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    try:
+        results, damaged = import_archive(read_archive(stream, fmt, STAGING_FOLDER), into=into,
+                                          skip_existing=skip_existing)
+    except Exception as e:
+        logging.error(f"Error importing archive: {e}")
+        return jsonify({"error": f"Failed to import archive: {str(e)}"}), 500
+
+    succeeded = sum(1 for result in results if result["ok"])
+    logging.info(f"Imported {succeeded} of {len(results)} files from a {fmt} archive.")
+    body = {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}
+    if damaged:
+        # Files before the damage were still imported, and are listed.
+        body["error"] = f"Not a readable {fmt} archive: {damaged}"
+        return jsonify(body), 400
+    return jsonify(body), 200
 
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
+    # Strong ETags come from the SHA-256 recorded at upload time; files that
+    # predate the catalog fall back to the storage layer's own validator.
+    entry = catalog.get(UPLOADS, filename)
+    sha256 = entry["sha256"] if entry else None
     try:
-        if USE_FIREBASE:
-            bucket = storage.bucket()
-            blob = bucket.blob(f"uploads/{filename}")
-            if blob.exists():
-                file_data = blob.download_as_bytes()
-                return send_file(
-                    BytesIO(file_data),
-                    as_attachment=True,
-                    download_name=filename
-                )
-            else:
-                return jsonify({"error": "File not found"}), 404
-        else:
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            if os.path.exists(filepath):
-                return send_file(filepath, as_attachment=True)
+        download = store.open(filename, sha256)
+        if download is None:
             return jsonify({"error": "File not found"}), 404
+        if download.path:
+            # A hard link carries its object's mtime; the catalog has the name's own.
+            return send_file(download.path, as_attachment=True, download_name=filename, etag=sha256 or True,
+                             last_modified=entry["mtime"] if entry else None, conditional=True)
+        if download.encoding and request.accept_encodings[download.encoding] and not request.range:
+            return send_encoded(download, filename, sha256)
+        response = send_file(
+            download.stream,
+            as_attachment=True,
+            download_name=filename,
+            mimetype=download.content_type or None,
+            etag=sha256 or download.etag,
+            last_modified=download.mtime,
+            conditional=False
+        )
+        response.content_length = download.size
+        if download.encoding:
+            response.vary.add('Accept-Encoding')
+        try:
+            return response.make_conditional(request, accept_ranges=True, complete_length=download.size)
+        except RequestedRangeNotSatisfiable:
+            download.stream.close()
+            raise
+    except RequestedRangeNotSatisfiable:
+        raise
     except Exception as e:
         logging.error(f"Error downloading file: {e}")
         return jsonify({"error": f"Failed to download file: {str(e)}"}), 500
 
+def send_encoded(download, filename, sha256):
+    # The stored compressed bytes go out as they are, for the client to
+    # decompress. They are a different representation, hence their own ETag.
+    download.stream.close()
+    stream, size = download.encoded()
+    response = send_file(
+        stream,
+        as_attachment=True,
+        download_name=filename,
+        mimetype=download.content_type or None,
+        etag=f"{sha256 or download.etag}.{download.encoding}",
+        last_modified=download.mtime,
+        conditional=False
+    )
+    response.content_length = size
+    response.content_encoding = download.encoding
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
 @app.route('/create-file', methods=['POST'])
 def create_file():
     data = request.get_json()
@@ -324,30 +1248,108 @@ def create_file():
         return jsonify({"error": "Filename is required"}), 400
 
     try:
-        if USE_FIREBASE:
-            # Upload to Firebase Storage
-            bucket = storage.bucket()
-            blob = bucket.blob(f"uploads/{filename}")
-            blob.upload_from_string(content, content_type='text/plain')
-            logging.info(f"File {filename} created in Firebase successfully.")
-        else:
-            # Fallback to local storage
-            file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            with open(file_path, 'w') as f:
-                f.write(content)
-            logging.info(f"File {filename} created locally successfully.")
+        check_name(filename)
+    except OperationError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    try:
+        store_upload(filename, io.BytesIO(content.encode()), 'text/plain')
+        logging.info(f"File {filename} created successfully.")
         
         return jsonify({"message": "File created successfully!"}), 201
     except Exception as e:
         logging.error(f"Error creating file: {e}")
         return jsonify({"error": f"Error creating file: {str(e)}"}), 500
 
+def version_entry(row):
+    return {
+        "version": row["version"],
+        "size": row["size"],
+        "sha256": row["sha256"],
+        "date_modified": format_timestamp(row["mtime"]),
+        "date_replaced": format_timestamp(row["archived_at"]),
+        "stored_as": "delta" if row["delta_sha256"] else "full",
+    }
+
+@app.route('/versions/<filename>', methods=['GET'])
+def list_versions(filename):
+    try:
+        return jsonify([version_entry(row) for row in catalog.versions(filename)]), 200
+    except Exception as e:
+        logging.error(f"Error listing versions: {e}")
+        return jsonify({"error": f"Failed to list versions: {str(e)}"}), 500
+
+@app.route('/versions/<filename>/<int:version>', methods=['GET'])
+def download_version(filename, version):
+    row = catalog.get_version(filename, version)
+    if row is None:
+        return jsonify({"error": "Version not found"}), 404
+    try:
+        # Full snapshots stream straight from storage; deltas are rebuilt in memory.
+        if row["delta_sha256"] is None:
+            stream = store.open_object(row["sha256"])
+        else:
+            stream = io.BytesIO(history.read(row))
+        return send_file(stream, as_attachment=True, download_name=filename, etag=row["sha256"], conditional=True)
+    except Exception as e:
+        logging.error(f"Error downloading version {version} of {filename}: {e}")
+        return jsonify({"error": f"Failed to download version: {str(e)}"}), 500
+
+@app.route('/versions/<filename>/<int:version>/diff', methods=['GET'])
+def diff_version(filename, version):
+    # Unified diff from this version to ?against=<version>, or to the current file by default.
+    row = catalog.get_version(filename, version)
+    if row is None:
+        return jsonify({"error": "Version not found"}), 404
+    against = request.args.get('against', 'current')
+    if against == 'current':
+        other = catalog.get(UPLOADS, filename)
+        other_label = f"{filename} (current)"
+    else:
+        other = catalog.get_version(filename, int(against)) if against.isdigit() else None
+        other_label = f"{filename} (version {against})"
+    if other is None or not other["sha256"]:
+        return jsonify({"error": "Nothing to compare against"}), 404
+    if max(row["size"], other["size"]) > app.config["VERSION_DELTA_MAX_BYTES"]:
+        return jsonify({"error": "File is too large to diff"}), 413
+
+    try:
+        old = history.read(row)
+        new = history.content(filename, other["sha256"])
+        old_lines = old.decode('utf-8').splitlines(keepends=True)
+        new_lines = new.decode('utf-8').splitlines(keepends=True)
+    except UnicodeDecodeError:
+        return jsonify({"error": "Binary files cannot be diffed"}), 415
+    except Exception as e:
+        logging.error(f"Error diffing version {version} of {filename}: {e}")
+        return jsonify({"error": f"Failed to diff version: {str(e)}"}), 500
+    diff = difflib.unified_diff(old_lines, new_lines, f"{filename} (version {version})", other_label)
+    return Response(''.join(diff), mimetype='text/plain')
+
+@app.route('/versions/<filename>/<int:version>/restore', methods=['POST'])
+def restore_version(filename, version):
+    # The restored content becomes the current file; what it replaces is kept as a new version.
+    row = catalog.get_version(filename, version)
+    if row is None:
+        return jsonify({"error": "Version not found"}), 404
+    try:
+        if row["delta_sha256"] is None:
+            with store.open_object(row["sha256"]) as stream:
+                store_upload(filename, stream, sha256=row["sha256"], size=row["size"])
+        else:
+            store_upload(filename, io.BytesIO(history.read(row)))
+        logging.info(f"Restored version {version} of {filename}.")
+        return jsonify({"message": f"{filename} restored to version {version}."}), 200
+    except Exception as e:
+        logging.error(f"Error restoring version {version} of {filename}: {e}")
+        return jsonify({"error": f"Failed to restore version: {str(e)}"}), 500
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 if __name__ == '__main__':
-    if os.environ.get('VERCEL'):
-        app.run(debug=False)
-    else:
-        app.run(debug=True, host='0.0.0.0', port=5000)
+    # For development; run.sh serves with gunicorn.
+    start_services()
+    app.run(debug=os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes'), host='0.0.0.0',
+            port=int(os.environ.get('PORT', 5000)))
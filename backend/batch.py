@@ -0,0 +1,116 @@
+import logging
+
+MAX_OPERATIONS = 10000
+# Google Cloud Storage accepts at most 100 calls per batch request.
+BULK_SIZE = 100
+
+SINGLE_OPS = ('delete', 'restore', 'purge', 'rename')
+EXPANDING_OPS = ('empty_trash', 'restore_all')
+
+
+class OperationError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def check_name(name):
+    # Names that arrive in a request body rather than a URL segment have not
+    # been stopped from pointing outside the storage folders.
+    if not isinstance(name, str) or not name or name in ('.', '..') or '/' in name or '\\' in name:
+        raise OperationError(f"Invalid file name: {name!r}")
+    return name
+
+
+def parse_operations(data, trash_names, max_operations=MAX_OPERATIONS):
+    """Validate a /batch body and expand empty_trash/restore_all into per-file operations.
+
+    trash_names is called lazily to list the trash, so batches without the
+    expanding operations never touch the catalog.
+    """
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise OperationError("operations must be a non-empty list")
+    if len(operations) > max_operations:
+        raise OperationError(f"A batch may contain at most {max_operations} operations")
+
+    expanded = []
+    for item in operations:
+        op = item.get('op') if isinstance(item, dict) else None
+        if op in EXPANDING_OPS:
+            single = 'purge' if op == 'empty_trash' else 'restore'
+            expanded.extend({"op": single, "name": name} for name in trash_names())
+        elif op in SINGLE_OPS:
+            entry = {"op": op, "name": check_name(item.get('name'))}
+            if op == 'rename':
+                entry["new_name"] = check_name(item.get('new_name'))
+            expanded.append(entry)
+        else:
+            raise OperationError(f"Unknown operation: {op!r}")
+
+    # Operations run concurrently, so two that touch the same file would race.
+    seen = set()
+    for entry in expanded:
+        for name in (entry["name"], entry.get("new_name")):
+            if name is None:
+                continue
+            if name in seen:
+                raise OperationError(f"{name} appears in more than one operation")
+            seen.add(name)
+    return expanded
+
+
+def operation_result(entry, outcome):
+    result = dict(entry)
+    if isinstance(outcome, OperationError):
+        result.update(ok=False, code=outcome.status, error=str(outcome))
+    elif isinstance(outcome, Exception):
+        result.update(ok=False, code=500, error=str(outcome))
+    else:
+        result.update(ok=True, code=200, message=outcome)
+    return result
+
+
+def _run_one(handler, entry):
+    try:
+        return [operation_result(entry, handler(entry))]
+    except Exception as e:
+        if not isinstance(e, OperationError):
+            logging.error(f"Batch {entry['op']} of {entry['name']} failed: {e}")
+        return [operation_result(entry, e)]
+
+
+def _run_bulk(handler, entries):
+    try:
+        outcomes = handler(entries)
+    except Exception as e:
+        logging.error(f"Batch {entries[0]['op']} of {len(entries)} files failed: {e}")
+        outcomes = [e] * len(entries)
+    return [operation_result(entry, outcome) for entry, outcome in zip(entries, outcomes)]
+
+
+def run_batch(executor, operations, handlers, bulk_handlers=None, bulk_size=BULK_SIZE):
+    """Run operations on the executor and return one result per operation, in order.
+
+    handlers map an op to a callable taking one operation and returning a
+    message. bulk_handlers take up to bulk_size operations at once and return
+    one message or exception per operation; ops with a bulk handler use it.
+    """
+    bulk_handlers = bulk_handlers or {}
+    futures = []
+    grouped = {}
+    for index, entry in enumerate(operations):
+        if entry["op"] in bulk_handlers:
+            grouped.setdefault(entry["op"], []).append(index)
+        else:
+            futures.append(([index], executor.submit(_run_one, handlers[entry["op"]], entry)))
+    for op, indices in grouped.items():
+        for start in range(0, len(indices), bulk_size):
+            chunk = indices[start:start + bulk_size]
+            futures.append((chunk, executor.submit(_run_bulk, bulk_handlers[op], [operations[i] for i in chunk])))
+
+    results = [None] * len(operations)
+    for indices, future in futures:
+        for index, result in zip(indices, future.result()):
+            results[index] = result
+    return results
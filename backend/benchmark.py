@@ -0,0 +1,613 @@
+"""Load-test the file API and record latency percentiles, throughput and peak memory.
+
+By default the app is imported into this process, with local storage in a
+scratch folder, so nothing but this script is needed:
+
+    python benchmark.py --files 1000,10000,100000 --output results.json
+    python benchmark.py --backend memory --scenarios upload,download --sizes 1K,1M,1G
+    python benchmark.py --compare results.json --output new.json
+
+Against a running server, whose memory is sampled when its pid is given:
+
+    python benchmark.py --url http://127.0.0.1:5000 --server-pid 1234
+
+Each data set is seeded with small text files before its scenarios run; the
+next data set adds to it. Runs that --compare flags as regressions exit with
+status 1.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import platform
+import tempfile
+import itertools
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit, quote
+from concurrent.futures import ThreadPoolExecutor
+
+COPY_BUFFER = 1024 * 1024
+# Larger uploads go through the chunked upload API, as a browser would send them.
+MULTIPART_MAX = 8 * 1024 * 1024
+CHUNK_SIZE = 8 * 1024 * 1024
+PAYLOAD_BLOCK = 64 * 1024
+# Names per /batch request in the batch scenario and when cleaning up.
+BATCH_NAMES = 100
+SEARCH_TOKENS = 97
+SCENARIOS = ('upload', 'download', 'list', 'sort', 'search', 'rename', 'trash', 'batch', 'mixed')
+# Share of each operation in the mixed workload.
+MIXED_WEIGHTS = {'download': 50, 'list': 15, 'search': 10, 'upload': 10, 'rename': 5, 'trash': 10}
+# A change this much worse than the baseline, in p95 latency or throughput, is a regression.
+REGRESSION_THRESHOLD = 0.2
+
+
+class BenchError(Exception):
+    pass
+
+
+UNITS = (('G', 1024 ** 3), ('M', 1024 ** 2), ('K', 1024))
+
+
+def parse_size(text):
+    # 100, 100B, 64K, 64KiB, 1G ...
+    text = text.strip().upper().removesuffix('IB').removesuffix('B')
+    number = text.rstrip('KMG')
+    return int(float(number) * dict(UNITS).get(text[len(number):], 1))
+
+
+def format_size(size):
+    for unit, scale in UNITS:
+        if size >= scale and size % scale == 0:
+            return f"{size // scale}{unit}"
+    return f"{size}B"
+
+
+class PayloadStream:
+    """Bytes start..start+length of a file made of one random block repeated.
+
+    They are made as they are read, so a GB-sized upload is never held in
+    memory on the client side.
+    """
+
+    def __init__(self, seed, start, length):
+        self._block = random.Random(seed).randbytes(PAYLOAD_BLOCK)
+        self._start = start
+        self._position = start
+        self._end = start + length
+        self.length = length
+
+    def tell(self):
+        return self._position - self._start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: self._start, io.SEEK_CUR: self._position, io.SEEK_END: self._end}[whence]
+        self._position = min(max(base + offset, self._start), self._end)
+        return self.tell()
+
+    def read(self, size=-1):
+        remaining = self._end - self._position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        offset = self._position % PAYLOAD_BLOCK
+        data = (self._block[offset:] + self._block * (size // PAYLOAD_BLOCK + 1))[:size]
+        self._position += size
+        return data
+
+
+def payload(seed, start, length):
+    return PayloadStream(seed, start, length).read()
+
+
+def seed_content(index, size):
+    text = f"seed file {index} token{index % SEARCH_TOKENS}\n".encode()
+    return (text * (size // len(text) + 1))[:size]
+
+
+def multipart(name, data, content_type='application/octet-stream'):
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode()
+    return head + data + f'\r\n--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+class InProcessClient:
+    """Calls the Flask app directly; each thread gets its own test client."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None, keep=False):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        if isinstance(body, PayloadStream):
+            response = client.open(path, method=method, input_stream=body, content_length=body.length,
+                                   headers=headers, buffered=False)
+        else:
+            response = client.open(path, method=method, data=body, headers=headers, buffered=False)
+        try:
+            if keep:
+                return response.status_code, b''.join(response.response)
+            return response.status_code, sum(len(block) for block in response.response)
+        finally:
+            response.close()
+
+
+class HttpClient:
+    """Keep-alive HTTP connections to a running server, one per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None, keep=False):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.connection_class(self.netloc, timeout=600, blocksize=COPY_BUFFER)
+        headers = dict(headers or {})
+        if isinstance(body, PayloadStream):
+            headers['Content-Length'] = str(body.length)
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = conn.getresponse()
+            if keep:
+                return response.status, response.read()
+            read = 0
+            while True:
+                block = response.read(COPY_BUFFER)
+                if not block:
+                    return response.status, read
+                read += len(block)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+def call(client, method, path, body=None, headers=None, keep=False):
+    status, data = client.request(method, path, body, headers, keep)
+    if status >= 400:
+        raise BenchError(f"{method} {path} returned {status}")
+    return data
+
+
+def call_json(client, method, path, document):
+    data = call(client, method, path, json.dumps(document).encode(), {'Content-Type': 'application/json'}, keep=True)
+    return json.loads(data) if data else None
+
+
+def upload(client, name, size, seed, content_type='application/octet-stream'):
+    """Upload size bytes as name; returns the bytes sent."""
+    if size <= MULTIPART_MAX:
+        body, form_type = multipart(name, payload(seed, 0, size), content_type)
+        call(client, 'POST', '/upload', body, {'Content-Type': form_type})
+        return size
+    manifest = call_json(client, 'POST', '/uploads', {'filename': name, 'size': size, 'chunk_size': CHUNK_SIZE})
+    for index in range(manifest["total_chunks"]):
+        start = index * manifest["chunk_size"]
+        chunk = PayloadStream(seed, start, min(manifest["chunk_size"], size - start))
+        call(client, 'PUT', f"/uploads/{manifest['upload_id']}/chunks/{index}", chunk,
+             {'Content-Type': 'application/octet-stream'})
+    call_json(client, 'POST', f"/uploads/{manifest['upload_id']}/complete", {'content_type': content_type})
+    return size
+
+
+def remove(client, names):
+    # Trash and then purge, a batch at a time.
+    for start in range(0, len(names), BATCH_NAMES):
+        group = names[start:start + BATCH_NAMES]
+        for op in ('delete', 'purge'):
+            call_json(client, 'POST', '/batch', {"operations": [{"op": op, "name": name} for name in group]})
+
+
+class RssSampler:
+    """Peak resident memory of a process while a scenario runs."""
+
+    def __init__(self, pid=None, interval=0.05):
+        self.path = f"/proc/{pid or 'self'}/status"
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def sample(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        if self.path == '/proc/self/status':
+            import resource
+            scale = 1 if sys.platform == 'darwin' else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        return 0
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.sample())
+
+    def __enter__(self):
+        self.peak = self.sample()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.sample())
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(make_op, concurrency, duration, max_ops, server_pid=None):
+    """Run one operation per worker in a loop; make_op(worker) returns a callable giving bytes moved."""
+    latencies = []
+    errors = []
+    moved = [0] * concurrency
+    deadline = time.perf_counter() + duration
+    budget = itertools.count()
+
+    def worker(index):
+        op = make_op(index)
+        while time.perf_counter() < deadline and (max_ops is None or next(budget) < max_ops):
+            started = time.perf_counter()
+            try:
+                moved[index] += op()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    with RssSampler(server_pid) as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(worker, range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    result = {
+        "ops": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "ops_per_second": round(len(latencies) / elapsed, 1),
+        "mb_per_second": round(sum(moved) / elapsed / 1e6, 2),
+        "p50_ms": None,
+        "p95_ms": None,
+        "p99_ms": None,
+        "max_ms": None,
+        "peak_rss_mb": round(rss.peak / 1e6, 1),
+    }
+    for key, fraction in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99), ("max_ms", 1.0)):
+        if latencies:
+            result[key] = round(percentile(latencies, fraction) * 1000, 2)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+class Workload:
+    """The operations of each scenario, over a data set of `files` seeded names."""
+
+    def __init__(self, client, files, seed_size, concurrency):
+        self.client = client
+        self.files = files
+        self.seed_size = seed_size
+        self.concurrency = concurrency
+        self.uploaded = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def seeded(index):
+        return f"seed-{index:07d}.txt"
+
+    def owned(self, worker, part):
+        # Renames and trash moves use the lower half of the data set and
+        # downloads the upper half, so a download never finds its name gone.
+        # Each worker has names of its own, one half for renames and the
+        # other for trash moves, so they never race.
+        return [self.seeded(index) for index in range(worker, self.files // 2, self.concurrency)][part::2]
+
+    def upload(self, worker, size):
+        counter = itertools.count()
+
+        def op():
+            name = f"upload-{worker}-{next(counter)}-{uuid.uuid4().hex[:8]}.bin"
+            sent = upload(self.client, name, size, seed=name)
+            with self._lock:
+                self.uploaded.append(name)
+            return sent
+        return op
+
+    def download(self, worker, name=None):
+        rng = random.Random(worker)
+        return lambda: call(self.client, 'GET',
+                            f"/download/{quote(name or self.seeded(rng.randrange(self.files // 2, self.files)))}")
+
+    def list(self, worker, sort_by='name'):
+        def op():
+            status, data = self.client.request('GET', f"/files?limit=100&sort_by={sort_by}", keep=True)
+            if status >= 400:
+                raise BenchError(f"GET /files returned {status}")
+            return len(data)
+        return op
+
+    def search(self, worker):
+        rng = random.Random(worker)
+        paths = itertools.cycle(['/files?limit=100&search=seed-00{}', '/search?q=token{}&limit=50'])
+
+        def op():
+            return call(self.client, 'GET', next(paths).format(rng.randrange(SEARCH_TOKENS)))
+        return op
+
+    def rename(self, worker):
+        names = itertools.cycle(self.owned(worker, 0))
+        renamed = set()
+
+        def op():
+            name = next(names)
+            old, new = (name + '.renamed', name) if name in renamed else (name, name + '.renamed')
+            call_json(self.client, 'PUT', '/rename', {"old_name": old, "new_name": new})
+            renamed.symmetric_difference_update({name})
+            return 0
+        return op
+
+    def trash(self, worker):
+        # Cycles through uploading a scratch file, trashing and purging it,
+        # then trashing and restoring one of the seeded files.
+        names = itertools.cycle(self.owned(worker, 1))
+        scratch = f"churn-{worker}.txt"
+        steps = itertools.cycle(['upload', 'delete-scratch', 'purge', 'delete', 'restore'])
+        current = [None]
+
+        def op():
+            step = next(steps)
+            if step == 'upload':
+                return upload(self.client, scratch, self.seed_size, seed=scratch, content_type='text/plain')
+            if step == 'delete-scratch':
+                return call(self.client, 'DELETE', f"/delete/{scratch}")
+            if step == 'purge':
+                return call(self.client, 'DELETE', f"/delete-permanent/{scratch}")
+            if step == 'delete':
+                current[0] = next(names)
+                return call(self.client, 'DELETE', f"/delete/{current[0]}")
+            return call(self.client, 'PUT', f"/restore/{current[0]}")
+        return op
+
+    def batch(self, worker):
+        names = self.owned(worker, 0)[:BATCH_NAMES]
+        forward = [True]
+
+        def op():
+            pairs = [(name, name + '.batch') for name in names]
+            operations = [{"op": "rename", "name": old, "new_name": new}
+                          for old, new in (pairs if forward[0] else [(b, a) for a, b in pairs])]
+            call_json(self.client, 'POST', '/batch', {"operations": operations})
+            forward[0] = not forward[0]
+            return 0
+        return op
+
+    def mixed(self, worker):
+        ops = {
+            'download': self.download(worker),
+            'list': self.list(worker),
+            'search': self.search(worker),
+            'upload': self.upload(worker, self.seed_size),
+            'rename': self.rename(worker),
+            'trash': self.trash(worker),
+        }
+        rng = random.Random(worker)
+        kinds = list(MIXED_WEIGHTS)
+        weights = [MIXED_WEIGHTS[kind] for kind in kinds]
+        return lambda: ops[rng.choices(kinds, weights)[0]]()
+
+    def finish(self):
+        # Undo renames and trash moves, whatever step they stopped at, and
+        # remove what was uploaded, so the next run starts from the same data set.
+        with self._lock:
+            names, self.uploaded = self.uploaded, []
+        status, data = self.client.request('GET', '/trash', keep=True)
+        trashed = [entry["name"] for entry in json.loads(data)] if status == 200 else []
+        operations = [{"op": "restore" if name.startswith('seed-') else "purge", "name": name} for name in trashed]
+        for suffix in ('.renamed', '.batch'):
+            status, data = self.client.request('GET', f"/files?search={suffix}", keep=True)
+            operations += [{"op": "rename", "name": entry["name"], "new_name": entry["name"].removesuffix(suffix)}
+                           for entry in (json.loads(data) if status == 200 else [])]
+        for start in range(0, len(operations), BATCH_NAMES):
+            call_json(self.client, 'POST', '/batch', {"operations": operations[start:start + BATCH_NAMES]})
+        status, data = self.client.request('GET', '/files?search=churn-', keep=True)
+        remove(self.client, names + [entry["name"] for entry in (json.loads(data) if status == 200 else [])])
+
+
+def seed(client, backend, start, files, seed_size, concurrency):
+    """Add seeded files start..files-1; returns files per second."""
+    started = time.perf_counter()
+    if backend is not None:
+        # In process the files are stored directly, which is many times faster
+        # than going through HTTP and does the same storage and catalog work.
+        for index in range(start, files):
+            backend.store_upload(Workload.seeded(index), io.BytesIO(seed_content(index, seed_size)), 'text/plain')
+    else:
+        def add(index):
+            body, form_type = multipart(Workload.seeded(index), seed_content(index, seed_size), 'text/plain')
+            call(client, 'POST', '/upload', body, {'Content-Type': form_type})
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(add, range(start, files)))
+    elapsed = time.perf_counter() - started
+    return (files - start) / elapsed if elapsed else None
+
+
+def wait_indexed(backend, timeout=300):
+    # Search results depend on the background content indexer having caught up.
+    deadline = time.time() + timeout
+    while backend.catalog.unindexed_hashes(1) and time.time() < deadline:
+        time.sleep(0.2)
+
+
+def scenario_plan(names, sizes, seed_size):
+    """(scenario, size, factory) for each scenario run; factory(workload, worker) returns the op."""
+    plan = []
+    for name in names:
+        if name == 'upload':
+            plan += [(name, size, lambda w, i, size=size: w.upload(i, size)) for size in sizes]
+        elif name == 'download':
+            plan.append((name, seed_size, lambda w, i: w.download(i)))
+            plan += [(name, size, lambda w, i, size=size: w.download(i, f"bench-{format_size(size)}.bin"))
+                     for size in sizes if size != seed_size]
+        elif name == 'sort':
+            plan += [(f"sort-{key}", None, lambda w, i, key=key: w.list(i, key)) for key in ('size', 'date')]
+        else:
+            plan.append((name, None, lambda w, i, name=name: getattr(w, name)(i)))
+    return plan
+
+
+def run(args, client, backend=None):
+    results = []
+    seeded = 0
+    for files in args.files:
+        rate = seed(client, backend, seeded, files, args.seed_size, max(args.concurrency))
+        seeded = files
+        if backend is not None:
+            wait_indexed(backend)
+        print(f"{files} files seeded ({rate:.0f} files/s)" if rate else f"{files} files seeded", file=sys.stderr)
+        for size in args.sizes:
+            if size != args.seed_size and 'download' in args.scenarios:
+                upload(client, f"bench-{format_size(size)}.bin", size, seed=size)
+        for scenario, size, factory in scenario_plan(args.scenarios, args.sizes, args.seed_size):
+            for concurrency in args.concurrency:
+                workload = Workload(client, files, args.seed_size, concurrency)
+                result = measure(lambda worker: factory(workload, worker), concurrency, args.duration,
+                                 args.max_ops, args.server_pid)
+                workload.finish()
+                row = dict(files=files, scenario=scenario, size=size, concurrency=concurrency, **result)
+                results.append(row)
+                print(format_row(row), file=sys.stderr)
+    return results
+
+
+def format_row(row):
+    size = f" {format_size(row['size'])}" if row["size"] is not None else ''
+    return (f"{row['files']:>7} {row['scenario'] + size:<18} c{row['concurrency']:<3} "
+            f"{row['ops_per_second']:>9.1f} op/s {row['mb_per_second']:>8.2f} MB/s  "
+            f"p50 {row['p50_ms']} p95 {row['p95_ms']} p99 {row['p99_ms']} ms  "
+            f"rss {row['peak_rss_mb']} MB" + (f"  errors {row['errors']}" if row["errors"] else ''))
+
+
+def result_key(row):
+    return (row["files"], row["scenario"], row["size"], row["concurrency"])
+
+
+def compare(baseline, results, threshold=REGRESSION_THRESHOLD):
+    """Print each result against the baseline; returns the keys that regressed."""
+    before = {result_key(row): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        old = before.get(result_key(row))
+        if old is None or not old["ops_per_second"] or old["p95_ms"] is None or row["p95_ms"] is None:
+            continue
+        throughput = row["ops_per_second"] / old["ops_per_second"] - 1
+        p95 = row["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0
+        regressed = throughput < -threshold or p95 > threshold
+        if regressed:
+            regressions.append(result_key(row))
+        print(f"{'REGRESSION ' if regressed else '           '}{format_row(row)}  "
+              f"throughput {throughput:+.0%} p95 {p95:+.0%}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def load_app(backend_name, folder):
+    # backend.py reads its settings from the environment and keeps its folders
+    # relative to the working directory, so both are set before the import.
+    os.environ.update(STORAGE_BACKEND=backend_name, BACKGROUND_JOBS='0', LOG_LEVEL='WARNING')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(folder)
+    import backend
+    # Seeding writes through backend.py directly, ahead of any request.
+    backend.start_services()
+    backend.reconciled.wait()
+    return backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help="Benchmark a running server instead of the app in this process")
+    parser.add_argument('--server-pid', type=int, help="Sample this process's memory instead of our own")
+    parser.add_argument('--backend', default='local', choices=('local', 'memory'),
+                        help="Storage for the app in this process (default local, in a scratch folder)")
+    parser.add_argument('--files', default='1000', help="Data set sizes to seed, e.g. 1000,10000,100000")
+    parser.add_argument('--seed-size', default='1K', help="Size of each seeded file")
+    parser.add_argument('--sizes', default='1K,1M,32M', help="File sizes for upload and download, e.g. 100B,1M,1G")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Any of {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,16', help="Client threads, e.g. 1,16,64")
+    parser.add_argument('--duration', type=float, default=5, help="Seconds per scenario run")
+    parser.add_argument('--max-ops', type=int, help="Stop a scenario run after this many operations")
+    parser.add_argument('--output', help="Write the results here as JSON")
+    parser.add_argument('--compare', help="Results file to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="Fractional change in p95 or throughput counted as a regression")
+    args = parser.parse_args()
+    args.files = sorted(int(n) for n in args.files.split(','))
+    args.seed_size = parse_size(args.seed_size)
+    args.sizes = [parse_size(size) for size in args.sizes.split(',') if size]
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    args.concurrency = [int(n) for n in args.concurrency.split(',')]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    meta = {
+        "started_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "target": args.url or f"in-process {args.backend}",
+        "seed_size": args.seed_size,
+        "duration": args.duration,
+    }
+    if args.url:
+        results = run(args, HttpClient(args.url))
+    else:
+        with tempfile.TemporaryDirectory(prefix='benchmark-') as folder:
+            backend = load_app(args.backend, folder)
+            results = run(args, InProcessClient(backend.app), backend)
+            os.chdir(os.path.dirname(folder))
+    document = {"meta": meta, "results": results}
+    if output:
+        with open(output, 'w') as f:
+            json.dump(document, f, indent=1)
+    if baseline is not None:
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.compare}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
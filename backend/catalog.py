@@ -0,0 +1,575 @@
+import os
+import json
+import re
+import base64
+import sqlite3
+import time
+import threading
+import logging
+
+UPLOADS = 'uploads'
+TRASH = 'trash'
+
+# Each migration bumps PRAGMA user_version by one, so existing catalogs are
+# upgraded in place instead of being rebuilt.
+_MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS files (
+        location TEXT NOT NULL,
+        name TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        PRIMARY KEY (location, name)
+    );
+    CREATE INDEX IF NOT EXISTS files_by_name ON files (location, name COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS files_by_size ON files (location, size, name);
+    CREATE INDEX IF NOT EXISTS files_by_mtime ON files (location, mtime, name);
+    """,
+    """
+    ALTER TABLE files ADD COLUMN sha256 TEXT;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS files_by_sha256 ON files (sha256);
+    """,
+    """
+    ALTER TABLE files ADD COLUMN deleted_at REAL;
+    UPDATE files SET deleted_at = mtime WHERE location = 'trash';
+    CREATE INDEX IF NOT EXISTS files_by_deleted_at ON files (location, deleted_at, name);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS versions (
+        name TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        archived_at REAL NOT NULL,
+        base_sha256 TEXT,
+        delta_sha256 TEXT,
+        PRIMARY KEY (name, version)
+    );
+    CREATE INDEX IF NOT EXISTS versions_by_sha256 ON versions (sha256);
+    CREATE INDEX IF NOT EXISTS versions_by_base ON versions (base_sha256);
+    CREATE INDEX IF NOT EXISTS versions_by_delta ON versions (delta_sha256);
+    """,
+    # Full-text search over names and contents. Text is extracted once per
+    # distinct content into content_text; file_search holds one row per file,
+    # keyed by the file's rowid and kept in step with files by triggers.
+    """
+    CREATE TABLE IF NOT EXISTS content_text (
+        sha256 TEXT PRIMARY KEY,
+        body TEXT
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5(
+        name, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    );
+    INSERT INTO file_search (rowid, name, body) SELECT rowid, name, NULL FROM files;
+    CREATE TRIGGER IF NOT EXISTS files_search_insert AFTER INSERT ON files BEGIN
+        INSERT INTO file_search (rowid, name, body)
+        VALUES (new.rowid, new.name, (SELECT body FROM content_text WHERE sha256 = new.sha256));
+    END;
+    CREATE TRIGGER IF NOT EXISTS files_search_delete AFTER DELETE ON files BEGIN
+        DELETE FROM file_search WHERE rowid = old.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS files_search_update AFTER UPDATE OF name, sha256 ON files BEGIN
+        DELETE FROM file_search WHERE rowid = old.rowid;
+        INSERT INTO file_search (rowid, name, body)
+        VALUES (new.rowid, new.name, (SELECT body FROM content_text WHERE sha256 = new.sha256));
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_text_insert AFTER INSERT ON content_text BEGIN
+        UPDATE file_search SET body = new.body
+        WHERE rowid IN (SELECT rowid FROM files WHERE sha256 = new.sha256);
+    END;
+    """,
+    # Objects kept compressed, with the level used and the bytes it saved.
+    """
+    CREATE TABLE IF NOT EXISTS encodings (
+        sha256 TEXT PRIMARY KEY,
+        codec TEXT NOT NULL,
+        level INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        stored_size INTEGER NOT NULL,
+        encoded_at REAL NOT NULL
+    );
+    """,
+    # Change log for the /changes feed: one row per name that appeared, changed
+    # or went away in uploads or trash, numbered in commit order. Like
+    # file_search it is kept in step with files by triggers, so every write
+    # path is covered. A rename or move logs the old name going away and the
+    # new one appearing.
+    """
+    CREATE TABLE IF NOT EXISTS changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        location TEXT NOT NULL,
+        name TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS changes_by_location ON changes (location, seq);
+    CREATE TRIGGER IF NOT EXISTS files_changes_insert AFTER INSERT ON files BEGIN
+        INSERT INTO changes (location, name) VALUES (new.location, new.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS files_changes_delete AFTER DELETE ON files BEGIN
+        INSERT INTO changes (location, name) VALUES (old.location, old.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS files_changes_update
+    AFTER UPDATE OF location, name, size, type, mtime, deleted_at ON files BEGIN
+        INSERT INTO changes (location, name)
+        SELECT old.location, old.name WHERE old.location != new.location OR old.name != new.name;
+        INSERT INTO changes (location, name) VALUES (new.location, new.name);
+    END;
+    """,
+]
+
+_ORDER_BY = {
+    'name': 'name COLLATE NOCASE, name',
+    'size': 'size, name',
+    'date_modified': 'mtime DESC, name',
+    'date_deleted': 'deleted_at DESC, name',
+}
+
+_AFTER = {
+    'name': ' AND (name > ? COLLATE NOCASE OR (name = ? COLLATE NOCASE AND name > ?))',
+    'size': ' AND (size > ? OR (size = ? AND name > ?))',
+    'date_modified': ' AND (mtime < ? OR (mtime = ? AND name > ?))',
+    'date_deleted': ' AND (deleted_at < ? OR (deleted_at = ? AND name > ?))',
+}
+
+
+def sort_key(row, sort_by):
+    if sort_by == 'size':
+        return row['size']
+    if sort_by == 'date_modified':
+        return row['mtime']
+    if sort_by == 'date_deleted':
+        return row['deleted_at']
+    return row['name']
+
+
+def encode_cursor(sort_by, row):
+    payload = json.dumps([sort_by, sort_key(row, sort_by), row['name']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(sort_by, cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, key, name = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Malformed cursor")
+    if cursor_sort != sort_by:
+        raise ValueError("Cursor was issued for a different sort order")
+    return key, name
+
+
+def match_expression(text):
+    # Every word must appear, each as a prefix; quoting keeps user input from
+    # being read as FTS5 query syntax.
+    words = re.findall(r'\w+', text)
+    if not words:
+        raise ValueError("Search query has no words in it")
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def file_type(name):
+    return name.split('.')[-1] if '.' in name else "Unknown"
+
+
+class Catalog:
+    """SQLite index of everything stored under uploads/ and trash/."""
+
+    def __init__(self, path, migrate=True):
+        self.path = path
+        self._local = threading.local()
+        # SQLite allows a single writer; serialising writers here avoids
+        # SQLITE_BUSY retries under concurrent requests.
+        self._write_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The app migrates on its first request instead, to keep imports cheap.
+        if migrate:
+            self.migrate()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            # INSERT OR REPLACE only fires the delete triggers that keep
+            # file_search in step when recursive triggers are on.
+            conn.execute('PRAGMA recursive_triggers=ON')
+            self._local.conn = conn
+        return conn
+
+    def migrate(self):
+        conn = self._conn()
+        with self._write_lock:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+                conn.executescript(script)
+                conn.execute(f'PRAGMA user_version = {number}')
+                logging.info(f"Catalog migrated to schema version {number}")
+
+    def _write(self, sql, params=()):
+        conn = self._conn()
+        with self._write_lock, conn:
+            return conn.execute(sql, params)
+
+    def put(self, location, name, size, mtime, sha256=None, deleted_at=None):
+        self._write(
+            'INSERT OR REPLACE INTO files (location, name, size, type, mtime, sha256, deleted_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (location, name, size, file_type(name), mtime, sha256, deleted_at),
+        )
+
+    def remove(self, location, name):
+        return self._write('DELETE FROM files WHERE location = ? AND name = ?', (location, name)).rowcount > 0
+
+    def remove_many(self, location, names):
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.executemany('DELETE FROM files WHERE location = ? AND name = ?', [(location, n) for n in names])
+
+    def move(self, src_location, name, dest_location, new_name=None, mtime=None):
+        # UPDATE OR REPLACE carries every other column (hash etc.) across and
+        # overwrites whatever already sat at the destination. Moving into the
+        # trash stamps the deletion time; moving anywhere else clears it.
+        new_name = new_name or name
+        deleted_at = time.time() if dest_location == TRASH else None
+        cursor = self._write(
+            'UPDATE OR REPLACE files SET location = ?, name = ?, type = ?, mtime = COALESCE(?, mtime), deleted_at = ? '
+            'WHERE location = ? AND name = ?',
+            (dest_location, new_name, file_type(new_name), mtime, deleted_at, src_location, name),
+        )
+        return cursor.rowcount > 0
+
+    def set_sha256(self, location, name, sha256):
+        self._write('UPDATE files SET sha256 = ? WHERE location = ? AND name = ?', (sha256, location, name))
+
+    def refcount(self, sha256):
+        # Names in either uploads or trash keep an object alive, and so do
+        # versions: full snapshots hold their content, deltas hold the delta
+        # object, and the newest delta of a name holds the base it applies to
+        # until that base is itself kept as a version.
+        return self._conn().execute(
+            'SELECT (SELECT COUNT(*) FROM files WHERE sha256 = :h)'
+            ' + (SELECT COUNT(*) FROM versions WHERE sha256 = :h AND delta_sha256 IS NULL)'
+            ' + (SELECT COUNT(*) FROM versions WHERE delta_sha256 = :h)'
+            ' + (SELECT COUNT(*) FROM versions v WHERE v.base_sha256 = :h AND v.delta_sha256 IS NOT NULL'
+            '    AND NOT EXISTS (SELECT 1 FROM versions w WHERE w.name = v.name AND w.sha256 = v.base_sha256))',
+            {'h': sha256},
+        ).fetchone()[0]
+
+    def object_hashes(self, after='', limit=100):
+        """Every stored object the catalog refers to, in hash order after `after`."""
+        # Each arm is limited on its own index before the union, so a batch
+        # costs the same at any point of a pass.
+        return [row[0] for row in self._conn().execute(
+            'SELECT * FROM (SELECT sha256 FROM files WHERE sha256 > :a ORDER BY sha256 LIMIT :n)'
+            ' UNION SELECT * FROM (SELECT sha256 FROM versions WHERE sha256 > :a AND delta_sha256 IS NULL'
+            '  ORDER BY sha256 LIMIT :n)'
+            ' UNION SELECT * FROM (SELECT delta_sha256 FROM versions WHERE delta_sha256 > :a'
+            '  ORDER BY delta_sha256 LIMIT :n)'
+            ' UNION SELECT * FROM (SELECT base_sha256 FROM versions v WHERE base_sha256 > :a'
+            '  AND delta_sha256 IS NOT NULL'
+            '  AND NOT EXISTS (SELECT 1 FROM versions w WHERE w.name = v.name AND w.sha256 = v.base_sha256)'
+            '  ORDER BY base_sha256 LIMIT :n)'
+            ' ORDER BY 1 LIMIT :n',
+            {'a': after, 'n': limit},
+        )]
+
+    def references(self, sha256):
+        """Names and versions that refer to an object, for reports."""
+        conn = self._conn()
+        names = [f"{row[0]}/{row[1]}" for row in conn.execute(
+            'SELECT location, name FROM files WHERE sha256 = ?', (sha256,))]
+        versions = [f"{row[0]}@{row[1]}" for row in conn.execute(
+            'SELECT name, version FROM versions WHERE sha256 = ? OR delta_sha256 = ? OR base_sha256 = ?',
+            (sha256, sha256, sha256))]
+        return names + versions
+
+    def delta_versions(self, sha256):
+        # Versions that can rebuild this content from a delta and a newer base.
+        return [dict(row) for row in self._conn().execute(
+            'SELECT * FROM versions WHERE sha256 = ? AND delta_sha256 IS NOT NULL ORDER BY version DESC', (sha256,)
+        )]
+
+    def unhashed(self, location):
+        return [row[0] for row in self._conn().execute(
+            'SELECT name FROM files WHERE location = ? AND sha256 IS NULL', (location,)
+        )]
+
+    def get(self, location, name):
+        row = self._conn().execute(
+            'SELECT * FROM files WHERE location = ? AND name = ?', (location, name)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def query(self, location, search=None, sort_by='name', after=None, limit=None):
+        # Keyset pagination: `after` is the (sort key, name) of the last row already
+        # returned, so every page is an index range scan no matter how deep it is.
+        sort_by = sort_by if sort_by in _ORDER_BY else 'name'
+        sql = 'SELECT location, name, size, type, mtime, deleted_at, sha256 FROM files WHERE location = ?'
+        params = [location]
+        if search:
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            sql += " AND name LIKE ? ESCAPE '\\'"
+            params.append(f'%{escaped}%')
+        if after is not None:
+            key, name = after
+            sql += _AFTER[sort_by]
+            params.extend([key, key, name])
+        sql += f" ORDER BY {_ORDER_BY[sort_by]}"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        for row in self._conn().execute(sql, params):
+            yield dict(row)
+
+    def names(self, location):
+        return [row[0] for row in self._conn().execute('SELECT name FROM files WHERE location = ?', (location,))]
+
+    def oldest_deleted(self, limit, before=None):
+        # Trash rows in deletion order, optionally only those deleted before a cutoff.
+        sql = 'SELECT name, size, deleted_at FROM files WHERE location = ?'
+        params = [TRASH]
+        if before is not None:
+            sql += ' AND deleted_at < ?'
+            params.append(before)
+        sql += ' ORDER BY deleted_at, name LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self._conn().execute(sql, params)]
+
+    def usage(self, location):
+        count, size = self._conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files WHERE location = ?', (location,)
+        ).fetchone()
+        return count, size
+
+    def next_version(self, name):
+        row = self._conn().execute('SELECT MAX(version) FROM versions WHERE name = ?', (name,)).fetchone()
+        return (row[0] or 0) + 1
+
+    def add_version(self, name, version, previous, base_sha256, delta_sha256):
+        self._write(
+            'INSERT INTO versions (name, version, sha256, size, mtime, archived_at, base_sha256, delta_sha256) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (name, version, previous["sha256"], previous["size"], previous["mtime"], time.time(), base_sha256, delta_sha256),
+        )
+
+    def versions(self, name):
+        return [dict(row) for row in self._conn().execute(
+            'SELECT * FROM versions WHERE name = ? ORDER BY version DESC', (name,)
+        )]
+
+    def get_version(self, name, version):
+        row = self._conn().execute(
+            'SELECT * FROM versions WHERE name = ? AND version = ?', (name, version)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def version_by_sha256(self, name, sha256):
+        # The newest one: its base is always newer content, so following bases
+        # from there can never loop.
+        row = self._conn().execute(
+            'SELECT * FROM versions WHERE name = ? AND sha256 = ? ORDER BY version DESC LIMIT 1', (name, sha256)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def prune_versions(self, name, keep):
+        conn = self._conn()
+        with self._write_lock, conn:
+            rows = [dict(row) for row in conn.execute(
+                'SELECT * FROM versions WHERE name = ? ORDER BY version DESC LIMIT -1 OFFSET ?', (name, keep)
+            )]
+            conn.executemany('DELETE FROM versions WHERE name = ? AND version = ?',
+                             [(name, row["version"]) for row in rows])
+        return rows
+
+    def drop_versions(self, name):
+        return self.prune_versions(name, 0)
+
+    def rename_versions(self, name, new_name):
+        # Renumbered after any history new_name already has, so nothing collides.
+        self._write(
+            'UPDATE versions SET name = ?, version = version + '
+            '(SELECT COALESCE(MAX(version), 0) FROM versions WHERE name = ?) WHERE name = ?',
+            (new_name, new_name, name),
+        )
+
+    def has_name(self, name):
+        return self._conn().execute('SELECT 1 FROM files WHERE name = ? LIMIT 1', (name,)).fetchone() is not None
+
+    def has_text(self, sha256):
+        return self._conn().execute('SELECT 1 FROM content_text WHERE sha256 = ?', (sha256,)).fetchone() is not None
+
+    def put_text(self, sha256, body):
+        # body is None for content that is not text, so it is not tried again.
+        self._write('INSERT OR IGNORE INTO content_text (sha256, body) VALUES (?, ?)', (sha256, body))
+
+    def forget_text(self, sha256):
+        self._write('DELETE FROM content_text WHERE sha256 = ?', (sha256,))
+
+    def change_seq(self, location=None):
+        """The newest change, to uploads or trash or to either.
+
+        Every change a listing reflects is numbered at most this. When the
+        log has been pruned past a location's last change, the newest change
+        overall stands in, so the value never repeats for different contents.
+        """
+        conn = self._conn()
+        seq = None
+        if location is not None:
+            seq = conn.execute('SELECT MAX(seq) FROM changes WHERE location = ?', (location,)).fetchone()[0]
+        if seq is None:
+            seq = conn.execute('SELECT MAX(seq) FROM changes').fetchone()[0]
+        return seq or 0
+
+    def oldest_change(self):
+        return self._conn().execute('SELECT MIN(seq) FROM changes').fetchone()[0]
+
+    def changes(self, since, limit):
+        # The latest change per name after `since`, with the name's current
+        # row, or no row once it is gone. Reading the current row rather than
+        # what the change wrote makes replaying a feed idempotent.
+        return [dict(row) for row in self._conn().execute(
+            'SELECT c.seq, c.location, c.name, f.size, f.type, f.mtime, f.deleted_at, f.location IS NOT NULL AS present'
+            ' FROM (SELECT location, name, MAX(seq) AS seq FROM changes WHERE seq > ?'
+            '       GROUP BY location, name ORDER BY seq LIMIT ?) c'
+            ' LEFT JOIN files f ON f.location = c.location AND f.name = c.name'
+            ' ORDER BY c.seq',
+            (since, limit),
+        )]
+
+    def prune_changes(self, keep):
+        # Keeps the newest `keep` changes, and always the newest one.
+        return self._write(
+            'DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?', (max(keep, 1),)
+        ).rowcount
+
+    def put_encoding(self, sha256, size, codec, level, stored_size):
+        self._write(
+            'INSERT OR REPLACE INTO encodings (sha256, codec, level, size, stored_size, encoded_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (sha256, codec, level, size, stored_size, time.time()),
+        )
+
+    def forget_encoding(self, sha256):
+        self._write('DELETE FROM encodings WHERE sha256 = ?', (sha256,))
+
+    def cold_encodings(self, codec, below_level, deleted_before, limit):
+        # Compressed objects held only by trash entries deleted before the
+        # cutoff, and not yet at the cold level.
+        return [dict(row) for row in self._conn().execute(
+            "SELECT e.* FROM encodings e WHERE e.codec = ? AND e.level < ?"
+            " AND EXISTS (SELECT 1 FROM files f WHERE f.sha256 = e.sha256 AND f.location = 'trash'"
+            "             AND f.deleted_at < ?)"
+            " AND NOT EXISTS (SELECT 1 FROM files f WHERE f.sha256 = e.sha256"
+            "                 AND (f.location = 'uploads' OR f.deleted_at >= ?))"
+            " LIMIT ?",
+            (codec, below_level, deleted_before, deleted_before, limit),
+        )]
+
+    def encoding_summary(self):
+        rows = self._conn().execute(
+            'SELECT codec, level, COUNT(*) AS objects, SUM(size) AS size, SUM(stored_size) AS stored_size '
+            'FROM encodings GROUP BY codec, level ORDER BY codec, level'
+        ).fetchall()
+        levels = [dict(row, ratio=row["stored_size"] / row["size"] if row["size"] else None) for row in rows]
+        size = sum(row["size"] for row in levels)
+        stored_size = sum(row["stored_size"] for row in levels)
+        return {
+            "objects": sum(row["objects"] for row in levels),
+            "size": size,
+            "stored_size": stored_size,
+            "ratio": stored_size / size if size else None,
+            "levels": levels,
+        }
+
+    def unindexed_hashes(self, limit):
+        return [row[0] for row in self._conn().execute(
+            'SELECT DISTINCT sha256 FROM files WHERE sha256 IS NOT NULL '
+            'AND sha256 NOT IN (SELECT sha256 FROM content_text) LIMIT ?', (limit,)
+        )]
+
+    def search(self, text, location=None, type=None, min_size=None, max_size=None,
+               modified_after=None, modified_before=None, limit=50):
+        # Ranked by BM25 with name matches weighted well above body matches.
+        sql = (
+            "SELECT f.location, f.name, f.size, f.type, f.mtime, f.deleted_at, "
+            "bm25(file_search, 10.0, 1.0) AS rank, "
+            "snippet(file_search, -1, '[', ']', '...', 12) AS snippet "
+            "FROM file_search JOIN files f ON f.rowid = file_search.rowid "
+            "WHERE file_search MATCH ?"
+        )
+        params = [match_expression(text)]
+        for clause, value in (
+            (' AND f.location = ?', location),
+            (' AND f.type = ? COLLATE NOCASE', type),
+            (' AND f.size >= ?', min_size),
+            (' AND f.size <= ?', max_size),
+            (' AND f.mtime >= ?', modified_after),
+            (' AND f.mtime <= ?', modified_before),
+        ):
+            if value is not None:
+                sql += clause
+                params.append(value)
+        sql += ' ORDER BY rank LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self._conn().execute(sql, params)]
+
+    def reconcile(self, location, entries):
+        # entries: iterable of (name, size, mtime, sha256) as currently found in
+        # storage; sha256 is None where the scan cannot tell. A name linked to
+        # content stored earlier is recorded later than its file's mtime, so
+        # only a newer mtime means it changed outside the server.
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS scan (name TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT)')
+            conn.execute('DELETE FROM scan')
+            conn.executemany('INSERT OR REPLACE INTO scan (name, size, mtime, sha256) VALUES (?, ?, ?, ?)', entries)
+            removed = conn.execute(
+                'DELETE FROM files WHERE location = ? AND name NOT IN (SELECT name FROM scan)', (location,)
+            ).rowcount
+            rows = conn.execute(
+                'SELECT s.name, s.size, s.mtime, s.sha256, f.deleted_at FROM scan s LEFT JOIN files f ON f.location = ? AND f.name = s.name '
+                'WHERE f.name IS NULL OR f.size != s.size OR f.mtime < s.mtime '
+                'OR (s.sha256 IS NOT NULL AND f.sha256 IS NOT s.sha256)',
+                (location,),
+            ).fetchall()
+            # A trash entry found only by the scan has no recorded deletion time;
+            # its mtime is the closest thing storage keeps.
+            conn.executemany(
+                'INSERT OR REPLACE INTO files (location, name, size, type, mtime, sha256, deleted_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(location, r['name'], r['size'], file_type(r['name']), r['mtime'], r['sha256'],
+                  r['deleted_at'] or (r['mtime'] if location == TRASH else None)) for r in rows],
+            )
+            conn.execute('DELETE FROM scan')
+        logging.info(f"Catalog reconciled {location}: {len(rows)} updated, {removed} removed")
+        return len(rows), removed
+
+
+def scan_directory(folder):
+    # os.scandir returns the d_type with each entry, so only one stat per file is needed
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file():
+                st = entry.stat()
+                yield entry.name, st.st_size, st.st_mtime, None
+
+
+def scan_bucket(bucket, prefix):
+    for blob in bucket.list_blobs(prefix=f'{prefix}/'):
+        if blob.name == f'{prefix}/':
+            continue
+        # Names written through the object store are empty pointers that carry
+        # the real size and hash in their metadata.
+        metadata = blob.metadata or {}
+        yield (
+            blob.name[len(prefix) + 1:],
+            int(metadata['size']) if 'size' in metadata else blob.size or 0,
+            blob.updated.timestamp() if blob.updated else 0,
+            metadata.get('sha256'),
+        )
@@ -0,0 +1,95 @@
+import time
+import threading
+import logging
+
+# Changes per /changes response or stream batch.
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+# Seconds between comments on an idle stream, so proxies keep it open.
+KEEPALIVE_INTERVAL = 15
+
+
+class FeedError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ChangeFeed:
+    """Tells clients which names changed since a change sequence number.
+
+    The catalog numbers every change to uploads and trash; a client that
+    listed a location at sequence N asks for the changes after N and
+    applies them to its copy instead of listing again. The log keeps the
+    newest `keep` changes; a client further behind than that gets a 410
+    and lists again.
+
+    A poller reads the newest sequence number every poll_interval seconds
+    and wakes the streams waiting for it, so changes made by other
+    processes sharing the catalog are seen too. At most max_streams
+    clients hold a stream open at once, since each one occupies a server
+    thread; the rest get a 503 and poll /changes instead.
+    """
+
+    def __init__(self, catalog, keep=100000, poll_interval=0.5, prune_interval=60, max_streams=8):
+        self.catalog = catalog
+        self.keep = keep
+        self.poll_interval = poll_interval
+        self.prune_interval = prune_interval
+        self._seq = 0
+        self._condition = threading.Condition()
+        self._streams = threading.BoundedSemaphore(max_streams) if max_streams else None
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def changes(self, since, limit=DEFAULT_LIMIT):
+        """The changes after `since`, oldest first, at most `limit` of them."""
+        oldest = self.catalog.oldest_change()
+        if since < 0 or (oldest is not None and since < oldest - 1):
+            raise FeedError("Changes since then are no longer kept; list the files again", 410)
+        latest = self.catalog.change_seq()
+        if since > latest:
+            raise FeedError("That change has not happened yet; list the files again", 410)
+        return self.catalog.changes(since, min(limit, MAX_LIMIT)), latest
+
+    def wait(self, since, timeout):
+        """Block until a change after `since` or the timeout; returns the newest sequence number."""
+        self.start()
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > since, timeout)
+            return self._seq
+
+    def open_stream(self):
+        return self._streams is not None and self._streams.acquire(blocking=False)
+
+    def close_stream(self):
+        self._streams.release()
+
+    def _loop(self):
+        pruned_at = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                seq = self.catalog.change_seq()
+                if seq != self._seq:
+                    with self._condition:
+                        self._seq = seq
+                        self._condition.notify_all()
+                if self.keep and time.monotonic() - pruned_at >= self.prune_interval:
+                    pruned_at = time.monotonic()
+                    self.catalog.prune_changes(self.keep)
+            except Exception as e:
+                logging.error(f"Change feed poll failed: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        # Started with the other background jobs, or by the first stream.
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._seq = self.catalog.change_seq()
+            self._thread = threading.Thread(target=self._loop, name='change-feed', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
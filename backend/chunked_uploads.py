@@ -0,0 +1,227 @@
+import os
+import io
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+COPY_BUFFER = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _ChunkReader(io.RawIOBase):
+    # Presents the staged chunks as one continuous read-only stream, holding
+    # at most a single open chunk file at a time.
+
+    def __init__(self, paths):
+        self._paths = list(paths)
+        self._current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self._current is None:
+                if not self._paths:
+                    return 0
+                self._current = open(self._paths.pop(0), 'rb')
+            n = self._current.readinto(buffer)
+            if n:
+                return n
+            self._current.close()
+            self._current = None
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        super().close()
+
+
+class HashingReader(io.RawIOBase):
+    # Computes the SHA-256 of everything read through it.
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_read
+
+    def readinto(self, buffer):
+        # read() rather than readinto() so any file-like object can be wrapped,
+        # including the spooled temp files werkzeug hands out for uploads.
+        data = self._raw.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        if n:
+            self.sha256.update(data)
+            self.bytes_read += n
+        return n
+
+
+class ChunkedUploads:
+    """Upload sessions staged on disk one chunk per file, so they can be resumed.
+
+    Sessions untouched for max_age seconds are removed by a sweep every
+    sweep_interval seconds: in a background thread once started, otherwise
+    at most that often from init.
+    """
+
+    def __init__(self, staging_folder, max_age=24 * 3600, sweep_interval=15 * 60):
+        self.staging_folder = staging_folder
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._swept_at = 0
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(staging_folder, exist_ok=True)
+
+    def _session_dir(self, upload_id):
+        # upload ids are generated by us; reject anything that could escape the staging folder
+        if not upload_id or not all(c in '0123456789abcdef' for c in upload_id):
+            raise UploadError("Unknown upload id", 404)
+        path = os.path.join(self.staging_folder, upload_id)
+        if not os.path.isdir(path):
+            raise UploadError("Unknown upload id", 404)
+        return path
+
+    def _chunk_path(self, session_dir, index):
+        return os.path.join(session_dir, f'chunk-{index:08d}')
+
+    def manifest(self, upload_id):
+        with open(os.path.join(self._session_dir(upload_id), 'manifest.json')) as f:
+            return json.load(f)
+
+    def init(self, filename, size, chunk_size=None):
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise UploadError("size must be a non-negative integer")
+        if chunk_size is not None and (not isinstance(chunk_size, int) or isinstance(chunk_size, bool)):
+            raise UploadError("chunk_size must be an integer")
+        chunk_size = min(max(chunk_size or DEFAULT_CHUNK_SIZE, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        if self._thread is None and time.monotonic() - self._swept_at >= self.sweep_interval:
+            self._swept_at = time.monotonic()
+            self.expire()
+        upload_id = uuid.uuid4().hex
+        session_dir = os.path.join(self.staging_folder, upload_id)
+        os.makedirs(session_dir)
+        manifest = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "size": size,
+            "chunk_size": chunk_size,
+            "total_chunks": max(1, -(-size // chunk_size)),
+            "created": time.time(),
+        }
+        with open(os.path.join(session_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        return manifest
+
+    def expected_chunk_length(self, manifest, index):
+        if index == manifest["total_chunks"] - 1:
+            return manifest["size"] - index * manifest["chunk_size"]
+        return manifest["chunk_size"]
+
+    def write_chunk(self, upload_id, index, stream, expected_sha256=None):
+        session_dir = self._session_dir(upload_id)
+        manifest = self.manifest(upload_id)
+        if not 0 <= index < manifest["total_chunks"]:
+            raise UploadError(f"Chunk index must be between 0 and {manifest['total_chunks'] - 1}")
+        expected_length = self.expected_chunk_length(manifest, index)
+
+        # Stream into a temporary file and only rename it into place once the
+        # length and checksum match, so a dropped connection never leaves a
+        # half-written chunk that looks complete.
+        final_path = self._chunk_path(session_dir, index)
+        part_path = f'{final_path}.{uuid.uuid4().hex}.part'
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with open(part_path, 'wb') as out:
+                while True:
+                    block = stream.read(COPY_BUFFER)
+                    if not block:
+                        break
+                    written += len(block)
+                    if written > expected_length:
+                        raise UploadError(f"Chunk {index} is larger than {expected_length} bytes")
+                    digest.update(block)
+                    out.write(block)
+            if written != expected_length:
+                raise UploadError(f"Chunk {index} has {written} bytes, expected {expected_length}")
+            sha256 = digest.hexdigest()
+            if expected_sha256 and expected_sha256.lower() != sha256:
+                raise UploadError(f"Checksum mismatch for chunk {index}", 422)
+            os.replace(part_path, final_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        return {"index": index, "size": written, "sha256": sha256}
+
+    def status(self, upload_id):
+        session_dir = self._session_dir(upload_id)
+        manifest = self.manifest(upload_id)
+        received = sorted(
+            int(name[len('chunk-'):]) for name in os.listdir(session_dir)
+            if name.startswith('chunk-') and not name.endswith('.part')
+        )
+        present = set(received)
+        missing = [i for i in range(manifest["total_chunks"]) if i not in present]
+        return dict(manifest, received=received, missing=missing)
+
+    def open_assembled(self, upload_id):
+        status = self.status(upload_id)
+        if status["missing"]:
+            raise UploadError(f"Upload is missing {len(status['missing'])} chunk(s)", 409)
+        session_dir = self._session_dir(upload_id)
+        paths = [self._chunk_path(session_dir, i) for i in range(status["total_chunks"])]
+        return status, io.BufferedReader(_ChunkReader(paths), buffer_size=COPY_BUFFER)
+
+    def discard(self, upload_id):
+        shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+
+    def expire(self):
+        cutoff = time.time() - self.max_age
+        with os.scandir(self.staging_folder) as entries:
+            for entry in entries:
+                # A session completed or aborted meanwhile is already gone.
+                try:
+                    if not entry.is_dir() or entry.stat().st_mtime >= cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logging.info(f"Expired stale upload session {entry.name}")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.expire()
+            except Exception as e:
+                logging.error(f"Upload session sweep failed: {e}")
+            self._stop.wait(self.sweep_interval)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='upload-sweep', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,465 @@
+import io
+import time
+import tempfile
+import bisect
+import hashlib
+import logging
+import threading
+import contextlib
+import requests
+from requests.adapters import HTTPAdapter
+
+VNODES = 128
+# A node that failed a request is skipped for this long before it is tried again.
+RETRY_AFTER = 10
+# Weight of the newest sample in a node's moving-average latency.
+LATENCY_ALPHA = 0.2
+# Objects copied between nodes are held in memory up to this size, on disk beyond it.
+COPY_SPOOL_BYTES = 8 * 1024 * 1024
+COPY_CHUNK = 256 * 1024
+
+
+class NodeUnavailable(OSError):
+    pass
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing with virtual nodes.
+
+    Each node owns vnodes points on a 64-bit ring and a key belongs to the
+    nodes whose points follow its hash clockwise. Adding or removing a node
+    only moves the keys next to that node's points, about 1/len(nodes) of
+    them. Rings are never changed in place; membership changes build a new one.
+    """
+
+    def __init__(self, nodes=(), vnodes=VNODES):
+        self.vnodes = vnodes
+        self.nodes = frozenset(nodes)
+        points = sorted((ring_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def with_node(self, node):
+        return HashRing(self.nodes | {node}, self.vnodes)
+
+    def without_node(self, node):
+        return HashRing(self.nodes - {node}, self.vnodes)
+
+    def preference_list(self, key, n, skip=frozenset()):
+        """The first n distinct nodes clockwise from key's hash, passing over those in skip."""
+        n = min(n, len(self.nodes - skip))
+        found = []
+        if not n:
+            return found
+        start = bisect.bisect(self._hashes, ring_hash(key))
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in found and node not in skip:
+                found.append(node)
+                if len(found) == n:
+                    break
+        return found
+
+
+class NodeClient:
+    """HTTP calls to one storage node, tracking its latency and failures."""
+
+    def __init__(self, address, session, timeout=10):
+        self.address = address
+        self.session = session
+        self.timeout = timeout
+        self.latency = None
+        self.failures = 0
+        # Set by the health monitor while the node misses heartbeats.
+        self.suspected = False
+        self._down_until = 0
+
+    @property
+    def healthy(self):
+        return not self.suspected and time.monotonic() >= self._down_until
+
+    def _request(self, method, path, **kwargs):
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, f'http://{self.address}{path}', timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            self.failures += 1
+            self._down_until = time.monotonic() + RETRY_AFTER
+            raise NodeUnavailable(f"Storage node {self.address} is unavailable: {e}")
+        elapsed = time.monotonic() - started
+        self.latency = elapsed if self.latency is None else (1 - LATENCY_ALPHA) * self.latency + LATENCY_ALPHA * elapsed
+        self._down_until = 0
+        if response.status_code >= 500:
+            response.close()
+            raise NodeUnavailable(f"Storage node {self.address} answered {response.status_code}")
+        return response
+
+    def put(self, sha256, stream, size):
+        response = self._request('PUT', f'/objects/{sha256}', data=stream, headers={'Content-Length': str(size)})
+        response.raise_for_status()
+
+    def get(self, sha256, start=0, end=None):
+        # None when the node does not hold the object; empty past its end.
+        headers = {}
+        if start or end is not None:
+            headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+        response = self._request('GET', f'/objects/{sha256}', headers=headers)
+        if response.status_code == 404:
+            return None
+        if response.status_code == 416:
+            return b''
+        response.raise_for_status()
+        return response.content
+
+    def open(self, sha256):
+        response = self._request('GET', f'/objects/{sha256}', stream=True)
+        if response.status_code == 404:
+            response.close()
+            return None
+        response.raise_for_status()
+        return response
+
+    def size(self, sha256):
+        response = self._request('HEAD', f'/objects/{sha256}')
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return int(response.headers['Content-Length'])
+
+    def delete(self, sha256):
+        self._request('DELETE', f'/objects/{sha256}').raise_for_status()
+
+    def ping(self):
+        self._request('GET', '/health').raise_for_status()
+
+    def list(self):
+        response = self._request('GET', '/objects', stream=True)
+        response.raise_for_status()
+        with response:
+            return {line for line in response.iter_lines(decode_unicode=True) if line}
+
+    def status(self):
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+            "failures": self.failures,
+            "suspected": self.suspected,
+        }
+
+
+class Throttle:
+    # Paces a stream of bytes to at most rate bytes per second; 0 means unlimited.
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + n / self.rate
+            delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ObjectReader(io.RawIOBase):
+    # Seekable reads of one object, fetched by Range requests from whichever
+    # replica answers first, so a replica failing mid-download is skipped.
+
+    def __init__(self, cluster, sha256, size=None):
+        self.cluster = cluster
+        self.sha256 = sha256
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def size(self):
+        if self._size is None:
+            self._size = self.cluster.size(self.sha256)
+        return self._size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size()
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def readinto(self, buffer):
+        if not len(buffer) or (self._size is not None and self._pos >= self._size):
+            return 0
+        data = self.cluster.read(self.sha256, self._pos, self._pos + len(buffer) - 1)
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        return n
+
+    def readall(self):
+        # One request for the rest of the object rather than one per buffer.
+        data = self.cluster.read(self.sha256, self._pos)
+        self._pos += len(data)
+        return data
+
+
+class Cluster:
+    """Storage nodes arranged on a hash ring, each object kept on `replicas` of them.
+
+    Writes go to an object's owners, falling through to the next nodes on the
+    ring when an owner is down, and succeed once a majority of the replicas
+    are stored. Reads try the healthy, lowest-latency replica first. Nodes
+    marked dead are left out of placement, so a rebalance re-replicates
+    whatever they held; copies between nodes are paced to copy_bandwidth
+    bytes per second.
+    """
+
+    def __init__(self, addresses, replicas=3, vnodes=VNODES, timeout=10, pool_size=16, copy_bandwidth=0):
+        self.replicas = replicas
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.nodes = {address: NodeClient(address, self.session, timeout) for address in addresses}
+        self.ring = HashRing(addresses, vnodes)
+        self.dead = frozenset()
+        self.throttle = Throttle(copy_bandwidth)
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._rebalance = {"running": False, "copied": 0, "deleted": 0, "orphans": 0, "errors": 0, "finished_at": None}
+        self._rebalance_again = False
+
+    @property
+    def write_quorum(self):
+        return min(self.replicas, len(self.ring.nodes)) // 2 + 1
+
+    def owners(self, sha256, ring=None):
+        return (ring or self.ring).preference_list(sha256, self.replicas, skip=self.dead)
+
+    def read_order(self, sha256):
+        # Owners first, then the rest of the ring where a write may have
+        # fallen through, then nodes still being drained after leaving it;
+        # within each, healthy nodes by measured latency.
+        ring = self.ring
+        nodes = dict(self.nodes)
+        owners = self.owners(sha256, ring)
+        rest = [address for address in ring.preference_list(sha256, len(ring.nodes)) if address not in owners]
+        leaving = [address for address in nodes if address not in ring.nodes]
+
+        def nearest(addresses):
+            found = [nodes[address] for address in addresses if address in nodes]
+            return sorted(found, key=lambda node: (not node.healthy, node.latency or 0))
+
+        return nearest(owners) + nearest(rest) + nearest(leaving)
+
+    def write(self, sha256, open_source, size):
+        """Store an object on its owners; open_source returns a fresh stream over its bytes."""
+        ring = self.ring
+        stored = []
+        for address in ring.preference_list(sha256, len(ring.nodes), skip=self.dead):
+            node = self.nodes[address]
+            if not node.healthy:
+                continue
+            try:
+                with open_source() as source:
+                    node.put(sha256, source, size)
+            except (NodeUnavailable, requests.HTTPError) as e:
+                logging.warning(f"Could not store {sha256} on {address}: {e}")
+                continue
+            stored.append(address)
+            if len(stored) == self.replicas:
+                break
+        if len(stored) < self.write_quorum:
+            raise NodeUnavailable(f"Stored {sha256} on {len(stored)} nodes; {self.write_quorum} are required")
+        return stored
+
+    def read(self, sha256, start=0, end=None):
+        for node in self.read_order(sha256):
+            try:
+                data = node.get(sha256, start, end)
+            except NodeUnavailable as e:
+                logging.warning(str(e))
+                continue
+            if data is not None:
+                return data
+        raise FileNotFoundError(f"No storage node holds {sha256}")
+
+    def size(self, sha256):
+        for node in self.read_order(sha256):
+            try:
+                size = node.size(sha256)
+            except NodeUnavailable:
+                continue
+            if size is not None:
+                return size
+        raise FileNotFoundError(f"No storage node holds {sha256}")
+
+    def open(self, sha256, size=None, buffer_size=1024 * 1024):
+        return io.BufferedReader(ObjectReader(self, sha256, size), buffer_size)
+
+    def delete(self, sha256):
+        # A write may have fallen through past the owners, so every node is
+        # asked. Dead nodes are skipped; the rebalance after they recover
+        # drops what they still hold.
+        dead = self.dead
+        for node in list(self.nodes.values()):
+            if node.address in dead:
+                continue
+            try:
+                node.delete(sha256)
+            except (NodeUnavailable, requests.HTTPError) as e:
+                logging.warning(f"Could not delete {sha256} from {node.address}: {e}")
+
+    def add_node(self, address):
+        with self._lock:
+            if address not in self.nodes:
+                self.nodes[address] = NodeClient(address, self.session, self.timeout)
+            self.ring = self.ring.with_node(address)
+
+    def remove_node(self, address):
+        # The node keeps serving reads until a rebalance has moved its objects off.
+        with self._lock:
+            if address not in self.ring.nodes:
+                raise KeyError(address)
+            self.ring = self.ring.without_node(address)
+
+    def mark_dead(self, address):
+        with self._lock:
+            self.dead = self.dead | {address}
+
+    def mark_alive(self, address):
+        with self._lock:
+            self.dead = self.dead - {address}
+
+    def wait_rebalanced(self, timeout=None):
+        return self._idle.wait(timeout)
+
+    def rebalance(self, lock=None, referenced=None):
+        """Copy each object to the owners that lack it, then drop copies on nodes that no longer own it.
+
+        lock(sha256) returns a lock held while one object is moved, so
+        garbage collection cannot delete it halfway. When referenced(sha256)
+        is given, objects it rejects are deleted from every node instead;
+        they are left over from deletes that missed a node that was down.
+        """
+        with self._lock:
+            if self._rebalance["running"]:
+                # The membership changed again mid-run; go round once more.
+                self._rebalance_again = True
+                return False
+            self._rebalance.update(running=True, copied=0, deleted=0, orphans=0, errors=0)
+            self._idle.clear()
+        try:
+            while True:
+                self._move_objects(lock, referenced)
+                with self._lock:
+                    if not self._rebalance_again:
+                        break
+                    self._rebalance_again = False
+        finally:
+            with self._lock:
+                ring = self.ring
+                for address in list(self.nodes):
+                    if address not in ring.nodes and not self._rebalance["errors"]:
+                        del self.nodes[address]
+                self._rebalance.update(running=False, finished_at=time.time())
+                self._idle.set()
+        return True
+
+    def _move_objects(self, lock, referenced):
+        holders = {}
+        dead = self.dead
+        for node in list(self.nodes.values()):
+            if node.address in dead:
+                continue
+            try:
+                for sha256 in node.list():
+                    holders.setdefault(sha256, set()).add(node.address)
+            except (NodeUnavailable, requests.HTTPError) as e:
+                logging.error(f"Could not list objects on {node.address}: {e}")
+                self._count("errors")
+        ring = self.ring
+        for sha256, held_by in holders.items():
+            owners = set(self.owners(sha256, ring))
+            if held_by == owners and referenced is None:
+                continue
+            with lock(sha256) if lock else contextlib.nullcontext():
+                if referenced is not None and not referenced(sha256):
+                    self._drop(sha256, held_by)
+                    self._count("orphans")
+                elif held_by != owners:
+                    self._move_object(sha256, held_by, owners)
+
+    def _drop(self, sha256, addresses):
+        for address in addresses:
+            try:
+                self.nodes[address].delete(sha256)
+                self._count("deleted")
+            except (NodeUnavailable, requests.HTTPError) as e:
+                logging.warning(f"Could not drop {sha256} from {address}: {e}")
+                self._count("errors")
+
+    def _move_object(self, sha256, held_by, owners):
+        missing = owners - held_by
+        for address in missing:
+            if self._copy(sha256, held_by, self.nodes[address]):
+                held_by = held_by | {address}
+        if owners <= held_by:
+            self._drop(sha256, held_by - owners)
+
+    def _copy(self, sha256, sources, target):
+        for address in sources:
+            try:
+                response = self.nodes[address].open(sha256)
+                if response is None:
+                    continue
+                # Spooled so the PUT carries a plain Content-Length body.
+                with response, tempfile.SpooledTemporaryFile(COPY_SPOOL_BYTES) as spool:
+                    for chunk in response.iter_content(COPY_CHUNK):
+                        self.throttle.consume(len(chunk))
+                        spool.write(chunk)
+                    size = spool.tell()
+                    spool.seek(0)
+                    target.put(sha256, spool, size)
+                self._count("copied")
+                return True
+            except (NodeUnavailable, requests.HTTPError) as e:
+                logging.warning(f"Could not copy {sha256} from {address} to {target.address}: {e}")
+        self._count("errors")
+        return False
+
+    def _count(self, key):
+        with self._lock:
+            self._rebalance[key] += 1
+
+    def status(self):
+        ring = self.ring
+        with self._lock:
+            rebalance = dict(self._rebalance)
+            nodes = list(self.nodes.values())
+        return {
+            "replicas": self.replicas,
+            "write_quorum": self.write_quorum,
+            "vnodes": ring.vnodes,
+            "dead": sorted(self.dead),
+            "copy_bandwidth": self.throttle.rate,
+            "nodes": [dict(node.status(), in_ring=node.address in ring.nodes) for node in nodes],
+            "rebalance": rebalance,
+        }
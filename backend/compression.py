@@ -0,0 +1,298 @@
+import io
+import gzip
+import zlib
+import time
+import shutil
+import threading
+import logging
+from chunked_uploads import COPY_BUFFER
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD = 'zstd'
+GZIP = 'gzip'
+# Object key suffix for each codec; the names double as Content-Encoding tokens.
+SUFFIXES = {ZSTD: '.zst', GZIP: '.gz'}
+DEFAULT_LEVELS = {ZSTD: 3, GZIP: 6}
+COLD_LEVELS = {ZSTD: 19, GZIP: 9}
+
+# Already-compressed formats, which would only cost CPU to compress again.
+INCOMPRESSIBLE_TYPES = (
+    'image/', 'video/', 'audio/', 'font/woff',
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/zstd',
+    'application/x-7z-compressed', 'application/x-rar-compressed', 'application/vnd.rar',
+    'application/x-xz', 'application/x-bzip2', 'application/x-brotli',
+)
+MIN_SIZE = 1024
+SAMPLE_BYTES = 64 * 1024
+# A sample that does not shrink below this fraction at a fast level is left raw.
+MAX_SAMPLE_RATIO = 0.9
+
+
+class CorruptObject(OSError):
+    # Stored compressed bytes that no longer decompress.
+    pass
+
+
+class Stats:
+    # Uncompressed and stored byte counts and CPU seconds for one direction of the tier.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {"objects": 0, "raw_bytes": 0, "stored_bytes": 0, "cpu_seconds": 0.0}
+
+    def add(self, objects=0, raw_bytes=0, stored_bytes=0, cpu_seconds=0.0):
+        with self._lock:
+            self.values["objects"] += objects
+            self.values["raw_bytes"] += raw_bytes
+            self.values["stored_bytes"] += stored_bytes
+            self.values["cpu_seconds"] += cpu_seconds
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self.values)
+        values["ratio"] = (values["stored_bytes"] / values["raw_bytes"]
+                           if values["raw_bytes"] and values["stored_bytes"] else None)
+        values["raw_mb_per_cpu_second"] = (values["raw_bytes"] / 1e6 / values["cpu_seconds"]
+                                           if values["cpu_seconds"] else None)
+        return values
+
+
+class DecompressingReader(io.RawIOBase):
+    # Decompresses as it is read and charges the CPU time to the tier.
+
+    def __init__(self, tier, raw, codec):
+        self._tier = tier
+        self._raw = raw
+        if codec == ZSTD:
+            if zstandard is None:
+                raise RuntimeError("zstandard is needed to read zstd-compressed objects")
+            self._reader = zstandard.ZstdDecompressor().stream_reader(raw, read_size=COPY_BUFFER)
+        else:
+            self._reader = gzip.GzipFile(fileobj=raw, mode='rb')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        started = time.thread_time()
+        try:
+            data = self._reader.read(len(buffer))
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            raise CorruptObject(str(e))
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise CorruptObject(str(e))
+            raise
+        n = len(data)
+        buffer[:n] = data
+        self._tier.decompressed.add(raw_bytes=n, cpu_seconds=time.thread_time() - started)
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._tier.decompressed.add(objects=1)
+            self._raw.close()
+        super().close()
+
+
+class CompressionTier:
+    """Compresses objects as they are stored and decompresses them as they are read.
+
+    Content whose type is a compressed format, that is tiny, or whose first
+    SAMPLE_BYTES barely shrink is stored raw. Compressed objects live under
+    their hash plus the codec's suffix, so readers can tell them apart. With
+    no codec nothing new is compressed, but existing objects still read back.
+    """
+
+    def __init__(self, codec=None, level=None, cold_level=None):
+        if codec == ZSTD and zstandard is None:
+            logging.warning("zstandard is not installed; compressing with gzip instead")
+            codec = GZIP
+        if codec is not None and codec not in SUFFIXES:
+            raise ValueError(f"Unknown compression codec: {codec}")
+        self.codec = codec
+        self.level = level or DEFAULT_LEVELS.get(codec)
+        self.cold_level = cold_level or COLD_LEVELS.get(codec)
+        # Where to look for an object, this tier's own codec first.
+        self.codecs = sorted(SUFFIXES, key=lambda other: other != codec)
+        self.compressed = Stats()
+        self.decompressed = Stats()
+        self._skipped = {"type": 0, "size": 0, "sample": 0}
+        self._lock = threading.Lock()
+
+    def _skip(self, reason):
+        with self._lock:
+            self._skipped[reason] += 1
+        return False
+
+    @property
+    def enabled(self):
+        return self.codec is not None
+
+    def worth_compressing(self, content_type, size, sample):
+        if not self.enabled:
+            return False
+        if content_type and content_type.lower().startswith(INCOMPRESSIBLE_TYPES):
+            return self._skip("type")
+        if size < MIN_SIZE:
+            return self._skip("size")
+        # Level 1 zlib is cheap and tracks zstd and gzip closely enough to
+        # tell text from media or ciphertext.
+        if len(zlib.compress(sample, 1)) > MAX_SAMPLE_RATIO * len(sample):
+            return self._skip("sample")
+        return True
+
+    def worth_compressing_stream(self, content_type, size, stream):
+        # Samples a seekable stream and rewinds it.
+        sample = stream.read(SAMPLE_BYTES)
+        stream.seek(0)
+        return self.worth_compressing(content_type, size, sample)
+
+    def compress(self, src, dst, level=None):
+        """Compress src into dst; returns the compressed size."""
+        level = level or self.level
+        started = time.thread_time()
+        start = dst.tell()
+        if self.codec == ZSTD:
+            read, _ = zstandard.ZstdCompressor(level=level).copy_stream(src, dst, read_size=COPY_BUFFER)
+        else:
+            counter = _CountingReader(src)
+            with gzip.GzipFile(filename='', fileobj=dst, mode='wb', compresslevel=level, mtime=0) as out:
+                shutil.copyfileobj(counter, out, COPY_BUFFER)
+            read = counter.count
+        written = dst.tell() - start
+        self.compressed.add(objects=1, raw_bytes=read, stored_bytes=written, cpu_seconds=time.thread_time() - started)
+        return written
+
+    def decompress(self, stream, codec):
+        return io.BufferedReader(DecompressingReader(self, stream, codec), COPY_BUFFER)
+
+    def metrics(self):
+        with self._lock:
+            skipped = dict(self._skipped)
+        return {
+            "codec": self.codec,
+            "level": self.level,
+            "cold_level": self.cold_level,
+            "compressed": self.compressed.snapshot(),
+            "decompressed": self.decompressed.snapshot(),
+            "skipped": skipped,
+        }
+
+
+class ColdRecompressor:
+    """Compresses objects left only in the trash again at the tier's cold level.
+
+    Trash is rarely read back, so once every name for an object has been in
+    the trash for cold_after seconds it is worth spending more CPU once to
+    keep it smaller. Objects are rewritten under their object lock, so an
+    upload or purge of the same content waits for the rewrite to finish.
+    """
+
+    def __init__(self, catalog, store, tier, object_locks, cold_after=7 * 24 * 60 * 60,
+                 interval=60 * 60, batch_size=100):
+        self.catalog = catalog
+        self.store = store
+        self.tier = tier
+        self.object_locks = object_locks
+        self.cold_after = cold_after
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "recompressed_objects": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "cpu_seconds": 0.0,
+            "errors": 0,
+            "last_run_at": None,
+        }
+
+    def recompress(self, row):
+        with self.object_locks(row["sha256"]):
+            # Purged since the batch was listed.
+            if not self.catalog.refcount(row["sha256"]):
+                return False
+            started = time.thread_time()
+            stored_size = self.store.recompress(row["sha256"], self.tier.cold_level)
+            if stored_size is None:
+                # Repaired as raw bytes, so there is nothing left to recompress.
+                self.catalog.forget_encoding(row["sha256"])
+                return False
+            self.catalog.put_encoding(row["sha256"], row["size"], row["codec"], self.tier.cold_level, stored_size)
+        with self._lock:
+            self._stats["recompressed_objects"] += 1
+            self._stats["bytes_before"] += row["stored_size"]
+            self._stats["bytes_after"] += stored_size
+            self._stats["cpu_seconds"] += time.thread_time() - started
+        return True
+
+    def run_once(self, now=None):
+        """Recompress one batch and return how many objects were recompressed."""
+        now = now or time.time()
+        rows = self.catalog.cold_encodings(self.tier.codec, self.tier.cold_level, now - self.cold_after,
+                                           self.batch_size)
+        done = 0
+        for row in rows:
+            if self._stop.is_set():
+                break
+            try:
+                done += self.recompress(row)
+            except Exception as e:
+                logging.error(f"Could not recompress object {row['sha256']}: {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["last_run_at"] = time.time()
+        return done
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                # Objects that fail are listed again, so only a batch that
+                # fully succeeded is followed straight away by the next.
+                full = self.run_once() >= self.batch_size
+            except Exception as e:
+                logging.error(f"Cold recompression run failed: {e}")
+                full = False
+            self._stop.wait(0.1 if full else self.interval)
+
+    def start(self):
+        if not (self.tier.enabled and self.cold_after) or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='cold-recompression', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        return dict(
+            stats,
+            enabled=self._thread is not None,
+            cold_after=self.cold_after,
+            cold_level=self.tier.cold_level,
+            saved_bytes=stats["bytes_before"] - stats["bytes_after"],
+        )
+
+
+class _CountingReader:
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.count = 0
+
+    def read(self, n=-1):
+        data = self._raw.read(n)
+        self.count += len(data)
+        return data
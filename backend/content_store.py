@@ -0,0 +1,163 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+from contextlib import ExitStack, contextmanager
+from chunked_uploads import COPY_BUFFER
+
+OBJECTS = 'objects'
+
+
+def object_key(sha256):
+    return f'{OBJECTS}/{sha256}'
+
+
+def hash_stream(stream):
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        block = stream.read(COPY_BUFFER)
+        if not block:
+            break
+        digest.update(block)
+        size += len(block)
+    return digest.hexdigest(), size
+
+
+class ObjectLocks:
+    # Striped locks keyed by hash (or by file name). Storing an object and
+    # deleting an unreferenced one take the same lock, so garbage collection
+    # never removes bytes that a concurrent upload has just decided to reuse.
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextmanager
+    def many(self, keys):
+        # Each stripe once and in a fixed order, so two callers locking
+        # overlapping sets of keys cannot deadlock.
+        with ExitStack() as stack:
+            for index in sorted({hash(key) % len(self._locks) for key in keys}):
+                stack.enter_context(self._locks[index])
+            yield
+
+
+class LocalObjects:
+    """Content-addressed blobs on disk; names in uploads/ and trash/ are hard links to them."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, sha256):
+        return os.path.join(self.folder, sha256[:2], sha256)
+
+    def temp_path(self):
+        # Same filesystem as the objects, so placing one is a rename.
+        return os.path.join(self.folder, f'incoming-{uuid.uuid4().hex}')
+
+    def place(self, temp_path, sha256):
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return True
+
+    def link(self, sha256, dest_path):
+        # Link beside the destination and rename over it, so an existing name
+        # is swapped atomically. Filesystems without hard links get a copy.
+        temp_path = f'{dest_path}.{uuid.uuid4().hex}.link'
+        try:
+            os.link(self.path(sha256), temp_path)
+        except OSError:
+            shutil.copyfile(self.path(sha256), temp_path)
+        os.replace(temp_path, dest_path)
+
+    def adopt(self, src_path, sha256):
+        # Folds a file written before the object store existed into it.
+        path = self.path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(src_path, path)
+            except OSError:
+                shutil.copyfile(src_path, path)
+        elif not os.path.samefile(src_path, path):
+            self.link(sha256, src_path)
+
+    def rewrite(self, sha256, stream):
+        # In place rather than by rename: names are hard links to this inode,
+        # so every one of them is repaired along with the object.
+        path = self.path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as out:
+            shutil.copyfileobj(stream, out, COPY_BUFFER)
+            out.truncate()
+            out.flush()
+            os.fsync(out.fileno())
+
+    def delete(self, sha256):
+        try:
+            os.remove(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+
+def write_pointer(bucket, key, sha256, size, content_type=None):
+    # In the bucket a name is an empty object whose metadata names the
+    # content, so trash moves and renames never copy the bytes themselves.
+    blob = bucket.blob(key)
+    blob.metadata = {'sha256': sha256, 'size': str(size)}
+    blob.upload_from_string(b'', content_type=content_type or 'application/octet-stream')
+    return blob
+
+
+def pointer_target(blob):
+    return (blob.metadata or {}).get('sha256')
+
+
+class PointerFiles:
+    """Names kept as small JSON files on local disk, each naming the object it refers to."""
+
+    def __init__(self, folders):
+        self.folders = folders
+        for folder in folders.values():
+            os.makedirs(folder, exist_ok=True)
+
+    def path(self, location, name):
+        return os.path.join(self.folders[location], name)
+
+    def write(self, location, name, sha256, size, content_type=None):
+        path = self.path(location, name)
+        temp_path = f'{path}.{uuid.uuid4().hex}.pointer'
+        with open(temp_path, 'w') as f:
+            json.dump({'sha256': sha256, 'size': size, 'content_type': content_type}, f)
+        os.replace(temp_path, path)
+        return os.stat(path).st_mtime
+
+    def read(self, location, name):
+        """Return the pointer with its mtime added; raises FileNotFoundError."""
+        path = self.path(location, name)
+        with open(path) as f:
+            pointer = json.load(f)
+        pointer['mtime'] = os.stat(path).st_mtime
+        return pointer
+
+    def names(self, location):
+        with os.scandir(self.folders[location]) as entries:
+            return [entry.name for entry in entries if entry.is_file() and not entry.name.endswith('.pointer')]
+
+    def scan(self, location):
+        for name in self.names(location):
+            try:
+                pointer = self.read(location, name)
+            except FileNotFoundError:
+                continue
+            yield name, pointer['size'], pointer['mtime'], pointer['sha256']
@@ -0,0 +1,222 @@
+"""Firebase Storage backend, kept apart so the Google client libraries are only imported when it is used."""
+import tempfile
+from google.api_core.exceptions import NotFound
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage as gcs
+from requests.adapters import HTTPAdapter
+from catalog import scan_bucket
+from content_store import object_key, hash_stream, write_pointer, pointer_target
+from compression import CompressionTier, SUFFIXES
+from storage_backends import StorageBackend, Staged, Download
+
+# Google Cloud Storage accepts at most 100 calls per batch request.
+BULK_SIZE = 100
+# Compressed uploads are held in memory up to this size, on disk beyond it.
+COMPRESS_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+def blob_mtime(blob):
+    return blob.updated.timestamp() if blob.updated else 0
+
+
+class FirebaseStorage(StorageBackend):
+    """A Firebase Storage (GCS) bucket; names are empty pointer blobs.
+
+    All calls share one authorised requests session whose connection pool
+    holds pool_size keep-alive connections, so concurrent callers do not pay
+    a TLS handshake per request.
+    """
+
+    hashes_before_upload = True
+
+    def __init__(self, firebase_app, pool_size=16, chunk_size=8 * 1024 * 1024, compression=None):
+        self._credentials = firebase_app.credential.get_credential()
+        self._project = firebase_app.project_id
+        self._session = AuthorizedSession(self._credentials)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self.client = self._new_client()
+        self.bucket = self.client.bucket(firebase_app.options.get('storageBucket'))
+        self.chunk_size = chunk_size
+        self.compression = compression or CompressionTier()
+
+    def _new_client(self):
+        return gcs.Client(project=self._project, credentials=self._credentials, _http=self._session)
+
+    def _delete_keys(self, keys):
+        # While a batch is open its client sends every call into the batch, so
+        # batches get a client of their own on the shared connection pool.
+        bucket = self._new_client().bucket(self.bucket.name)
+        for start in range(0, len(keys), BULK_SIZE):
+            try:
+                with bucket.client.batch():
+                    for key in keys[start:start + BULK_SIZE]:
+                        bucket.blob(key).delete()
+            except NotFound:
+                # The batch still ran every delete; the missing ones were already gone.
+                pass
+
+    def stage(self, stream, content_type=None, sha256=None, size=None):
+        # Hashing first decides whether the bytes need sending at all.
+        if sha256 is None:
+            sha256, size = hash_stream(stream)
+            stream.seek(0)
+        return Staged(sha256, size, stream, content_type)
+
+    def _variants(self, sha256):
+        # The raw object and its compressed copies by key, in one listing call.
+        return {blob.name: blob for blob in self.bucket.list_blobs(prefix=object_key(sha256))}
+
+    def _encoded_blob(self, sha256):
+        # (codec, blob) of the object's compressed copy, or None.
+        variants = self._variants(sha256)
+        for codec in self.compression.codecs:
+            blob = variants.get(object_key(sha256) + SUFFIXES[codec])
+            if blob is not None:
+                return codec, blob
+        return None
+
+    def _upload_compressed(self, src, sha256, size, content_type=None, level=None):
+        # The bucket needs the compressed size up front, so it is spooled first.
+        codec = self.compression.codec
+        level = level or self.compression.level
+        with tempfile.SpooledTemporaryFile(COMPRESS_SPOOL_BYTES) as spool:
+            stored_size = self.compression.compress(src, spool, level)
+            spool.seek(0)
+            blob = self.bucket.blob(object_key(sha256) + SUFFIXES[codec], chunk_size=self.chunk_size)
+            blob.metadata = {'size': str(size), 'level': str(level)}
+            blob.upload_from_file(spool, size=stored_size, content_type=content_type)
+        return stored_size
+
+    def commit(self, staged):
+        if self._variants(staged.sha256):
+            return
+        if self.compression.worth_compressing_stream(staged.content_type, staged.size, staged.source):
+            stored_size = self._upload_compressed(staged.source, staged.sha256, staged.size, staged.content_type)
+            staged.encoding = (self.compression.codec, self.compression.level, stored_size)
+            return
+        blob = self.bucket.blob(object_key(staged.sha256), chunk_size=self.chunk_size)
+        blob.upload_from_file(staged.source, size=staged.size, content_type=staged.content_type)
+
+    def delete_object(self, sha256):
+        for key in [object_key(sha256)] + [object_key(sha256) + suffix for suffix in SUFFIXES.values()]:
+            try:
+                self.bucket.blob(key).delete()
+            except NotFound:
+                pass
+
+    def open_object(self, sha256):
+        blob = self.bucket.get_blob(object_key(sha256))
+        if blob is not None:
+            return blob.open('rb', chunk_size=self.chunk_size)
+        encoded = self._encoded_blob(sha256)
+        if encoded is None:
+            raise FileNotFoundError(object_key(sha256))
+        codec, blob = encoded
+        return self.compression.decompress(blob.open('rb', chunk_size=self.chunk_size), codec)
+
+    def replace_copy(self, sha256, copy, stream, size):
+        encoded = self._encoded_blob(sha256)
+        if encoded is not None and encoded[0] == self.compression.codec:
+            level = int((encoded[1].metadata or {}).get('level', 0)) or None
+            self._upload_compressed(stream, sha256, size, encoded[1].content_type, level)
+            return
+        blob = self.bucket.blob(object_key(sha256), chunk_size=self.chunk_size)
+        blob.upload_from_file(stream, size=size)
+
+    def recompress(self, sha256, level):
+        encoded = self._encoded_blob(sha256)
+        if encoded is None or encoded[0] != self.compression.codec:
+            return None
+        codec, blob = encoded
+        size = int((blob.metadata or {}).get('size', 0))
+        with self.compression.decompress(blob.open('rb', chunk_size=self.chunk_size), codec) as src:
+            return self._upload_compressed(src, sha256, size, blob.content_type, level)
+
+    def link(self, location, name, sha256, size, content_type=None):
+        return blob_mtime(write_pointer(self.bucket, f"{location}/{name}", sha256, size, content_type))
+
+    def move(self, src_location, name, dest_location, new_name=None):
+        src_blob = self.bucket.blob(f"{src_location}/{name}")
+        # copy_blob fails with NotFound on a missing source, which saves the
+        # separate exists() round trip.
+        try:
+            dest_blob = self.bucket.copy_blob(src_blob, self.bucket, f"{dest_location}/{new_name or name}")
+        except NotFound:
+            raise FileNotFoundError(src_blob.name)
+        src_blob.delete()
+        return blob_mtime(dest_blob)
+
+    def exists(self, location, name):
+        return self.bucket.blob(f"{location}/{name}").exists()
+
+    def remove(self, location, name):
+        try:
+            self.bucket.blob(f"{location}/{name}").delete()
+        except NotFound:
+            raise FileNotFoundError(f"{location}/{name}")
+
+    def remove_many(self, location, names):
+        self._delete_keys([f"{location}/{name}" for name in names])
+
+    def scan(self, location):
+        return scan_bucket(self.bucket, location)
+
+    def identify(self, location, name):
+        blob = self.bucket.get_blob(f"{location}/{name}")
+        if blob is None:
+            raise FileNotFoundError(f"{location}/{name}")
+        if pointer_target(blob):
+            return pointer_target(blob), int(blob.metadata.get('size', 0)), True
+        with blob.open('rb', chunk_size=self.chunk_size) as reader:
+            sha256, size = hash_stream(reader)
+        return sha256, size, False
+
+    def adopt(self, location, name, sha256, size):
+        blob = self.bucket.get_blob(f"{location}/{name}")
+        if blob is None:
+            raise FileNotFoundError(f"{location}/{name}")
+        if not self.bucket.blob(object_key(sha256)).exists():
+            self.bucket.copy_blob(blob, self.bucket, object_key(sha256))
+        write_pointer(self.bucket, blob.name, sha256, size, blob.content_type)
+
+    def open(self, name, sha256=None):
+        in_catalog = sha256 is not None
+        if sha256 is None:
+            # Not in the catalog yet: follow the name's pointer, or serve a
+            # file that has not been moved into the object store.
+            blob = self.bucket.get_blob(f"uploads/{name}")
+            if blob is None:
+                return None
+            if not pointer_target(blob):
+                return self._download(blob)
+            sha256 = pointer_target(blob)
+        variants = self._variants(sha256)
+        if not variants and in_catalog:
+            return self.open(name)
+        if object_key(sha256) in variants:
+            return self._download(variants[object_key(sha256)])
+        for codec in self.compression.codecs:
+            blob = variants.get(object_key(sha256) + SUFFIXES[codec])
+            if blob is not None:
+                return Download(
+                    int((blob.metadata or {}).get('size', 0)),
+                    blob.updated,
+                    content_type=blob.content_type,
+                    etag=sha256,
+                    stream=self.compression.decompress(blob.open('rb', chunk_size=self.chunk_size), codec),
+                    encoding=codec,
+                    encoded=lambda: (blob.open('rb', chunk_size=self.chunk_size), blob.size),
+                )
+        return None
+
+    def _download(self, blob):
+        # BlobReader fetches one chunk_size window at a time and supports
+        # seek(), so Range requests only download the bytes they need.
+        return Download(
+            blob.size,
+            blob.updated,
+            content_type=blob.content_type,
+            etag=blob.md5_hash or blob.etag,
+            stream=blob.open('rb', chunk_size=self.chunk_size),
+        )
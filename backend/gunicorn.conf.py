@@ -0,0 +1,31 @@
+"""Production server settings: gunicorn -c gunicorn.conf.py backend:app (run from this folder).
+
+One process serves every request from a pool of SERVER_THREADS threads. The
+catalog's name and object locks live in process memory, and so do the
+background jobs, so a second process would race the first on shared content
+and run every job twice. Threads give the concurrency instead: a request
+waiting on a slow bucket or storage node call holds only its own thread.
+"""
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('SERVER_THREADS', 32))
+# Streaming a large upload or download is one long request; the worker keeps
+# heartbeating meanwhile, so this only catches a worker that is truly stuck.
+timeout = int(os.environ.get('SERVER_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+# The app is imported in the worker, not the master: importing it opens the
+# storage clients' connection pools, which a forked worker must not share.
+preload_app = False
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+accesslog = '-' if os.environ.get('ACCESS_LOG', '').lower() in ('1', 'true', 'yes') else None
+
+
+def post_worker_init(worker):
+    # Migrate the catalog and start the reconcile before the first request
+    # arrives rather than while it waits.
+    from backend import start_services
+    start_services()
@@ -0,0 +1,214 @@
+import math
+import time
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+ALIVE = 'alive'
+SUSPECT = 'suspect'
+DEAD = 'dead'
+# Recent failure and recovery events kept for the health view.
+MAX_EVENTS = 50
+
+
+class PhiAccrualDetector:
+    """Suspicion level for one node from the spacing of its heartbeats.
+
+    phi is -log10 of the probability that a heartbeat this late would still
+    arrive, given a normal fit to recent intervals: phi 8 means a 1 in 10^8
+    chance that the node is merely slow. acceptable_pause is added to the
+    mean so brief stalls are tolerated.
+    """
+
+    def __init__(self, now, first_interval=1.0, window=100, min_std=0.1, acceptable_pause=0.0):
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        # Seeded as if heartbeats had been arriving, so a node that never
+        # answers becomes suspect on the same schedule as one that stops.
+        self.intervals = collections.deque([first_interval, first_interval], maxlen=window)
+        self.last = now
+
+    def heartbeat(self, now):
+        self.intervals.append(now - self.last)
+        self.last = now
+
+    def phi(self, now):
+        mean = sum(self.intervals) / len(self.intervals)
+        variance = sum((x - mean) ** 2 for x in self.intervals) / len(self.intervals)
+        std = max(math.sqrt(variance), self.min_std)
+        y = (now - self.last - mean - self.acceptable_pause) / std
+        # Logistic approximation of the normal CDF's tail.
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y)) if y > -15 else math.inf
+        if y > 0:
+            return -math.log10(max(e / (1 + e), 1e-300))
+        return -math.log10(1 - 1 / (1 + e))
+
+
+class HealthMonitor:
+    """Heartbeats every storage node and repairs the cluster when one dies.
+
+    A node whose phi reaches phi_threshold is suspect: reads and writes avoid
+    it. Once it has been suspect for dead_after seconds it is dead: it leaves
+    placement and its objects are re-replicated onto the remaining nodes in
+    the background. A node that answers again is alive and gets its share
+    back. Each death is recorded with how long detection and repair took.
+    """
+
+    def __init__(self, cluster, lock=None, referenced=None, interval=1.0, phi_threshold=8.0,
+                 dead_after=10.0, acceptable_pause=3.0):
+        self.cluster = cluster
+        self.lock = lock
+        self.referenced = referenced
+        self.interval = interval
+        self.phi_threshold = phi_threshold
+        self.dead_after = dead_after
+        self.acceptable_pause = acceptable_pause
+        self._detectors = {}
+        self._states = {}
+        self._suspected_since = {}
+        self._events = collections.deque(maxlen=MAX_EVENTS)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._repair_wanted = threading.Event()
+        self._threads = []
+        self._pinger = ThreadPoolExecutor(max_workers=8, thread_name_prefix='heartbeat')
+
+    def _ping(self, node):
+        try:
+            node.ping()
+            return True
+        except Exception:
+            return False
+
+    def check(self, now=None):
+        """Send one round of heartbeats and update every node's state."""
+        nodes = list(self.cluster.nodes.values())
+        answered = list(self._pinger.map(self._ping, nodes))
+        now = now or time.time()
+        changed = False
+        with self._lock:
+            for address in list(self._detectors):
+                if address not in self.cluster.nodes:
+                    del self._detectors[address], self._states[address]
+                    self._suspected_since.pop(address, None)
+            for node, ok in zip(nodes, answered):
+                detector = self._detectors.get(node.address)
+                if detector is None:
+                    detector = self._detectors[node.address] = PhiAccrualDetector(
+                        now, self.interval, acceptable_pause=self.acceptable_pause)
+                    self._states[node.address] = ALIVE
+                if ok:
+                    detector.heartbeat(now)
+                changed |= self._update(node, detector.phi(now), now)
+        if changed:
+            self._repair_wanted.set()
+
+    def _update(self, node, phi, now):
+        # Returns True when placement changed and a repair is due.
+        address = node.address
+        state = self._states[address]
+        if phi < self.phi_threshold:
+            self._suspected_since.pop(address, None)
+            node.suspected = False
+            if state == DEAD:
+                self.cluster.mark_alive(address)
+                self._events.append({"node": address, "event": "recovered", "at": now,
+                                     "repair_started_at": None, "repair_finished_at": None})
+                logging.info(f"Storage node {address} is alive again.")
+            self._states[address] = ALIVE
+            return state == DEAD
+        node.suspected = True
+        if state == ALIVE:
+            self._suspected_since[address] = now
+            self._states[address] = SUSPECT
+            logging.warning(f"Storage node {address} is suspect (phi {phi:.1f}).")
+        elif state == SUSPECT and now - self._suspected_since[address] >= self.dead_after:
+            self._states[address] = DEAD
+            self.cluster.mark_dead(address)
+            last_heartbeat = self._detectors[address].last
+            self._events.append({
+                "node": address,
+                "event": "dead",
+                "at": now,
+                "last_heartbeat_at": last_heartbeat,
+                "detection_seconds": now - last_heartbeat,
+                "repair_started_at": None,
+                "repair_finished_at": None,
+            })
+            logging.error(f"Storage node {address} is dead; re-replicating its objects.")
+            return True
+        return False
+
+    def repair(self):
+        """Rebalance until every object is on its live owners; records the timing on pending events."""
+        with self._lock:
+            pending = [event for event in self._events if event["repair_finished_at"] is None]
+            started = time.time()
+            for event in pending:
+                event["repair_started_at"] = event["repair_started_at"] or started
+        if not self.cluster.rebalance(self.lock, self.referenced):
+            # Another rebalance was running; it goes round again to cover this.
+            self.cluster.wait_rebalanced()
+        finished = time.time()
+        copied = self.cluster.status()["rebalance"]["copied"]
+        with self._lock:
+            for event in pending:
+                event["repair_finished_at"] = finished
+                event["repair_seconds"] = finished - event["repair_started_at"]
+                event["copied"] = copied
+                if event["event"] == "dead":
+                    # From the last sign of life until every object had its replicas back.
+                    event["recovery_seconds"] = finished - event["last_heartbeat_at"]
+
+    def _heartbeat_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Heartbeat round failed: {e}")
+            self._stop.wait(self.interval)
+
+    def _repair_loop(self):
+        while not self._stop.is_set():
+            if not self._repair_wanted.wait(self.interval):
+                continue
+            self._repair_wanted.clear()
+            try:
+                self.repair()
+            except Exception as e:
+                logging.error(f"Cluster repair failed: {e}")
+
+    def start(self):
+        if self._threads:
+            return
+        for target, name in ((self._heartbeat_loop, 'heartbeat'), (self._repair_loop, 'cluster-repair')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+    def view(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            nodes = [{
+                "address": address,
+                "state": self._states[address],
+                "phi": round(min(detector.phi(now), 1e6), 2),
+                "last_heartbeat_at": detector.last,
+                "seconds_since_heartbeat": round(now - detector.last, 3),
+            } for address, detector in self._detectors.items()]
+            events = [dict(event) for event in self._events]
+        recoveries = [event["recovery_seconds"] for event in events if "recovery_seconds" in event]
+        return {
+            "interval": self.interval,
+            "phi_threshold": self.phi_threshold,
+            "dead_after": self.dead_after,
+            "nodes": nodes,
+            "events": events,
+            "last_recovery_seconds": recoveries[-1] if recoveries else None,
+            "max_recovery_seconds": max(recoveries) if recoveries else None,
+            "cluster": self.cluster.status(),
+        }
@@ -0,0 +1,405 @@
+import time
+import uuid
+import bisect
+import random
+import inspect
+import logging
+import threading
+from collections import deque
+
+# Seconds; spans a fast catalog lookup up to a GB-sized upload.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+UNMATCHED_ROUTE = '<unmatched>'
+# Where the Flask app records the matched URL rule for the middleware.
+ROUTE_KEY = 'metrics.route'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: ([*counts], total, count) for key, (counts, total, count) in self._values.items()}
+        for label_values, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                yield self.name + '_bucket', _format_labels(self.labels, label_values, [('le', le)]), cumulative
+            labels = _format_labels(self.labels, label_values)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+class Registry:
+    """The metrics this process exposes, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Trace:
+
+    def __init__(self, method, path):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def add_span(self, name, started, duration, outcome='ok'):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started - self._started) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "outcome": outcome,
+        })
+
+    def finish(self, route, status):
+        self.route = route
+        self.status = status
+        self.duration = time.perf_counter() - self._started
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "spans": list(self.spans),
+        }
+
+
+class Tracer:
+    """Records the storage and catalog calls made while serving a sample of requests.
+
+    A request is traced with probability sample_rate; the last `keep` traces
+    are kept in memory. Only calls made on the request's own thread are
+    attached to its trace.
+    """
+
+    def __init__(self, sample_rate=0.0, keep=200):
+        self.sample_rate = sample_rate
+        self._local = threading.local()
+        self._traces = deque(maxlen=keep)
+
+    def begin(self, method, path):
+        # Also clears a trace left on this thread by a response never closed.
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            self._local.trace = None
+            return None
+        trace = self._local.trace = Trace(method, path)
+        return trace
+
+    def end(self, trace, route, status):
+        self._local.trace = None
+        trace.finish(route, status)
+        self._traces.append(trace)
+        logging.debug(f"Trace {trace.id} {trace.method} {trace.path} took {trace.duration * 1000:.1f} ms "
+                      f"over {len(trace.spans)} spans")
+
+    @property
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def recent(self, limit=None, route=None):
+        traces = [trace for trace in reversed(self._traces) if route is None or trace.route == route]
+        return [trace.to_dict() for trace in traces[:limit]]
+
+
+class _Span:
+    # Times a block of code into the current trace, if the request is sampled.
+
+    def __init__(self, tracer, name):
+        self._tracer = tracer
+        self._name = name
+
+    def __enter__(self):
+        self._trace = self._tracer.current
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._trace is not None:
+            self._trace.add_span(self._name, self._started, time.perf_counter() - self._started,
+                                 exc_type.__name__ if exc_type else 'ok')
+        return False
+
+
+class Instrumented:
+    """Proxies an object, counting and timing every call to its public methods.
+
+    Calls are recorded in `calls` and `durations` under (backend, method)
+    and, when the request is sampled, as spans named component.method. A method that returns a generator is timed while
+    it is iterated, so lazy catalog queries are charged their real cost.
+    """
+
+    def __init__(self, target, component, backend, calls, durations, tracer):
+        self._target = target
+        self._component = component
+        self._backend = backend
+        self._calls = calls
+        self._durations = durations
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith('_') or not callable(value):
+            return value
+        operation = f'{self._component}.{name}'
+
+        def timed(*args, **kwargs):
+            trace = self._tracer.current
+            started = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            except BaseException as e:
+                self._record(name, operation, trace, started, time.perf_counter() - started, type(e).__name__)
+                raise
+            if inspect.isgenerator(result):
+                return self._timed_iteration(name, operation, trace, started, time.perf_counter() - started, result)
+            self._record(name, operation, trace, started, time.perf_counter() - started, 'ok')
+            return result
+
+        # Bound methods do not change, so later lookups skip __getattr__.
+        self.__dict__[name] = timed
+        return timed
+
+    def _timed_iteration(self, name, operation, trace, started, elapsed, generator):
+        outcome = 'ok'
+        try:
+            while True:
+                resumed = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - resumed
+                yield item
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                outcome = type(e).__name__
+            raise
+        finally:
+            generator.close()
+            self._record(name, operation, trace, started, elapsed, outcome)
+
+    def _record(self, name, operation, trace, started, elapsed, outcome):
+        self._calls.inc(self._backend, name, outcome)
+        self._durations.observe(elapsed, self._backend, name)
+        if trace is not None:
+            trace.add_span(operation, started, elapsed, outcome)
+
+
+class RequestMetrics:
+    """WSGI middleware recording latency, status, bytes in and out and
+    in-flight requests per route, and running the request's trace.
+
+    A request is timed until its response body has been sent. Files handed
+    to the server's wsgi.file_wrapper (sendfile) are counted by their
+    Content-Length and timed until they are handed over.
+    """
+
+    def __init__(self, app, registry, tracer):
+        self.app = app
+        self.tracer = tracer
+        self.requests = registry.counter('http_requests_total', 'Requests served, by route, method and status.',
+                                         ('method', 'route', 'status'))
+        self.latency = registry.histogram('http_request_duration_seconds',
+                                          'Time to serve a request including its response body, in seconds.',
+                                          ('method', 'route'))
+        self.bytes_in = registry.counter('http_request_bytes_total', 'Request body bytes read.', ('method', 'route'))
+        self.bytes_out = registry.counter('http_response_bytes_total', 'Response body bytes sent.',
+                                          ('method', 'route'))
+        self.in_flight = registry.gauge('http_requests_in_flight', 'Requests currently being served.')
+        self.in_flight.inc(amount=0)
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        method = environ.get('REQUEST_METHOD', 'GET')
+        trace = self.tracer.begin(method, environ.get('PATH_INFO', ''))
+        body_in = environ['wsgi.input'] = _CountingInput(environ['wsgi.input'])
+        response = {"status": None, "length": None}
+
+        def recording_start_response(status, headers, exc_info=None):
+            response["status"] = status.split(' ', 1)[0]
+            for header, value in headers:
+                if header.lower() == 'content-length':
+                    response["length"] = int(value)
+            if trace is not None:
+                headers.append(('X-Trace-Id', trace.id))
+            return start_response(status, headers, exc_info)
+
+        def finish(bytes_out):
+            route = environ.get(ROUTE_KEY) or UNMATCHED_ROUTE
+            status = response["status"] or '500'
+            self.in_flight.dec()
+            self.requests.inc(method, route, status)
+            self.latency.observe(time.perf_counter() - started, method, route)
+            self.bytes_in.inc(method, route, amount=body_in.count)
+            self.bytes_out.inc(method, route, amount=bytes_out)
+            if trace is not None:
+                self.tracer.end(trace, route, int(status))
+
+        self.in_flight.inc()
+        try:
+            body = self.app(environ, recording_start_response)
+        except BaseException:
+            finish(0)
+            raise
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            finish(response["length"] or 0)
+            return body
+        return _CountingBody(body, finish)
+
+
+class _CountingInput:
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.count = 0
+
+    def read(self, *args):
+        data = self._raw.read(*args)
+        self.count += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._raw.readline(*args)
+        self.count += len(data)
+        return data
+
+    def readlines(self, *args):
+        lines = self._raw.readlines(*args)
+        self.count += sum(len(line) for line in lines)
+        return lines
+
+    def __iter__(self):
+        for line in self._raw:
+            self.count += len(line)
+            yield line
+
+
+class _CountingBody:
+    # Counts the bytes sent and reports them once, when the body has been
+    # sent in full or the server closes it, whichever comes first.
+
+    def __init__(self, body, on_finish):
+        self._body = body
+        self._on_finish = on_finish
+        self._count = 0
+        self._finished = False
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._count += len(chunk)
+            yield chunk
+        self._finish()
+
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            self._on_finish(self._count)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._finish()
@@ -0,0 +1,117 @@
+import time
+import threading
+import logging
+from catalog import TRASH
+
+# Pause between back-to-back batches while catching up on a backlog, so the
+# purge never holds storage or the catalog's write lock for long stretches.
+BATCH_PAUSE = 0.1
+
+
+class TrashRetention:
+    """Permanently deletes trash past its maximum age or beyond the size quota.
+
+    Work is done in batches of at most batch_size files. purge takes a list of
+    {"name": ...} entries and returns one outcome per entry; an exception
+    outcome means that file was not purged.
+    """
+
+    def __init__(self, catalog, purge, max_age=0, quota_bytes=0, batch_size=100, interval=60):
+        self.catalog = catalog
+        self.purge = purge
+        self.max_age = max_age
+        self.quota_bytes = quota_bytes
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "purged_files": 0,
+            "reclaimed_bytes": 0,
+            "expired_files": 0,
+            "over_quota_files": 0,
+            "errors": 0,
+            "last_run_at": None,
+        }
+
+    def due(self, now=None):
+        # Expired files first, then the oldest deletions until the trash fits its quota.
+        now = now or time.time()
+        rows = []
+        if self.max_age:
+            rows = self.catalog.oldest_deleted(self.batch_size, before=now - self.max_age)
+        expired = len(rows)
+        if self.quota_bytes and len(rows) < self.batch_size:
+            _, used = self.catalog.usage(TRASH)
+            excess = used - self.quota_bytes - sum(row["size"] for row in rows)
+            if excess > 0:
+                seen = {row["name"] for row in rows}
+                for row in self.catalog.oldest_deleted(self.batch_size):
+                    if excess <= 0 or len(rows) >= self.batch_size:
+                        break
+                    if row["name"] in seen:
+                        continue
+                    rows.append(row)
+                    excess -= row["size"]
+        return rows, expired
+
+    def run_once(self, now=None):
+        """Purge one batch and return how many files it held."""
+        rows, expired = self.due(now)
+        if rows:
+            outcomes = self.purge([{"name": row["name"]} for row in rows])
+            purged = [row for row, outcome in zip(rows, outcomes) if not isinstance(outcome, Exception)]
+            reclaimed = sum(row["size"] for row in purged)
+            with self._lock:
+                self._stats["purged_files"] += len(purged)
+                self._stats["reclaimed_bytes"] += reclaimed
+                self._stats["expired_files"] += min(expired, len(purged))
+                self._stats["over_quota_files"] += max(len(purged) - expired, 0)
+                self._stats["errors"] += len(rows) - len(purged)
+            logging.info(f"Trash retention purged {len(purged)} of {len(rows)} files, {reclaimed} bytes.")
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["last_run_at"] = time.time()
+        return len(rows)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                full = self.run_once() >= self.batch_size
+            except Exception as e:
+                logging.error(f"Trash retention run failed: {e}")
+                full = False
+            self._stop.wait(BATCH_PAUSE if full else self.interval)
+
+    def start(self):
+        if not (self.max_age or self.quota_bytes) or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='trash-retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def metrics(self, now=None):
+        now = now or time.time()
+        count, used = self.catalog.usage(TRASH)
+        oldest = self.catalog.oldest_deleted(1)
+        oldest_deleted_at = oldest[0]["deleted_at"] if oldest else None
+        # How far past its expiry the oldest file still in the trash is.
+        lag = 0
+        if self.max_age and oldest_deleted_at is not None:
+            lag = max(0, now - self.max_age - oldest_deleted_at)
+        with self._lock:
+            stats = dict(self._stats)
+        return dict(
+            stats,
+            enabled=self._thread is not None,
+            max_age=self.max_age,
+            quota_bytes=self.quota_bytes,
+            trash_files=count,
+            trash_bytes=used,
+            oldest_deleted_at=oldest_deleted_at,
+            purge_lag_seconds=lag,
+        )
@@ -0,0 +1,223 @@
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from chunked_uploads import COPY_BUFFER
+from cluster import Throttle
+from compression import CorruptObject
+
+BATCH_SIZE = 100
+# Repairs hold the known-good bytes in memory up to this size, on disk beyond it.
+REPAIR_SPOOL_BYTES = 8 * 1024 * 1024
+# Objects that could not be repaired, kept for the report.
+MAX_UNRECOVERABLE = 100
+
+
+class Scrubber:
+    """Re-reads every stored object and repairs copies whose bytes no longer match their SHA-256.
+
+    Reads are paced to `rate` bytes per second so scrubbing never starves
+    uploads and downloads; a full pass over the catalog runs every `interval`
+    seconds. A bad or missing copy is rewritten from a good copy when the
+    backend keeps several, otherwise rebuilt from the version history.
+    """
+
+    def __init__(self, catalog, store, history, object_locks, rate=10 * 1024 * 1024,
+                 interval=24 * 60 * 60, batch_size=BATCH_SIZE):
+        self.catalog = catalog
+        self.store = store
+        self.history = history
+        self.object_locks = object_locks
+        self.throttle = Throttle(rate)
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._unrecoverable = []
+        self._stats = {
+            "passes": 0,
+            "running": False,
+            "pass_started_at": None,
+            "position": 0.0,
+            "objects_verified": 0,
+            "bytes_verified": 0,
+            "pass_objects": 0,
+            "pass_bytes": 0,
+            "corrupt_copies": 0,
+            "repaired_copies": 0,
+            "errors": 0,
+            "last_pass_finished_at": None,
+            "last_pass_seconds": None,
+        }
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _hash_copy(self, sha256, copy):
+        digest = hashlib.sha256()
+        size = 0
+        with self.store.open_copy(sha256, copy) as stream:
+            while True:
+                block = stream.read(COPY_BUFFER)
+                if not block:
+                    break
+                self.throttle.consume(len(block))
+                digest.update(block)
+                size += len(block)
+        self._count(bytes_verified=size, pass_bytes=size)
+        return digest.hexdigest()
+
+    def check(self, sha256):
+        """Return (good, bad) copies of an object; missing copies are bad."""
+        good, bad = [], []
+        for copy in self.store.object_copies(sha256):
+            try:
+                matches = self._hash_copy(sha256, copy) == sha256
+            except (FileNotFoundError, CorruptObject):
+                matches = False
+            (good if matches else bad).append(copy)
+        self._count(objects_verified=1, pass_objects=1)
+        return good, bad
+
+    def _good_bytes(self, sha256, good, out):
+        # A verified copy if there is one, otherwise the content rebuilt from
+        # a delta against newer content in the version history.
+        for copy in good:
+            digest = hashlib.sha256()
+            try:
+                with self.store.open_copy(sha256, copy) as stream:
+                    while True:
+                        block = stream.read(COPY_BUFFER)
+                        if not block:
+                            break
+                        digest.update(block)
+                        out.write(block)
+            except (FileNotFoundError, CorruptObject):
+                pass
+            if digest.hexdigest() == sha256:
+                return True
+            out.seek(0)
+            out.truncate()
+        for row in self.catalog.delta_versions(sha256):
+            try:
+                data = self.history.read(row)
+            except Exception as e:
+                logging.warning(f"Could not rebuild {sha256} from version {row['version']} of {row['name']}: {e}")
+                continue
+            if hashlib.sha256(data).hexdigest() == sha256:
+                out.write(data)
+                return True
+        return False
+
+    def scrub_object(self, sha256):
+        good, bad = self.check(sha256)
+        if not bad:
+            return
+        with self.object_locks(sha256):
+            # Collected, or rewritten by an upload, while it was being read.
+            if not self.catalog.refcount(sha256):
+                return
+            good, bad = self.check(sha256)
+            if not bad:
+                return
+            self._count(corrupt_copies=len(bad))
+            logging.error(f"Object {sha256} has {len(bad)} bad or missing copies: {bad}")
+            with tempfile.SpooledTemporaryFile(REPAIR_SPOOL_BYTES) as source:
+                if not self._good_bytes(sha256, good, source):
+                    self._record_unrecoverable(sha256)
+                    return
+                size = source.tell()
+                for copy in bad:
+                    source.seek(0)
+                    self.store.replace_copy(sha256, copy, source, size)
+            self._count(repaired_copies=len(bad))
+            logging.info(f"Repaired {len(bad)} copies of object {sha256}.")
+
+    def _record_unrecoverable(self, sha256):
+        references = self.catalog.references(sha256)
+        logging.error(f"Object {sha256} cannot be repaired; affected: {references}")
+        with self._lock:
+            self._unrecoverable = [entry for entry in self._unrecoverable if entry["sha256"] != sha256]
+            self._unrecoverable.append({"sha256": sha256, "references": references, "found_at": time.time()})
+            del self._unrecoverable[:-MAX_UNRECOVERABLE]
+
+    def run_pass(self):
+        """Verify every object once, in hash order."""
+        started = time.time()
+        with self._lock:
+            self._stats.update(running=True, pass_started_at=started, position=0.0, pass_objects=0, pass_bytes=0)
+        after = ''
+        try:
+            while not self._stop.is_set():
+                batch = self.catalog.object_hashes(after, self.batch_size)
+                if not batch:
+                    break
+                for sha256 in batch:
+                    if self._stop.is_set():
+                        break
+                    try:
+                        self.scrub_object(sha256)
+                    except Exception as e:
+                        logging.error(f"Could not scrub object {sha256}: {e}")
+                        self._count(errors=1)
+                    after = sha256
+                    with self._lock:
+                        # Hashes are uniform, so the leading bits say how far the pass has got.
+                        self._stats["position"] = int(sha256[:8], 16) / 0xFFFFFFFF
+        finally:
+            finished = time.time()
+            with self._lock:
+                self._stats.update(running=False, position=1.0, last_pass_finished_at=finished,
+                                   last_pass_seconds=finished - started)
+                self._stats["passes"] += 1
+        logging.info(f"Scrub pass finished in {finished - started:.1f}s.")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pass()
+            except Exception as e:
+                logging.error(f"Scrub pass failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        if not self.interval or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='scrubber', daemon=True)
+        self._thread.start()
+
+    def scrub_now(self):
+        """Start a pass now; False if one is already running."""
+        with self._lock:
+            if self._stats["running"]:
+                return False
+        if self._thread is not None:
+            self._wake.set()
+        else:
+            threading.Thread(target=self.run_pass, name='scrubber', daemon=True).start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def metrics(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            unrecoverable = list(self._unrecoverable)
+        elapsed = (now if stats["running"] else stats["last_pass_finished_at"] or now) - (stats["pass_started_at"] or now)
+        return dict(
+            stats,
+            enabled=self._thread is not None,
+            rate=self.throttle.rate,
+            interval=self.interval,
+            pass_bytes_per_second=stats["pass_bytes"] / elapsed if elapsed > 0 else None,
+            unrecoverable=unrecoverable,
+        )
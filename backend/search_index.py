@@ -0,0 +1,84 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Only the start of large files is indexed.
+INDEX_MAX_BYTES = 1024 * 1024
+BACKFILL_BATCH = 500
+# A NUL in the first few KiB marks content as binary.
+SNIFF_BYTES = 8 * 1024
+
+
+def extract_text(data):
+    """The text in data, or None when it does not look like text."""
+    if b'\0' in data[:SNIFF_BYTES]:
+        return None
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # The cap may have cut a multi-byte character in half.
+        if e.start < len(data) - 3:
+            return None
+        return data[:e.start].decode('utf-8')
+
+
+class ContentIndexer:
+    """Extracts the text of stored contents into the catalog's search index.
+
+    Text is indexed once per distinct content, on a single background worker
+    so uploads never wait for it and index writes never contend with each other.
+    """
+
+    def __init__(self, catalog, store, max_bytes=INDEX_MAX_BYTES):
+        self.catalog = catalog
+        self.store = store
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-index')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def index(self, sha256):
+        if self.catalog.has_text(sha256):
+            return
+        with self.store.open_object(sha256) as stream:
+            data = stream.read(self.max_bytes)
+        self.catalog.put_text(sha256, extract_text(data))
+
+    def _run(self, sha256):
+        try:
+            self.index(sha256)
+        except FileNotFoundError:
+            # Released before its turn came; nothing left to search.
+            pass
+        except Exception as e:
+            logging.error(f"Could not index contents {sha256}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(sha256)
+
+    def submit(self, sha256):
+        if not sha256:
+            return
+        with self._lock:
+            if sha256 in self._pending:
+                return
+            self._pending.add(sha256)
+        self._executor.submit(self._run, sha256)
+
+    def backfill(self):
+        # Contents stored before the index existed, or whose indexing was cut short.
+        failed = set()
+        while True:
+            hashes = [sha256 for sha256 in self.catalog.unindexed_hashes(BACKFILL_BATCH + len(failed))
+                      if sha256 not in failed]
+            if not hashes:
+                break
+            for sha256 in hashes:
+                try:
+                    self.index(sha256)
+                except FileNotFoundError:
+                    failed.add(sha256)
+                except Exception as e:
+                    logging.error(f"Could not index contents {sha256}: {e}")
+                    failed.add(sha256)
+        logging.info(f"Search index backfill finished; {len(failed)} contents could not be read.")
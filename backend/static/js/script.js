@@ -1,6 +1,5 @@
 document.addEventListener("DOMContentLoaded", () => {
-    viewFiles();
-    viewTrash();
+    refreshFileList();
     toggleFileAction();
 
     document.getElementById("refreshButton").addEventListener("click", refreshFileList);
@@ -17,21 +16,91 @@ function updateFileName() {
     document.getElementById("selectedFileName").textContent = fileInput.files.length ? truncateFileName(fileInput.files[0].name) : "No file chosen";
 }
 
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const CHUNK_RETRIES = 3;
+
+async function sha256Hex(buffer) {
+    // crypto.subtle is only available in secure contexts; the server still
+    // returns its own checksum for each chunk when we cannot send one.
+    if (!window.crypto || !window.crypto.subtle) return null;
+    let digest = await crypto.subtle.digest("SHA-256", buffer);
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, "0")).join("");
+}
+
+async function uploadFileInChunks(file) {
+    // Resume a previous attempt for the same file if the server still has it.
+    let resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    let session = null;
+    let uploadId = localStorage.getItem(resumeKey);
+    if (uploadId) {
+        let response = await fetch(`/uploads/${uploadId}`);
+        if (response.ok) session = await response.json();
+    }
+    if (!session) {
+        let response = await fetch('/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        session = await response.json();
+        if (!response.ok) throw new Error(session.error || "Failed to start upload");
+        session.missing = Array.from({ length: session.total_chunks }, (_, i) => i);
+        localStorage.setItem(resumeKey, session.upload_id);
+    }
+
+    for (let index of session.missing) {
+        let start = index * session.chunk_size;
+        let buffer = await file.slice(start, start + session.chunk_size).arrayBuffer();
+        let checksum = await sha256Hex(buffer);
+        let headers = { 'Content-Type': 'application/octet-stream' };
+        if (checksum) headers['X-Chunk-SHA256'] = checksum;
+
+        for (let attempt = 1; ; attempt++) {
+            try {
+                let response = await fetch(`/uploads/${session.upload_id}/chunks/${index}`, { method: 'PUT', headers, body: buffer });
+                if (response.ok) break;
+                let result = await response.json();
+                if (attempt >= CHUNK_RETRIES) throw new Error(result.error || `Chunk ${index} failed`);
+            } catch (error) {
+                if (attempt >= CHUNK_RETRIES) throw error;
+            }
+        }
+        document.getElementById("selectedFileName").textContent =
+            `${truncateFileName(file.name)} (${Math.min(100, Math.round((start + buffer.byteLength) / file.size * 100))}%)`;
+    }
+
+    let response = await fetch(`/uploads/${session.upload_id}/complete`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ content_type: file.type || null })
+    });
+    let data = await response.json();
+    if (response.ok) localStorage.removeItem(resumeKey);
+    return data;
+}
+
 async function uploadFile() {
     let fileInput = document.getElementById('fileInput');
     if (!fileInput.files.length) return alert("Please select a file to upload!");
 
-    let formData = new FormData();
-    formData.append('file', fileInput.files[0]);
+    let file = fileInput.files[0];
 
     try {
-        let response = await fetch('/upload', { method: 'POST', body: formData });
-        let data = await response.json();
+        let data;
+        if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+            data = await uploadFileInChunks(file);
+        } else {
+            let formData = new FormData();
+            formData.append('file', file);
+            let response = await fetch('/upload', { method: 'POST', body: formData });
+            data = await response.json();
+        }
         alert(data.message || data.error);
-        refreshFileList();
+        syncChanges();
         document.getElementById("selectedFileName").textContent = "No file chosen";
     } catch (error) {
         console.error(error);
+        alert(error.message);
     }
 }
 
@@ -61,7 +130,7 @@ async function createFile() {
         if (!response.ok) throw new Error(result.error || "Failed to create file");
 
         alert(result.message);
-        refreshFileList();
+        syncChanges();
         document.getElementById("fileNameInput").value = "";
         document.getElementById("fileContentInput").value = "";
     } catch (error) {
@@ -88,46 +157,145 @@ async function downloadFile(filename) {
     }
 }
 
-async function viewFiles() {
+const FILES_PAGE_SIZE = 100;
+// entries maps each name on screen to its entry and <li>; listing is false
+// while content search results are shown, which changes cannot add to.
+let fileListState = { cursor: null, loading: false, done: false, generation: 0, listing: true, entries: new Map() };
+let fileListObserver = null;
+
+function fileListItem(file) {
+    let fileSizeMB = (file.size / (1024 * 1024)).toFixed(2);
+    let truncatedName = truncateFileName(file.name);
+
+    let li = document.createElement("li");
+    li.fileEntry = file;
+    li.innerHTML = `
+        ${truncatedName} (${file.type}, ${fileSizeMB} MB) 
+        <button onclick="downloadFile('${file.name}')">Download</button>
+        <button onclick="renameFile('${file.name}')">Rename</button>
+        <button onclick="deleteFile('${file.name}')">Delete</button>
+        <button onclick="showVersions('${file.name}')">Versions</button>
+    `;
+    return li;
+}
+
+async function loadNextFilesPage() {
+    if (fileListState.loading || fileListState.done) return;
+    fileListState.loading = true;
+    let generation = fileListState.generation;
+
     try {
         let searchQuery = document.getElementById("searchInput").value;
         let sortBy = document.getElementById("sortOptions").value;
+        let params = new URLSearchParams({ search: searchQuery, sort_by: sortBy, limit: FILES_PAGE_SIZE });
+        if (fileListState.cursor) params.set("cursor", fileListState.cursor);
 
-        let response = await fetch(`/files?search=${searchQuery}&sort_by=${sortBy}`);
+        let response = await fetch(`/files?${params}`);
         let files = await response.json();
 
+        // A newer search or sort started while this page was in flight.
+        if (generation !== fileListState.generation) return;
+        noteChangeSeq(response);
+
         let fileListDiv = document.getElementById("fileList").querySelector('ul');
-        fileListDiv.innerHTML = "";
 
         if (!Array.isArray(files)) {
             console.error("Server returned error:", files);
             if (files.error) {
                 fileListDiv.innerHTML = `<li style="color: red;">Error: ${files.error}</li>`;
             }
+            fileListState.done = true;
             return;
         }
 
-        if (files.length === 0) {
+        if (files.length === 0 && !fileListState.cursor) {
             fileListDiv.innerHTML = "<li>No files found.</li>";
-            return;
         }
 
-        files.forEach(file => {
-            let fileSizeMB = (file.size / (1024 * 1024)).toFixed(2);
-            let truncatedName = truncateFileName(file.name);
-
-            let li = document.createElement("li");
-            li.innerHTML = `
-                ${truncatedName} (${file.type}, ${fileSizeMB} MB) 
-                <button onclick="downloadFile('${file.name}')">Download</button>
-                <button onclick="renameFile('${file.name}')">Rename</button>
-                <button onclick="deleteFile('${file.name}')">Delete</button>
-            `;
-            fileListDiv.appendChild(li);
-        });
+        files.forEach(file => showFile(fileListDiv, file));
 
+        fileListState.cursor = response.headers.get("X-Next-Cursor");
+        fileListState.done = !fileListState.cursor;
     } catch (error) {
         console.error("Error fetching files:", error);
+    } finally {
+        if (generation === fileListState.generation) fileListState.loading = false;
+    }
+
+    // Keep filling while the sentinel is still on screen (e.g. on tall windows).
+    let sentinel = document.getElementById("filesSentinel");
+    if (!fileListState.done && sentinel && sentinel.getBoundingClientRect().top < window.innerHeight) {
+        loadNextFilesPage();
+    }
+}
+
+function showFile(ul, file, before = null) {
+    // A change may already have put this name on screen.
+    let shown = fileListState.entries.get(file.name);
+    if (shown) shown.li.remove();
+    let li = fileListItem(file);
+    ul.insertBefore(li, before);
+    fileListState.entries.set(file.name, { entry: file, li });
+    return li;
+}
+
+function viewFiles() {
+    fileListState = {
+        cursor: null, loading: false, done: false, generation: fileListState.generation + 1,
+        listing: true, entries: new Map()
+    };
+    document.getElementById("fileList").querySelector('ul').innerHTML = "";
+
+    let sentinel = document.getElementById("filesSentinel");
+    if (!sentinel) {
+        sentinel = document.createElement("div");
+        sentinel.id = "filesSentinel";
+        document.getElementById("fileList").appendChild(sentinel);
+    }
+    if (!fileListObserver && "IntersectionObserver" in window) {
+        fileListObserver = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNextFilesPage();
+        });
+        fileListObserver.observe(sentinel);
+    }
+
+    return loadNextFilesPage();
+}
+
+async function searchFiles() {
+    let searchQuery = document.getElementById("searchInput").value.trim();
+    if (!document.getElementById("searchContents").checked || !searchQuery) {
+        return viewFiles();
+    }
+
+    // Ranked content search returns a single page, so stop the paged listing.
+    fileListState = {
+        cursor: null, loading: false, done: true, generation: fileListState.generation + 1,
+        listing: false, entries: new Map()
+    };
+    let fileListDiv = document.getElementById("fileList").querySelector('ul');
+    fileListDiv.innerHTML = "";
+    try {
+        let response = await fetch(`/search?${new URLSearchParams({ q: searchQuery })}`);
+        let files = await response.json();
+        if (!Array.isArray(files)) {
+            fileListDiv.innerHTML = `<li style="color: red;">Error: ${files.error}</li>`;
+            return;
+        }
+        if (files.length === 0) {
+            fileListDiv.innerHTML = "<li>No files found.</li>";
+        }
+        files.forEach(file => {
+            let li = showFile(fileListDiv, file);
+            if (file.snippet) {
+                let snippet = document.createElement("div");
+                snippet.className = "search-snippet";
+                snippet.textContent = file.snippet;
+                li.appendChild(snippet);
+            }
+        });
+    } catch (error) {
+        console.error("Error searching files:", error);
     }
 }
 
@@ -143,7 +311,23 @@ async function renameFile(oldFilename) {
 
     let result = await response.json();
     alert(result.message || result.error);
-    if (response.ok) refreshFileList();
+    if (response.ok) syncChanges();
+}
+
+async function showVersions(filename) {
+    let response = await fetch(`/versions/${encodeURIComponent(filename)}`);
+    let versions = await response.json();
+    if (!response.ok) return alert(versions.error);
+    if (versions.length === 0) return alert(`"${filename}" has no earlier versions.`);
+
+    let listing = versions.map(v => `${v.version}: ${v.date_modified} (${v.size} bytes)`).join('\n');
+    let choice = prompt(`Earlier versions of "${filename}":\n${listing}\n\nEnter a version number to restore:`);
+    if (!choice) return;
+
+    response = await fetch(`/versions/${encodeURIComponent(filename)}/${parseInt(choice, 10)}/restore`, { method: 'POST' });
+    let result = await response.json();
+    alert(result.message || result.error);
+    if (response.ok) syncChanges();
 }
 
 async function deleteFile(filename) {
@@ -156,47 +340,58 @@ async function deleteFile(filename) {
     let result = await response.json();
 
     alert(result.message || result.error);
-    if (response.ok) refreshFileList();
+    if (response.ok) syncChanges();
 }
 
+let trashEntries = new Map();
+
 async function viewTrash() {
     try {
         let response = await fetch('/trash');
         let files = await response.json();
 
-        let trashListUl = document.getElementById('trashList').querySelector('ul');
-
         if (!Array.isArray(files)) {
             console.error("Server returned error:", files);
             if (files.error) {
-                trashListUl.innerHTML = `<li style="color: red;">Error: ${files.error}</li>`;
+                document.getElementById('trashList').querySelector('ul').innerHTML =
+                    `<li style="color: red;">Error: ${files.error}</li>`;
             }
             return;
         }
 
-        if (files.length === 0) {
-            trashListUl.innerHTML = "<li>Trash is empty.</li>";
-            return;
-        }
-
-        trashListUl.innerHTML = files.map(file => `
-            <li>
-                ${truncateFileName(file.name)} (${(file.size / (1024 * 1024)).toFixed(2)} MB) 
-                <button class="restore-btn" onclick="restoreFile('${file.name}')">Restore</button>
-                <button class="delete-permanent-btn" onclick="deletePermanent('${file.name}')">Delete Permanently</button>
-            </li>
-        `).join('');
+        noteChangeSeq(response);
+        trashEntries = new Map(files.map(file => [file.name, file]));
+        renderTrash();
     } catch (error) {
         console.error(error);
     }
 }
 
+function renderTrash() {
+    let trashListUl = document.getElementById('trashList').querySelector('ul');
+    if (trashEntries.size === 0) {
+        trashListUl.innerHTML = "<li>Trash is empty.</li>";
+        return;
+    }
+
+    // Newest deletions first, as /trash lists them.
+    let files = Array.from(trashEntries.values()).sort((a, b) =>
+        compareValues(b.date_deleted, a.date_deleted) || compareValues(a.name, b.name));
+    trashListUl.innerHTML = files.map(file => `
+        <li>
+            ${truncateFileName(file.name)} (${(file.size / (1024 * 1024)).toFixed(2)} MB) 
+            <button class="restore-btn" onclick="restoreFile('${file.name}')">Restore</button>
+            <button class="delete-permanent-btn" onclick="deletePermanent('${file.name}')">Delete Permanently</button>
+        </li>
+    `).join('');
+}
+
 async function restoreFile(filename) {
     try {
         let response = await fetch(`/restore/${filename}`, { method: 'PUT' });
         let data = await response.json();
         alert(data.message || data.error);
-        refreshFileList();
+        syncChanges();
     } catch (error) {
         console.error(error);
     }
@@ -209,7 +404,44 @@ async function deletePermanent(filename) {
         let response = await fetch(`/delete-permanent/${filename}`, { method: 'DELETE' });
         let data = await response.json();
         alert(data.message || data.error);
-        viewTrash();
+        syncChanges();
+    } catch (error) {
+        console.error(error);
+    }
+}
+
+async function runBatch(operations) {
+    let response = await fetch('/batch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ operations })
+    });
+    let data = await response.json();
+    if (!response.ok) return alert(data.error);
+
+    let failures = data.results.filter(result => !result.ok);
+    let summary = `${data.succeeded} succeeded, ${data.failed} failed.`;
+    if (failures.length) {
+        summary += '\n' + failures.slice(0, 10).map(result => `${result.name}: ${result.error}`).join('\n');
+    }
+    alert(summary);
+}
+
+async function restoreAll() {
+    try {
+        await runBatch([{ op: 'restore_all' }]);
+        syncChanges();
+    } catch (error) {
+        console.error(error);
+    }
+}
+
+async function emptyTrash() {
+    if (!confirm("Are you sure you want to permanently delete everything in the trash?")) return;
+
+    try {
+        await runBatch([{ op: 'empty_trash' }]);
+        syncChanges();
     } catch (error) {
         console.error(error);
     }
@@ -219,7 +451,118 @@ function toggleTrashView(visible) {
     document.getElementById('trashList').style.display = visible ? 'block' : 'none';
 }
 
-function refreshFileList() {
-    viewFiles();
-    viewTrash();
+async function refreshFileList() {
+    changeSeq = null;
+    await Promise.all([viewFiles(), viewTrash()]);
+    followChanges();
+}
+
+// Change feed: every listing says which change it reflects (X-Change-Seq);
+// later changes are applied to the lists on screen instead of listing again.
+// They come from an event stream, or by polling when the server has no
+// stream to spare.
+const CHANGE_POLL_INTERVAL = 5000;
+let changeSeq = null;
+let changeSource = null;
+let changePollTimer = null;
+
+function noteChangeSeq(response) {
+    let seq = parseInt(response.headers.get("X-Change-Seq"), 10);
+    if (Number.isNaN(seq)) return;
+    // Applying a change twice is harmless, so the oldest position wins.
+    changeSeq = changeSeq === null ? seq : Math.min(changeSeq, seq);
+}
+
+function followChanges() {
+    if (changeSeq === null || changeSource || changePollTimer) return;
+    if (!window.EventSource) return scheduleChangePoll();
+
+    changeSource = new EventSource(`/changes/stream?since=${changeSeq}`);
+    changeSource.addEventListener("change", event => applyChanges([JSON.parse(event.data)]));
+    changeSource.addEventListener("reset", () => {
+        changeSource.close();
+        changeSource = null;
+        refreshFileList();
+    });
+    changeSource.onerror = () => {
+        // Dropped connections reconnect by themselves; a refused stream does not.
+        if (changeSource && changeSource.readyState === EventSource.CLOSED) {
+            changeSource = null;
+            scheduleChangePoll();
+        }
+    };
+}
+
+function scheduleChangePoll() {
+    clearTimeout(changePollTimer);
+    changePollTimer = setTimeout(async () => {
+        await syncChanges();
+        scheduleChangePoll();
+    }, CHANGE_POLL_INTERVAL);
+}
+
+async function syncChanges() {
+    if (changeSeq === null) return refreshFileList();
+    try {
+        for (;;) {
+            let response = await fetch(`/changes?since=${changeSeq}`);
+            // The server no longer has every change since then.
+            if (response.status === 410) return refreshFileList();
+            let data = await response.json();
+            if (!response.ok) throw new Error(data.error || "Failed to fetch changes");
+            applyChanges(data.changes);
+            changeSeq = Math.max(changeSeq, data.next);
+            if (!data.more) return;
+        }
+    } catch (error) {
+        console.error("Error fetching changes:", error);
+    }
+}
+
+function applyChanges(changes) {
+    let trashChanged = false;
+    for (let change of changes) {
+        if (change.location === "trash") {
+            if (change.op === "put") trashEntries.set(change.name, change.entry);
+            else trashEntries.delete(change.name);
+            trashChanged = true;
+        } else {
+            applyFileChange(change);
+        }
+        if (changeSeq !== null) changeSeq = Math.max(changeSeq, change.seq);
+    }
+    if (trashChanged) renderTrash();
+}
+
+const compareValues = (a, b) => a < b ? -1 : a > b ? 1 : 0;
+
+function compareFiles(a, b, sortBy) {
+    // Mirrors the ORDER BY of each sort in catalog.py.
+    if (sortBy === "size") return compareValues(a.size, b.size) || compareValues(a.name, b.name);
+    if (sortBy === "date_modified") {
+        return compareValues(b.date_modified, a.date_modified) || compareValues(a.name, b.name);
+    }
+    return compareValues(a.name.toLowerCase(), b.name.toLowerCase()) || compareValues(a.name, b.name);
+}
+
+function applyFileChange(change) {
+    let shown = fileListState.entries.get(change.name);
+    if (shown) {
+        shown.li.remove();
+        fileListState.entries.delete(change.name);
+    }
+    if (change.op !== "put" || !fileListState.listing) return;
+
+    let search = document.getElementById("searchInput").value.toLowerCase();
+    if (search && !change.entry.name.toLowerCase().includes(search)) return;
+
+    // Insert in sort order among the entries loaded so far. One that sorts
+    // after all of them arrives with a later page, unless there are none.
+    let ul = document.getElementById("fileList").querySelector('ul');
+    let sortBy = document.getElementById("sortOptions").value;
+    let before = Array.from(ul.children).find(li => li.fileEntry && compareFiles(change.entry, li.fileEntry, sortBy) < 0);
+    if (!before && !fileListState.done) return;
+    // Drop the "No files found." placeholder.
+    Array.from(ul.children).filter(li => !li.fileEntry).forEach(li => li.remove());
+    showFile(ul, change.entry, before || null);
 }
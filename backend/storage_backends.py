@@ -0,0 +1,538 @@
+import io
+import os
+import time
+import shutil
+import hashlib
+import threading
+from catalog import UPLOADS, TRASH, scan_directory
+from chunked_uploads import HashingReader, COPY_BUFFER
+from content_store import LocalObjects, PointerFiles, object_key, hash_stream
+from compression import CompressionTier, SUFFIXES, SAMPLE_BYTES
+
+
+class Staged:
+    # Content that has been hashed but not yet committed to the object store.
+
+    def __init__(self, sha256, size, source=None, content_type=None):
+        self.sha256 = sha256
+        self.size = size
+        self.source = source
+        self.content_type = content_type
+        # (codec, level, stored_size) once commit() has stored it compressed.
+        self.encoding = None
+
+
+class Download:
+    # Either a local path for send_file to stream itself, or an open stream.
+    # A compressed object streams decompressed; encoded() returns
+    # (stream, size) over the stored bytes for clients that accept them.
+
+    def __init__(self, size, mtime, content_type=None, etag=None, path=None, stream=None,
+                 encoding=None, encoded=None):
+        self.size = size
+        self.mtime = mtime
+        self.content_type = content_type
+        self.etag = etag
+        self.path = path
+        self.stream = stream
+        self.encoding = encoding
+        self.encoded = encoded
+
+
+class StorageBackend:
+    """Where file contents and the names pointing at them are kept.
+
+    Contents are objects addressed by SHA-256. A name lives in a location
+    (uploads or trash) and refers to one object. Methods that look up a name
+    raise FileNotFoundError when it is missing. Reference counting and locking
+    are left to the caller.
+    """
+
+    # True when stage() has to read the content once before it can be stored,
+    # so callers holding a non-seekable stream should pass sha256 and size in.
+    hashes_before_upload = False
+
+    def stage(self, stream, content_type=None, sha256=None, size=None):
+        raise NotImplementedError
+
+    def commit(self, staged):
+        """Store the staged content unless an object with its hash already exists."""
+        raise NotImplementedError
+
+    def discard(self, staged):
+        pass
+
+    def delete_object(self, sha256):
+        raise NotImplementedError
+
+    def open_object(self, sha256):
+        """Return a readable stream over an object's bytes."""
+        raise NotImplementedError
+
+    def object_copies(self, sha256):
+        """Each copy of an object that can be verified and replaced on its own."""
+        return [None]
+
+    def open_copy(self, sha256, copy):
+        return self.open_object(sha256)
+
+    def replace_copy(self, sha256, copy, stream, size):
+        """Overwrite one copy of an object with bytes known to match its hash."""
+        raise NotImplementedError
+
+    def recompress(self, sha256, level):
+        """Compress a compressed object again at level; returns its new stored size, or None if it is not compressed."""
+        return None
+
+    def link(self, location, name, sha256, size, content_type=None):
+        """Point a name at an object, replacing any existing name; returns the new mtime."""
+        raise NotImplementedError
+
+    def move(self, src_location, name, dest_location, new_name=None):
+        """Move a name; returns its new mtime, or None if it is unchanged."""
+        raise NotImplementedError
+
+    def exists(self, location, name):
+        raise NotImplementedError
+
+    def remove(self, location, name):
+        raise NotImplementedError
+
+    def remove_many(self, location, names):
+        # Names that are already gone are skipped.
+        for name in names:
+            try:
+                self.remove(location, name)
+            except FileNotFoundError:
+                pass
+
+    def scan(self, location):
+        """Yield (name, size, mtime, sha256) for every name; sha256 may be None."""
+        raise NotImplementedError
+
+    def identify(self, location, name):
+        """Return (sha256, size, stored) for a name; stored is False if it is not in the object store yet."""
+        raise NotImplementedError
+
+    def adopt(self, location, name, sha256, size):
+        """Move a name that is not in the object store yet into it."""
+        raise NotImplementedError
+
+    def open(self, name, sha256=None):
+        """Return a Download for uploads/<name>, or None if there is no such file."""
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """Folders on disk; names are hard links into the objects folder.
+
+    A compressed object cannot be hard linked as the file it stands for, so
+    names of compressed objects are pointer files under names_folder instead.
+    """
+
+    def __init__(self, upload_folder, trash_folder, objects_folder, names_folder=None, compression=None):
+        self.folders = {UPLOADS: upload_folder, TRASH: trash_folder}
+        self.objects = LocalObjects(objects_folder)
+        self.names = PointerFiles({
+            UPLOADS: os.path.join(names_folder, UPLOADS),
+            TRASH: os.path.join(names_folder, TRASH),
+        }) if names_folder else None
+        self.compression = compression or CompressionTier()
+
+    def path(self, location, name):
+        return os.path.join(self.folders[location], name)
+
+    def _encoded(self, sha256):
+        # (codec, path) of the object's compressed file, or None.
+        for codec in self.compression.codecs:
+            path = self.objects.path(sha256) + SUFFIXES[codec]
+            if os.path.exists(path):
+                return codec, path
+        return None
+
+    def _has_pointer(self, location, name):
+        return self.names is not None and os.path.exists(self.names.path(location, name))
+
+    def _remove_quietly(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _compress_to(self, src, path, level=None):
+        temp_path = self.objects.temp_path()
+        try:
+            with open(temp_path, 'wb') as out:
+                stored_size = self.compression.compress(src, out, level)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return stored_size
+
+    def stage(self, stream, content_type=None, sha256=None, size=None):
+        # Hash while writing so the checksum costs no extra read of the file.
+        temp_path = self.objects.temp_path()
+        reader = HashingReader(stream)
+        try:
+            with open(temp_path, 'wb') as out:
+                shutil.copyfileobj(reader, out, COPY_BUFFER)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        return Staged(reader.sha256.hexdigest(), reader.bytes_read, temp_path, content_type)
+
+    def commit(self, staged):
+        if os.path.exists(self.objects.path(staged.sha256)) or self._encoded(staged.sha256):
+            return
+        if self.names is not None:
+            with open(staged.source, 'rb') as src:
+                if self.compression.worth_compressing_stream(staged.content_type, staged.size, src):
+                    codec = self.compression.codec
+                    stored_size = self._compress_to(src, self.objects.path(staged.sha256) + SUFFIXES[codec])
+                    staged.encoding = (codec, self.compression.level, stored_size)
+                    return
+        self.objects.place(staged.source, staged.sha256)
+
+    def discard(self, staged):
+        if os.path.exists(staged.source):
+            os.remove(staged.source)
+
+    def delete_object(self, sha256):
+        self.objects.delete(sha256)
+        for suffix in SUFFIXES.values():
+            self._remove_quietly(self.objects.path(sha256) + suffix)
+
+    def open_object(self, sha256):
+        try:
+            return open(self.objects.path(sha256), 'rb')
+        except FileNotFoundError:
+            encoded = self._encoded(sha256)
+            if encoded is None:
+                raise
+            codec, path = encoded
+            return self.compression.decompress(open(path, 'rb'), codec)
+
+    def replace_copy(self, sha256, copy, stream, size):
+        encoded = self._encoded(sha256)
+        if encoded is not None and encoded[0] == self.compression.codec:
+            self._compress_to(stream, encoded[1])
+            return
+        # Raw objects are found before compressed ones, so a copy this tier
+        # cannot write again is replaced by the raw bytes.
+        self.objects.rewrite(sha256, stream)
+        if encoded is not None:
+            os.remove(encoded[1])
+
+    def recompress(self, sha256, level):
+        encoded = self._encoded(sha256)
+        if encoded is None or encoded[0] != self.compression.codec:
+            return None
+        codec, path = encoded
+        # Readers that already opened the old file keep it until they close it.
+        with self.compression.decompress(open(path, 'rb'), codec) as src:
+            return self._compress_to(src, path, level)
+
+    def link(self, location, name, sha256, size, content_type=None):
+        path = self.path(location, name)
+        if self.names is not None and not os.path.exists(self.objects.path(sha256)) and self._encoded(sha256):
+            mtime = self.names.write(location, name, sha256, size, content_type)
+            self._remove_quietly(path)
+            return mtime
+        self.objects.link(sha256, path)
+        if self.names is not None:
+            self._remove_quietly(self.names.path(location, name))
+        # A hard link shares the object's inode and so its mtime, which is
+        # when the content was first stored; the name's own time is now.
+        return time.time()
+
+    def move(self, src_location, name, dest_location, new_name=None):
+        dest_name = new_name or name
+        src_path = self.path(src_location, name)
+        if os.path.exists(src_path):
+            shutil.move(src_path, self.path(dest_location, dest_name))
+            if self.names is not None:
+                self._remove_quietly(self.names.path(dest_location, dest_name))
+            return None
+        if self._has_pointer(src_location, name):
+            os.replace(self.names.path(src_location, name), self.names.path(dest_location, dest_name))
+            self._remove_quietly(self.path(dest_location, dest_name))
+            return None
+        raise FileNotFoundError(src_path)
+
+    def exists(self, location, name):
+        return os.path.exists(self.path(location, name)) or self._has_pointer(location, name)
+
+    def remove(self, location, name):
+        try:
+            os.remove(self.path(location, name))
+        except FileNotFoundError:
+            if self.names is None:
+                raise
+            os.remove(self.names.path(location, name))
+
+    def scan(self, location):
+        yield from scan_directory(self.folders[location])
+        if self.names is not None:
+            yield from self.names.scan(location)
+
+    def identify(self, location, name):
+        if self._has_pointer(location, name):
+            pointer = self.names.read(location, name)
+            return pointer['sha256'], pointer['size'], True
+        path = self.path(location, name)
+        with open(path, 'rb') as f:
+            sha256, size = hash_stream(f)
+        object_path = self.objects.path(sha256)
+        return sha256, size, os.path.exists(object_path) and os.path.samefile(path, object_path)
+
+    def adopt(self, location, name, sha256, size):
+        self.objects.adopt(self.path(location, name), sha256)
+
+    def open(self, name, sha256=None):
+        path = self.path(UPLOADS, name)
+        if os.path.exists(path):
+            st = os.stat(path)
+            return Download(st.st_size, st.st_mtime, path=os.path.abspath(path))
+        try:
+            pointer = self.names.read(UPLOADS, name) if self.names is not None else None
+        except FileNotFoundError:
+            pointer = None
+        if pointer is None:
+            return None
+        sha256 = sha256 or pointer['sha256']
+        object_path = self.objects.path(sha256)
+        if os.path.exists(object_path):
+            return Download(pointer['size'], pointer['mtime'], content_type=pointer.get('content_type'),
+                            path=os.path.abspath(object_path))
+        encoded = self._encoded(sha256)
+        if encoded is None:
+            return None
+        codec, encoded_path = encoded
+        return Download(
+            pointer['size'],
+            pointer['mtime'],
+            content_type=pointer.get('content_type'),
+            etag=sha256,
+            stream=self.compression.decompress(open(encoded_path, 'rb'), codec),
+            encoding=codec,
+            encoded=lambda: (open(encoded_path, 'rb'), os.path.getsize(encoded_path)),
+        )
+
+
+class ReplicatedStorage(StorageBackend):
+    """Objects spread over storage nodes by a Cluster; names are pointer files on local disk.
+
+    Uploads are spooled to a local file while they are hashed, since each
+    replica is sent its own copy of the bytes.
+    """
+
+    def __init__(self, cluster, upload_folder, trash_folder, spool_folder, chunk_size=1024 * 1024):
+        self.cluster = cluster
+        self.names = PointerFiles({UPLOADS: upload_folder, TRASH: trash_folder})
+        self.spool = LocalObjects(spool_folder)
+        self.chunk_size = chunk_size
+
+    def stage(self, stream, content_type=None, sha256=None, size=None):
+        temp_path = self.spool.temp_path()
+        reader = HashingReader(stream)
+        try:
+            with open(temp_path, 'wb') as out:
+                shutil.copyfileobj(reader, out, COPY_BUFFER)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        return Staged(reader.sha256.hexdigest(), reader.bytes_read, temp_path, content_type)
+
+    def commit(self, staged):
+        self.cluster.write(staged.sha256, lambda: open(staged.source, 'rb'), staged.size)
+
+    def discard(self, staged):
+        if os.path.exists(staged.source):
+            os.remove(staged.source)
+
+    def delete_object(self, sha256):
+        self.cluster.delete(sha256)
+
+    def open_object(self, sha256):
+        return self.cluster.open(sha256, buffer_size=self.chunk_size)
+
+    def object_copies(self, sha256):
+        # The live owners; a missing copy there is as much a fault as a bad one.
+        return self.cluster.owners(sha256)
+
+    def open_copy(self, sha256, copy):
+        response = self.cluster.nodes[copy].open(sha256)
+        if response is None:
+            raise FileNotFoundError(f"{copy}/{object_key(sha256)}")
+        response.raw.decode_content = True
+        return response.raw
+
+    def replace_copy(self, sha256, copy, stream, size):
+        # Nodes keep whatever they already hold under a hash, so the bad copy goes first.
+        node = self.cluster.nodes[copy]
+        node.delete(sha256)
+        node.put(sha256, stream, size)
+
+    def link(self, location, name, sha256, size, content_type=None):
+        return self.names.write(location, name, sha256, size, content_type)
+
+    def move(self, src_location, name, dest_location, new_name=None):
+        os.replace(self.names.path(src_location, name), self.names.path(dest_location, new_name or name))
+        return None
+
+    def exists(self, location, name):
+        return os.path.exists(self.names.path(location, name))
+
+    def remove(self, location, name):
+        os.remove(self.names.path(location, name))
+
+    def scan(self, location):
+        return self.names.scan(location)
+
+    def identify(self, location, name):
+        pointer = self.names.read(location, name)
+        return pointer['sha256'], pointer['size'], True
+
+    def adopt(self, location, name, sha256, size):
+        pass
+
+    def open(self, name, sha256=None):
+        try:
+            pointer = self.names.read(UPLOADS, name)
+        except FileNotFoundError:
+            return None
+        sha256 = sha256 or pointer['sha256']
+        return Download(
+            pointer['size'],
+            pointer['mtime'],
+            content_type=pointer.get('content_type'),
+            etag=sha256,
+            stream=self.cluster.open(sha256, pointer['size'], buffer_size=self.chunk_size),
+        )
+
+
+class MemoryStorage(StorageBackend):
+    """Everything in process memory, so the API can be tested and benchmarked offline."""
+
+    def __init__(self, compression=None):
+        self._objects = {}
+        # Compressed objects as (codec, bytes).
+        self._encoded = {}
+        self._names = {UPLOADS: {}, TRASH: {}}
+        self._lock = threading.Lock()
+        self.compression = compression or CompressionTier()
+
+    def stage(self, stream, content_type=None, sha256=None, size=None):
+        data = stream.read()
+        return Staged(hashlib.sha256(data).hexdigest(), len(data), data, content_type)
+
+    def _compressed(self, data, level=None):
+        out = io.BytesIO()
+        self.compression.compress(io.BytesIO(data), out, level)
+        return self.compression.codec, out.getvalue()
+
+    def commit(self, staged):
+        if staged.sha256 in self._objects or staged.sha256 in self._encoded:
+            return
+        if self.compression.worth_compressing(staged.content_type, staged.size, staged.source[:SAMPLE_BYTES]):
+            codec, data = self._compressed(staged.source)
+            with self._lock:
+                self._encoded.setdefault(staged.sha256, (codec, data))
+            staged.encoding = (codec, self.compression.level, len(data))
+            return
+        with self._lock:
+            self._objects.setdefault(staged.sha256, staged.source)
+
+    def delete_object(self, sha256):
+        with self._lock:
+            self._objects.pop(sha256, None)
+            self._encoded.pop(sha256, None)
+
+    def open_object(self, sha256):
+        if sha256 in self._objects:
+            return io.BytesIO(self._objects[sha256])
+        try:
+            codec, data = self._encoded[sha256]
+        except KeyError:
+            raise FileNotFoundError(object_key(sha256))
+        return self.compression.decompress(io.BytesIO(data), codec)
+
+    def replace_copy(self, sha256, copy, stream, size):
+        with self._lock:
+            if sha256 in self._encoded and self.compression.enabled:
+                self._encoded[sha256] = self._compressed(stream.read())
+            else:
+                self._encoded.pop(sha256, None)
+                self._objects[sha256] = stream.read()
+
+    def recompress(self, sha256, level):
+        entry = self._encoded.get(sha256)
+        if entry is None or entry[0] != self.compression.codec:
+            return None
+        with self.compression.decompress(io.BytesIO(entry[1]), entry[0]) as src:
+            entry = self._compressed(src.read(), level)
+        with self._lock:
+            self._encoded[sha256] = entry
+        return len(entry[1])
+
+    def link(self, location, name, sha256, size, content_type=None):
+        mtime = time.time()
+        with self._lock:
+            self._names[location][name] = (sha256, size, mtime, content_type)
+        return mtime
+
+    def move(self, src_location, name, dest_location, new_name=None):
+        with self._lock:
+            try:
+                entry = self._names[src_location].pop(name)
+            except KeyError:
+                raise FileNotFoundError(f"{src_location}/{name}")
+            self._names[dest_location][new_name or name] = entry
+        return None
+
+    def exists(self, location, name):
+        return name in self._names[location]
+
+    def remove(self, location, name):
+        with self._lock:
+            try:
+                del self._names[location][name]
+            except KeyError:
+                raise FileNotFoundError(f"{location}/{name}")
+
+    def scan(self, location):
+        with self._lock:
+            entries = list(self._names[location].items())
+        return [(name, size, mtime, sha256) for name, (sha256, size, mtime, _) in entries]
+
+    def identify(self, location, name):
+        try:
+            sha256, size, _, _ = self._names[location][name]
+        except KeyError:
+            raise FileNotFoundError(f"{location}/{name}")
+        return sha256, size, True
+
+    def adopt(self, location, name, sha256, size):
+        pass
+
+    def open(self, name, sha256=None):
+        entry = self._names[UPLOADS].get(name)
+        if entry is None:
+            return None
+        sha256, size, mtime, content_type = entry
+        if sha256 in self._objects:
+            return Download(size, mtime, content_type=content_type, stream=io.BytesIO(self._objects[sha256]))
+        if sha256 not in self._encoded:
+            return None
+        codec, data = self._encoded[sha256]
+        return Download(
+            size,
+            mtime,
+            content_type=content_type,
+            etag=sha256,
+            stream=self.compression.decompress(io.BytesIO(data), codec),
+            encoding=codec,
+            encoded=lambda: (io.BytesIO(data), len(data)),
+        )
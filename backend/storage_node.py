@@ -0,0 +1,94 @@
+"""A storage node: keeps content-addressed objects in one folder and serves them over HTTP.
+
+Start a few on localhost and point the backend at them:
+
+    python storage_node.py --port 9101 --data nodes/9101
+    python storage_node.py --port 9102 --data nodes/9102
+    python storage_node.py --port 9103 --data nodes/9103
+    STORAGE_BACKEND=replicated STORAGE_NODES=127.0.0.1:9101,127.0.0.1:9102,127.0.0.1:9103 flask --app backend.py run
+"""
+import os
+import re
+import shutil
+import logging
+import argparse
+from flask import Flask, Response, jsonify, request, send_file
+from chunked_uploads import HashingReader, COPY_BUFFER
+from content_store import LocalObjects
+
+SHA256 = re.compile(r'[0-9a-f]{64}')
+
+
+def create_app(data_folder):
+    app = Flask(__name__)
+    objects = LocalObjects(data_folder)
+
+    def object_path(sha256):
+        if not SHA256.fullmatch(sha256):
+            return None
+        return objects.path(sha256)
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        usage = shutil.disk_usage(data_folder)
+        return jsonify({"status": "ok", "free_bytes": usage.free, "total_bytes": usage.total}), 200
+
+    @app.route('/objects', methods=['GET'])
+    def list_objects():
+        def generate():
+            for prefix in os.scandir(data_folder):
+                if prefix.is_dir():
+                    for entry in os.scandir(prefix.path):
+                        yield entry.name + '\n'
+        return Response(generate(), mimetype='text/plain')
+
+    @app.route('/objects/<sha256>', methods=['GET'])
+    def get_object(sha256):
+        path = object_path(sha256)
+        if path is None or not os.path.exists(path):
+            return jsonify({"error": "Object not found"}), 404
+        return send_file(os.path.abspath(path), mimetype='application/octet-stream', etag=sha256, conditional=True)
+
+    @app.route('/objects/<sha256>', methods=['PUT'])
+    def put_object(sha256):
+        path = object_path(sha256)
+        if path is None:
+            return jsonify({"error": "Not a SHA-256"}), 400
+        if os.path.exists(path):
+            return jsonify({"message": "Already stored"}), 200
+        # The hash is checked before the object becomes visible, so a
+        # truncated or corrupted transfer never replaces good data.
+        temp_path = objects.temp_path()
+        reader = HashingReader(request.stream)
+        try:
+            with open(temp_path, 'wb') as out:
+                shutil.copyfileobj(reader, out, COPY_BUFFER)
+            if reader.sha256.hexdigest() != sha256:
+                os.remove(temp_path)
+                return jsonify({"error": "Content does not match its SHA-256"}), 400
+            objects.place(temp_path, sha256)
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            logging.error(f"Error storing object {sha256}: {e}")
+            return jsonify({"error": f"Failed to store object: {str(e)}"}), 500
+        return jsonify({"message": "Stored"}), 201
+
+    @app.route('/objects/<sha256>', methods=['DELETE'])
+    def delete_object(sha256):
+        if object_path(sha256) is None:
+            return jsonify({"error": "Not a SHA-256"}), 400
+        objects.delete(sha256)
+        return '', 204
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9101)
+    parser.add_argument('--data', default=None, help="Folder for the objects (default nodes/<port>)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    create_app(args.data or os.path.join('nodes', str(args.port))).run(host=args.host, port=args.port, threaded=True)
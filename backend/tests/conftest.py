@@ -0,0 +1,45 @@
+import os
+import sys
+import uuid
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# backend.py and its modules import each other by bare name.
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope='session')
+def backend(tmp_path_factory):
+    # backend.py reads its settings from the environment and keeps its folders
+    # relative to the working directory, so both are set before the import.
+    folder = tmp_path_factory.mktemp('app')
+    os.environ.update(
+        STORAGE_BACKEND='memory',
+        BACKGROUND_JOBS='0',
+        LOG_LEVEL='WARNING',
+        CATALOG_PATH=str(folder / 'catalog.db'),
+        STAGING_FOLDER=str(folder / 'staging'),
+    )
+    os.chdir(folder)
+    import backend
+    backend.start_services()
+    backend.reconciled.wait()
+    return backend
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
+
+
+@pytest.fixture
+def name():
+    # The app and its catalog live for the whole session, so every test
+    # works on names of its own.
+    return f'{uuid.uuid4().hex[:12]}.txt'
+
+
+def create(client, filename, content):
+    response = client.post('/create-file', json={"filename": filename, "content": content})
+    assert response.status_code == 201, response.get_json()
+    return response
@@ -0,0 +1,64 @@
+import io
+import json
+import zipfile
+import tarfile
+import pytest
+from conftest import create
+
+
+@pytest.mark.parametrize('fmt', ['zip', 'tar'])
+def test_round_trip(client, backend, name, fmt):
+    trashed = 'trashed-' + name
+    create(client, name, 'kept')
+    create(client, trashed, 'deleted')
+    client.delete(f'/delete/{trashed}')
+    deleted_at = backend.catalog.get('trash', trashed)["deleted_at"]
+
+    response = client.post('/export', json={"format": fmt, "location": "all", "search": name})
+    assert response.status_code == 200
+    archive = response.data
+    client.delete(f'/delete/{name}')
+    for filename in (name, trashed):
+        client.delete(f'/delete-permanent/{filename}')
+
+    body = client.post(f'/import?format={fmt}', data=archive).get_json()
+    assert body["failed"] == 0
+    assert client.get(f'/download/{name}').data == b'kept'
+    assert backend.catalog.get('trash', trashed)["deleted_at"] == deleted_at
+
+
+def zip_of(files, manifest=None):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as archive:
+        if manifest is not None:
+            archive.writestr('manifest.json', json.dumps(manifest))
+        for path, data in files.items():
+            archive.writestr(path, data)
+    return out.getvalue()
+
+
+def test_paths_outside_the_folders_are_rejected(client, backend, name):
+    body = client.post('/import?format=zip', data=zip_of({f'../{name}': b'x', f'a/b/{name}': b'x'})).get_json()
+    assert body["failed"] == 2
+    assert backend.catalog.get('uploads', name) is None
+
+
+def test_content_must_match_the_manifest(client, backend, name):
+    manifest = {"files": [{"path": f'uploads/{name}', "size": 4, "sha256": '0' * 64}]}
+    body = client.post('/import?format=zip', data=zip_of({f'uploads/{name}': b'evil'}, manifest)).get_json()
+    assert [result["code"] for result in body["results"]] == [422]
+    assert backend.catalog.get('uploads', name) is None
+
+
+def test_truncated_tar_keeps_what_came_before(client, name):
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w') as archive:
+        for index in range(2):
+            data = b'x' * 10000
+            info = tarfile.TarInfo(f'{index}-{name}')
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    response = client.post('/import?format=tar', data=out.getvalue()[:12000])
+    assert response.status_code == 400
+    results = response.get_json()["results"]
+    assert [result["name"] for result in results if result["ok"]] == [f'0-{name}']
@@ -0,0 +1,24 @@
+from conftest import create
+
+
+def test_unchanged_listing_revalidates(client, name):
+    response = client.get('/files')
+    etag = response.headers['ETag']
+    assert client.get('/files', headers={'If-None-Match': etag}).status_code == 304
+    create(client, name, 'x')
+    assert client.get('/files', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_changes_since_a_listing(client, name):
+    since = int(client.get('/files').headers['X-Change-Seq'])
+    create(client, name, 'x')
+    client.delete(f'/delete/{name}')
+    body = client.get(f'/changes?since={since}').get_json()
+    ops = {(change["location"], change["name"]): change["op"] for change in body["changes"]}
+    assert ops == {('uploads', name): 'delete', ('trash', name): 'put'}
+    assert client.get(f'/changes?since={body["next"]}').get_json()["changes"] == []
+
+
+def test_changes_need_a_known_position(client):
+    assert client.get('/changes').status_code == 400
+    assert client.get('/changes?since=999999999').status_code == 410
@@ -0,0 +1,49 @@
+import hashlib
+import pytest
+
+CHUNK = 256 * 1024
+
+
+def start(client, filename, size):
+    response = client.post('/uploads', json={"filename": filename, "size": size, "chunk_size": CHUNK})
+    assert response.status_code == 201
+    return response.get_json()["upload_id"]
+
+
+def test_resumed_upload(client, name):
+    data = bytes(range(256)) * 2048
+    upload_id = start(client, name, len(data))
+    assert client.put(f'/uploads/{upload_id}/chunks/1', data=data[CHUNK:]).status_code == 200
+    assert client.get(f'/uploads/{upload_id}').get_json()["missing"] == [0]
+
+    assert client.put(f'/uploads/{upload_id}/chunks/0', data=data[:CHUNK]).status_code == 200
+    response = client.post(f'/uploads/{upload_id}/complete', json={"sha256": hashlib.sha256(data).hexdigest()})
+    assert response.status_code == 201
+    assert client.get(f'/download/{name}').data == data
+
+
+def test_chunk_checksum_mismatch(client, name):
+    upload_id = start(client, name, 3)
+    response = client.put(f'/uploads/{upload_id}/chunks/0', data=b'abc', headers={'X-Chunk-SHA256': '0' * 64})
+    assert response.status_code == 422
+    assert client.get(f'/uploads/{upload_id}').get_json()["missing"] == [0]
+
+
+def test_file_checksum_mismatch_stores_nothing(client, backend, name):
+    upload_id = start(client, name, 3)
+    client.put(f'/uploads/{upload_id}/chunks/0', data=b'abc')
+    response = client.post(f'/uploads/{upload_id}/complete', json={"sha256": '0' * 64})
+    assert response.status_code == 422
+    assert backend.catalog.get('uploads', name) is None
+    assert client.get(f'/uploads/{upload_id}').status_code == 404
+
+
+@pytest.mark.parametrize('body', [
+    {"filename": "../escape.txt", "size": 3},
+    {"filename": "a/b.txt", "size": 3},
+    {"filename": "ok.txt", "size": "3"},
+    {"filename": "ok.txt", "size": -1},
+    {"filename": "ok.txt", "size": 3, "chunk_size": "big"},
+])
+def test_invalid_sessions_are_rejected(client, body):
+    assert client.post('/uploads', json=body).status_code == 400
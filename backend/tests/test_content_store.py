@@ -0,0 +1,94 @@
+import io
+import time
+import hashlib
+import threading
+import pytest
+from conftest import create
+from content_store import ObjectLocks
+from storage_backends import LocalStorage
+
+
+def sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def object_exists(backend, digest):
+    try:
+        backend.store.open_object(digest).close()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def test_identical_content_is_stored_once(client, backend, name):
+    content = f'shared {name}'
+    digest = sha256(content)
+    first, second = 'a-' + name, 'b-' + name
+    create(client, first, content)
+    create(client, second, content)
+    assert backend.catalog.refcount(digest) == 2
+
+    for filename in (first, second):
+        assert client.delete(f'/delete/{filename}').status_code == 200
+    assert client.delete(f'/delete-permanent/{first}').status_code == 200
+    assert object_exists(backend, digest)
+    assert client.delete(f'/delete-permanent/{second}').status_code == 200
+    assert backend.catalog.refcount(digest) == 0
+    assert not object_exists(backend, digest)
+
+
+def test_empty_trash_releases_objects(client, backend, name):
+    names = [f'{i}-{name}' for i in range(3)]
+    for filename in names:
+        create(client, filename, filename)
+        client.delete(f'/delete/{filename}')
+    response = client.post('/batch', json={"operations": [{"op": "purge", "name": n} for n in names]})
+    assert response.get_json()["succeeded"] == 3
+    assert not any(object_exists(backend, sha256(filename)) for filename in names)
+
+
+def test_purge_keeps_a_file_deleted_under_the_same_name(client, backend, name):
+    # The purge holds the name lock, so a newer deletion cannot slip in
+    # between its lookup and its removal.
+    create(client, name, 'old')
+    client.delete(f'/delete/{name}')
+    with backend.name_locks(name):
+        purge = threading.Thread(target=backend.purge_many, args=([{"name": name}],))
+        purge.start()
+        time.sleep(0.1)
+        assert backend.catalog.get('trash', name) is not None
+    purge.join()
+    create(client, name, 'new')
+    client.delete(f'/delete/{name}')
+    assert backend.catalog.get('trash', name)["sha256"] == sha256('new')
+    assert object_exists(backend, sha256('new'))
+    assert not object_exists(backend, sha256('old'))
+
+
+def test_locking_overlapping_sets_does_not_deadlock():
+    locks = ObjectLocks(stripes=4)
+    keys = [f'key-{i}' for i in range(16)]
+
+    def lock_many(ordered):
+        for _ in range(200):
+            with locks.many(ordered):
+                pass
+
+    threads = [threading.Thread(target=lock_many, args=(order,)) for order in (keys, keys[::-1])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_linked_name_gets_its_own_time(tmp_path):
+    store = LocalStorage(str(tmp_path / 'uploads'), str(tmp_path / 'trash'), str(tmp_path / 'objects'))
+    for folder in ('uploads', 'trash'):
+        (tmp_path / folder).mkdir()
+    staged = store.stage(io.BytesIO(b'same'))
+    store.commit(staged)
+    first = store.link('uploads', 'a.txt', staged.sha256, staged.size)
+    time.sleep(0.05)
+    second = store.link('uploads', 'b.txt', staged.sha256, staged.size)
+    assert second > first
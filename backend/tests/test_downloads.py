@@ -0,0 +1,23 @@
+import hashlib
+from conftest import create
+
+
+def test_range_and_conditional_requests(client, name):
+    create(client, name, '0123456789')
+    etag = f'"{hashlib.sha256(b"0123456789").hexdigest()}"'
+
+    response = client.get(f'/download/{name}')
+    assert response.data == b'0123456789'
+    assert response.headers['ETag'] == etag
+
+    partial = client.get(f'/download/{name}', headers={'Range': 'bytes=2-5'})
+    assert partial.status_code == 206
+    assert partial.data == b'2345'
+    assert partial.headers['Content-Range'] == 'bytes 2-5/10'
+
+    assert client.get(f'/download/{name}', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f'/download/{name}', headers={'Range': 'bytes=20-30'}).status_code == 416
+
+
+def test_missing_file(client, name):
+    assert client.get(f'/download/{name}').status_code == 404
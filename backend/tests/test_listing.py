@@ -0,0 +1,33 @@
+import json
+from conftest import create
+
+
+def test_pages_follow_the_cursor(client, name):
+    prefix = name[:8]
+    names = [f'{prefix}-{i:02d}.txt' for i in range(7)]
+    for filename in names:
+        create(client, filename, filename)
+
+    seen = []
+    cursor = None
+    while True:
+        query = f'/files?search={prefix}&limit=3' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(query)
+        assert response.status_code == 200
+        seen += [entry["name"] for entry in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert seen == names
+
+
+def test_bad_limit_and_cursor_are_rejected(client):
+    assert client.get('/files?limit=0').status_code == 400
+    assert client.get('/files?limit=10&cursor=not-a-cursor').status_code == 400
+
+
+def test_ndjson_listing(client, name):
+    create(client, name, 'x')
+    response = client.get(f'/files?search={name}&format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)["name"] for line in response.data.decode().splitlines()] == [name]
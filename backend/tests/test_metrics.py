@@ -0,0 +1,19 @@
+from conftest import create
+from metrics import Tracer
+
+
+def test_requests_and_storage_calls_are_counted(client, name):
+    create(client, name, 'x')
+    client.get(f'/download/{name}')
+    text = client.get('/metrics').data.decode()
+    assert 'http_requests_total{method="GET",route="/download/<filename>",status="200"}' in text
+    assert 'storage_operations_total{backend="memory",operation="open",outcome="ok"}' in text
+
+
+def test_unsampled_request_does_not_inherit_a_trace():
+    tracer = Tracer(sample_rate=1)
+    # A streamed response that is never closed leaves its trace behind.
+    assert tracer.begin('GET', '/files') is not None
+    tracer.sample_rate = 0
+    assert tracer.begin('GET', '/files') is None
+    assert tracer.current is None
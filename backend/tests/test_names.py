@@ -0,0 +1,37 @@
+import io
+import pytest
+from conftest import create
+
+
+@pytest.mark.parametrize('bad', ['../escape.txt', '..', 'a/b.txt', 'a\\b.txt'])
+def test_names_outside_the_folders_are_rejected(client, name, bad):
+    create(client, name, 'x')
+    assert client.post('/create-file', json={"filename": bad, "content": "x"}).status_code == 400
+    assert client.put('/rename', json={"old_name": name, "new_name": bad}).status_code == 400
+    response = client.post('/batch', json={"operations": [{"op": "rename", "name": name, "new_name": bad}]})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('bad', ['../escape.txt', '..'])
+def test_uploaded_names_outside_the_folders_are_rejected(client, bad):
+    assert client.post('/upload', data={"file": (io.BytesIO(b'x'), bad)}).status_code == 400
+
+
+def test_rename_does_not_replace_an_existing_file(client, name):
+    other = 'other-' + name
+    create(client, name, 'first')
+    create(client, other, 'second')
+    assert client.put('/rename', json={"old_name": name, "new_name": other}).status_code == 409
+    assert client.get(f'/download/{other}').data == b'second'
+
+
+def test_batch(client, name):
+    renamed = 'renamed-' + name
+    create(client, name, 'x')
+    response = client.post('/batch', json={"operations": [
+        {"op": "rename", "name": name, "new_name": renamed},
+        {"op": "delete", "name": 'missing-' + name},
+    ]})
+    body = response.get_json()
+    assert (body["succeeded"], body["failed"]) == (1, 1)
+    assert client.get(f'/download/{renamed}').status_code == 200
@@ -0,0 +1,10 @@
+from conftest import create
+
+
+def test_search_finds_names_and_contents(client, backend, name):
+    word = 'zq' + name[:8]
+    create(client, name, f'notes about {word} and more')
+    backend.indexer.index(backend.catalog.get('uploads', name)["sha256"])
+    results = client.get(f'/search?q={word}').get_json()
+    assert [result["name"] for result in results] == [name]
+    assert client.get('/search?location=elsewhere').status_code == 400
@@ -0,0 +1,24 @@
+from conftest import create
+
+
+def test_overwrite_keeps_a_version_that_can_be_restored(client, name):
+    first = ''.join(f'line {i}\n' for i in range(200))
+    second = first.replace('line 100\n', 'changed\n')
+    create(client, name, first)
+    create(client, name, second)
+
+    versions = client.get(f'/versions/{name}').get_json()
+    assert [v["version"] for v in versions] == [1]
+    assert client.get(f'/versions/{name}/1').data == first.encode()
+
+    diff = client.get(f'/versions/{name}/1/diff').data.decode()
+    assert '-line 100' in diff and '+changed' in diff
+
+    assert client.post(f'/versions/{name}/1/restore').status_code == 200
+    assert client.get(f'/download/{name}').data == first.encode()
+    assert len(client.get(f'/versions/{name}').get_json()) == 2
+
+
+def test_unknown_version(client, name):
+    create(client, name, 'x')
+    assert client.get(f'/versions/{name}/9').status_code == 404
@@ -0,0 +1,190 @@
+import io
+import zlib
+import struct
+import hashlib
+import logging
+
+# On average one line in four ends a chunk.
+BOUNDARY_MASK = 3
+MAX_CHUNK = 8 * 1024
+_MAGIC = b'FRD1'
+_COPY = b'C'
+_LITERAL = b'L'
+
+
+def _chunks(data):
+    # Content-defined chunks: a chunk ends after a line whose CRC has its low
+    # bits clear, so boundaries depend only on the line itself. After an
+    # insertion both sides soon cut at the same line and matching resumes.
+    # Newlines are frequent enough in binary data to act as boundaries there
+    # too; MAX_CHUNK caps runs without one.
+    start = 0
+    n = len(data)
+    line_start = 0
+    while line_start < n:
+        end = data.find(b'\n', line_start)
+        end = n if end == -1 else end + 1
+        if end - start >= MAX_CHUNK:
+            end = start + MAX_CHUNK
+        elif end < n and zlib.crc32(data[line_start:end]) & BOUNDARY_MASK:
+            line_start = end
+            continue
+        yield start, end
+        start = line_start = end
+
+
+def _digest(chunk):
+    return hashlib.blake2b(chunk, digest_size=16).digest()
+
+
+def make_delta(base, target):
+    """Encode target as copies from base plus literal bytes, zlib-compressed."""
+    index = {}
+    for start, end in _chunks(base):
+        index.setdefault(_digest(base[start:end]), start)
+
+    out = bytearray(_MAGIC)
+    literal = bytearray()
+    copy_offset = copy_length = 0
+
+    def flush_copy():
+        if copy_length:
+            out.extend(_COPY + struct.pack('>QI', copy_offset, copy_length))
+
+    def flush_literal():
+        if literal:
+            out.extend(_LITERAL + struct.pack('>I', len(literal)) + literal)
+            literal.clear()
+
+    for start, end in _chunks(target):
+        offset = index.get(_digest(target[start:end]))
+        if offset is None:
+            flush_copy()
+            copy_length = 0
+            literal.extend(target[start:end])
+            continue
+        flush_literal()
+        if copy_length and copy_offset + copy_length == offset:
+            copy_length += end - start
+        else:
+            flush_copy()
+            copy_offset, copy_length = offset, end - start
+    flush_copy()
+    flush_literal()
+    return zlib.compress(bytes(out), 6)
+
+
+def apply_delta(base, delta):
+    data = zlib.decompress(delta)
+    if data[:4] != _MAGIC:
+        raise ValueError("Not a version delta")
+    out = bytearray()
+    pos = 4
+    while pos < len(data):
+        op = data[pos:pos + 1]
+        if op == _COPY:
+            offset, length = struct.unpack_from('>QI', data, pos + 1)
+            out.extend(base[offset:offset + length])
+            pos += 13
+        elif op == _LITERAL:
+            (length,) = struct.unpack_from('>I', data, pos + 1)
+            out.extend(data[pos + 5:pos + 5 + length])
+            pos += 5 + length
+        else:
+            raise ValueError("Corrupt version delta")
+    return bytes(out)
+
+
+class VersionHistory:
+    """Earlier contents of each file name, kept when the name is overwritten.
+
+    A version is either a full snapshot, which keeps its content object alive,
+    or a compressed delta against the content that replaced it. Every
+    snapshot_interval-th version is a full snapshot, so rebuilding any version
+    applies fewer than snapshot_interval deltas.
+    """
+
+    def __init__(self, catalog, store, object_locks, release, snapshot_interval=8,
+                 max_versions=50, delta_max_bytes=16 * 1024 * 1024):
+        self.catalog = catalog
+        self.store = store
+        self.object_locks = object_locks
+        self.release = release
+        self.snapshot_interval = snapshot_interval
+        self.max_versions = max_versions
+        self.delta_max_bytes = delta_max_bytes
+
+    def _read_object(self, sha256):
+        with self.store.open_object(sha256) as stream:
+            return stream.read()
+
+    def content(self, name, sha256, depth=0):
+        # The bytes of one of this name's contents, from its object if it still
+        # exists, otherwise rebuilt from the newest version holding it.
+        try:
+            return self._read_object(sha256)
+        except FileNotFoundError:
+            pass
+        row = self.catalog.version_by_sha256(name, sha256)
+        if row is None or depth > self.snapshot_interval + 1:
+            raise FileNotFoundError(f"Content {sha256} of {name} is no longer stored")
+        return self.read(row, depth + 1)
+
+    def read(self, row, depth=0):
+        if row["delta_sha256"] is None:
+            return self._read_object(row["sha256"])
+        base = self.content(row["name"], row["base_sha256"], depth)
+        return apply_delta(base, self._read_object(row["delta_sha256"]))
+
+    def archive(self, name, previous, current_sha256):
+        """Keep previous (a catalog row) as a version of name before current_sha256 replaces it.
+
+        Must run before the previous content's object is released.
+        """
+        if not previous or not previous["sha256"] or previous["sha256"] == current_sha256:
+            return None
+        number = self.catalog.next_version(name)
+        delta_sha256 = None
+        if number % self.snapshot_interval and previous["size"] <= self.delta_max_bytes:
+            try:
+                delta = self._encode(previous, current_sha256)
+            except Exception as e:
+                logging.warning(f"Could not delta-encode version {number} of {name}: {e}")
+                delta = None
+            if delta is not None:
+                staged = self.store.stage(io.BytesIO(delta))
+                try:
+                    with self.object_locks(staged.sha256):
+                        self.store.commit(staged)
+                        if staged.encoding:
+                            self.catalog.put_encoding(staged.sha256, staged.size, *staged.encoding)
+                        delta_sha256 = staged.sha256
+                        self.catalog.add_version(name, number, previous, current_sha256, delta_sha256)
+                finally:
+                    self.store.discard(staged)
+        if delta_sha256 is None:
+            self.catalog.add_version(name, number, previous, current_sha256, None)
+        logging.info(f"Kept version {number} of {name} as {'a delta' if delta_sha256 else 'a full snapshot'}.")
+        self.prune(name)
+        return number
+
+    def _encode(self, previous, current_sha256):
+        # Worth storing only if it is well under half the full object.
+        base = self._read_object(current_sha256)
+        if len(base) > self.delta_max_bytes:
+            return None
+        delta = make_delta(base, self._read_object(previous["sha256"]))
+        return delta if len(delta) < previous["size"] // 2 else None
+
+    def _release_rows(self, rows):
+        for row in rows:
+            for sha256 in (row["sha256"], row["delta_sha256"], row["base_sha256"]):
+                self.release(sha256)
+
+    def prune(self, name):
+        # Dropping the oldest versions is always safe: deltas only ever point
+        # at newer content.
+        self._release_rows(self.catalog.prune_versions(name, self.max_versions))
+
+    def drop(self, name):
+        self._release_rows(self.catalog.drop_versions(name))
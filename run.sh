@@ -0,0 +1,3 @@
+#!/bin/sh
+# Serve the app in production; settings are read from backend/gunicorn.conf.py.
+cd "$(dirname "$0")/backend" && exec gunicorn -c gunicorn.conf.py backend:app